@@ -0,0 +1,257 @@
+# -*- coding: utf-8 -*-
+"""
+提醒规则 - 按发件人、域名、主题正则和关键词决定每封新邮件的提醒方式
+所有规则在加载时一次编译：发件人和域名放进字典，关键词和每个主题正则里必须出现的文字建成一个Aho-Corasick自动机，
+每封邮件只扫描一遍文字，再验证预筛命中的少数正则，所以匹配开销基本不随规则数量增长
+
+配置示例(app_config.json):
+    "rules": [
+        {"name": "老板", "from": ["boss@example.com", "@vip.example.com"], "action": "loop"},
+        {"name": "系统告警", "subject": ["告警|故障", "^\\\\[ALERT\\\\]"], "action": "loop"},
+        {"name": "发票", "keywords": ["发票", "invoice"], "action": "once"},
+        {"name": "合同", "body": ["合同编号"], "action": "loop"},
+        {"name": "其他", "match_all": true, "action": "silent"}
+    ]
+一封邮件按配置顺序取第一条命中的规则；没有规则命中时使用界面上选择的提醒模式
+body 关键词检查正文开头的摘要，只有配置了这类规则时监控才会去取正文
+"""
+
+import re
+from collections import deque
+from email.utils import parseaddr
+
+# loop: 弹窗并循环播放直到确认；once: 只播放一次；silent: 只记录不提醒；default: 使用界面上选择的模式
+ACTIONS = ("loop", "once", "silent", "default")
+# 正则内联标志 (?aiLmsux) (?-i:...) 中 (? 后面可能出现的字符
+INLINE_FLAGS = frozenset("aiLmsux-")
+# 带固定长度参数的转义：\xhh \uhhhh \Uhhhhhhhh
+ESCAPE_ARGS = {"x": 2, "u": 4, "U": 8}
+
+
+class RuleError(ValueError):
+    """规则配置有误"""
+
+
+class AhoCorasick:
+    """多关键词自动机：一次扫描文本找出所有出现的关键词"""
+
+    def __init__(self):
+        self.goto = [{}]
+        self.fail = [0]
+        self.output = [set()]
+
+    def add(self, keyword, value):
+        state = 0
+        for char in keyword:
+            next_state = self.goto[state].get(char)
+            if next_state is None:
+                next_state = len(self.goto)
+                self.goto[state][char] = next_state
+                self.goto.append({})
+                self.fail.append(0)
+                self.output.append(set())
+            state = next_state
+        self.output[state].add(value)
+
+    def build(self):
+        """计算失败指针，添加完所有关键词后调用一次"""
+        # 第一层节点的失败指针都指向根
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self.goto[state].items():
+                queue.append(next_state)
+                fallback = self.fail[state]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[next_state] = self.goto[fallback].get(char, 0)
+                self.output[next_state] |= self.output[self.fail[next_state]]
+        return self
+
+    def search(self, text):
+        """返回文本中出现的所有关键词对应的值"""
+        found = set()
+        state = 0
+        for char in text:
+            while state and char not in self.goto[state]:
+                state = self.fail[state]
+            state = self.goto[state].get(char, 0)
+            if self.output[state]:
+                found |= self.output[state]
+        return found
+
+
+class Rule:
+
+    def __init__(self, index, config):
+        self.index = index
+        self.name = config.get("name") or f"规则{index + 1}"
+        self.action = config.get("action", "loop")
+        if self.action not in ACTIONS:
+            raise RuleError(f"{self.name}: 未知的提醒方式 {self.action}")
+        self.senders = [s.strip().lower() for s in as_list(config.get("from"))]
+        self.subjects = as_list(config.get("subject"))
+        self.keywords = [k.casefold() for k in as_list(config.get("keywords")) if k]
+        self.body_keywords = [k.casefold() for k in as_list(config.get("body")) if k]
+        self.match_all = bool(config.get("match_all"))
+        for pattern in self.subjects:
+            try:
+                re.compile(pattern)
+            except re.error as e:
+                raise RuleError(f"{self.name}: 主题正则有误 {pattern}: {e}") from None
+
+
+def as_list(value):
+    if not value:
+        return []
+    return [value] if isinstance(value, str) else list(value)
+
+
+def escape_end(pattern, escaped, i):
+    """字母数字转义 \\<escaped> 的参数之后的位置，i 为 escaped 之后的位置"""
+    if escaped in ESCAPE_ARGS:
+        return i + ESCAPE_ARGS[escaped]
+    if escaped == "N" and pattern[i:i + 1] == "{":
+        end = pattern.find("}", i)
+        return len(pattern) if end < 0 else end + 1
+    if escaped.isdigit():
+        # 反向引用 \1 \12 或八进制 \012，最多3位
+        end = min(len(pattern), i + 2)
+        while i < end and pattern[i].isdigit():
+            i += 1
+    return i
+
+
+def required_literal(pattern):
+    """找出正则匹配时一定会出现的最长一段字面文字，用于预筛；找不到(少于2个字)时返回None
+
+    只看最外层：含 | 的正则、括号和字符类里的内容、后面跟 ? * { 的字符、{m,n} 中的内容、
+    \\d \\x41 等字母数字转义及其参数都不算；
+    带内联标志 (?x) (?i:...) 等的正则可能改变字面文字的含义，不预筛
+    """
+    if "|" in pattern:
+        return None
+    best = current = ""
+    depth = 0
+    i = 0
+    while i < len(pattern):
+        char = pattern[i]
+        literal = None
+        if char == "\\":
+            escaped = pattern[i + 1:i + 2]
+            i += 2
+            if escaped and not escaped.isalnum():
+                literal = escaped
+            else:
+                # \d \b 等类别和反向引用不是字面文字，\x41 \u544a \N{...} 连同后面的参数一起跳过
+                i = escape_end(pattern, escaped, i)
+        elif char == "[":
+            # 跳过字符类，]紧跟在[或[^后面时是普通字符
+            i += 2 if pattern[i + 1:i + 2] == "^" else 1
+            i = pattern.find("]", i + 1)
+            i = len(pattern) if i < 0 else i + 1
+        elif char == "(":
+            if pattern[i + 1:i + 2] == "?" and pattern[i + 2:i + 3] in INLINE_FLAGS:
+                return None
+            depth += 1
+            i += 1
+        elif char == ")":
+            depth -= 1
+            i += 1
+        elif char == "{":
+            # 重复次数 {m,n} 整段跳过，其中的数字和逗号不是字面文字
+            end = pattern.find("}", i + 1)
+            i = len(pattern) if end < 0 else end + 1
+        else:
+            if char not in ".^$+*?}":
+                literal = char
+            i += 1
+        optional = pattern[i:i + 1] in ("?", "*", "{")
+        if literal is not None and depth == 0 and not optional:
+            current += literal
+            if pattern[i:i + 1] == "+":
+                best, current = max(best, current, key=len), ""
+        else:
+            best, current = max(best, current, key=len), ""
+    best = max(best, current, key=len)
+    return best.casefold() if len(best) >= 2 else None
+
+
+class RuleSet:
+    """编译后的规则集"""
+
+    def __init__(self, rules_config=()):
+        self.rules = [Rule(i, config) for i, config in enumerate(rules_config)]
+        self.addresses = {}
+        self.domains = {}
+        # 关键词和主题正则的预筛文字放在同一个自动机里，一次扫描
+        self.automaton = AhoCorasick()
+        self.body_automaton = AhoCorasick()
+        self.patterns = []
+        self.unfiltered = []
+        self.catch_all = None
+
+        for rule in self.rules:
+            for sender in rule.senders:
+                if sender.startswith("@"):
+                    self.domains.setdefault(sender[1:], rule.index)
+                else:
+                    self.addresses.setdefault(sender, rule.index)
+            for keyword in rule.keywords:
+                self.automaton.add(keyword, (rule.index, None))
+            for keyword in rule.body_keywords:
+                self.body_automaton.add(keyword, (rule.index, None))
+            for pattern in rule.subjects:
+                position = len(self.patterns)
+                self.patterns.append((rule.index, re.compile(pattern, re.IGNORECASE)))
+                hint = required_literal(pattern)
+                if hint:
+                    self.automaton.add(hint, (rule.index, position))
+                else:
+                    self.unfiltered.append((rule.index, position))
+            if rule.match_all and self.catch_all is None:
+                self.catch_all = rule.index
+        self.automaton.build()
+        self.body_automaton.build()
+        # 有检查正文的规则时，新邮件需要带上正文摘要
+        self.needs_body = any(rule.body_keywords for rule in self.rules)
+
+    def __len__(self):
+        return len(self.rules)
+
+    def match(self, email_info):
+        """返回命中的第一条规则，没有命中时返回None"""
+        if not self.rules:
+            return None
+        best = len(self.rules) if self.catch_all is None else self.catch_all
+
+        address = parseaddr(email_info.get('from', ''))[1].lower()
+        best = min(best, self.addresses.get(address, best))
+        domain = address.rpartition("@")[2]
+        while domain:
+            best = min(best, self.domains.get(domain, best))
+            domain = domain.partition(".")[2]
+
+        subject = email_info.get('subject', '')
+        found = self.automaton.search(f"{subject}\n{email_info.get('from', '')}".casefold())
+        if self.needs_body and email_info.get('snippet'):
+            found |= self.body_automaton.search(email_info['snippet'].casefold())
+        # 关键词命中直接生效；正则只验证预筛通过且排在当前结果之前的
+        for index, position in sorted(found.union(self.unfiltered), key=lambda item: item[0]):
+            if index >= best:
+                break
+            if position is None or self.patterns[position][1].search(subject):
+                best = index
+
+        return self.rules[best] if best < len(self.rules) else None
+
+    def route(self, new_emails, default_action):
+        """给每封邮件标上命中的规则和提醒方式，按提醒方式分组返回 {action: [邮件]}"""
+        groups = {}
+        for email_info in new_emails:
+            rule = self.match(email_info)
+            action = rule.action if rule is not None else "default"
+            email_info['rule'] = rule.name if rule is not None else ""
+            email_info['action'] = default_action if action == "default" else action
+            groups.setdefault(email_info['action'], []).append(email_info)
+        return groups
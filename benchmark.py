@@ -0,0 +1,366 @@
+# -*- coding: utf-8 -*-
+"""
+轮询流程基准测试 - 在本地模拟IMAP服务器上运行与监控引擎相同的同步代码
+报告首次同步、空轮询、增量同步的耗时，每秒解析邮件数，传输字节数，峰值内存和新邮件提醒延迟
+
+用法: python benchmark.py --messages 100000 --size 20000 --mime attachment --charset gbk
+"""
+
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import tempfile
+import statistics
+
+from fake_imap_server import FakeImapServer, make_message
+from mail_engine import ACCOUNT_DEFAULTS, AccountMonitor, SyncStateStore
+from mail_metrics import Metrics, peak_rss_mb, stage_totals
+from mail_parse import PARSE_CHUNK, POOL_THRESHOLD, HeaderParser, parse_header_records
+
+
+class BenchEngine:
+    """代替 MonitorEngine：记录提醒而不弹窗，已处理记录放在内存中"""
+
+    def __init__(self, sync_file, body_bytes=0, parse_workers=0):
+        self.sync_store = SyncStateStore(sync_file)
+        self.body_bytes = body_bytes
+        self.parser = HeaderParser(parse_workers)
+        self.metrics = Metrics()
+        self.processed = set()
+        self.alerted = 0
+        self.alert_event = asyncio.Event()
+        self.alert_time = None
+        self.first_alert_time = None
+
+    def status(self, msg):
+        pass
+
+    async def dispatch(self, monitor, new_emails):
+        self.alerted += len(new_emails)
+        self.processed.update(email_info['key'] for email_info in new_emails)
+        self.alert_time = time.perf_counter()
+        if self.first_alert_time is None:
+            self.first_alert_time = self.alert_time
+        self.alert_event.set()
+
+
+class Benchmark:
+
+    def __init__(self, args):
+        self.args = args
+        factory = lambda uid: make_message(uid, args.size, args.mime, args.charset)
+        self.server = FakeImapServer(idle=not args.no_idle, factory=factory).start()
+        self.mailbox = self.server.mailbox()
+        self.mailbox.add_synthetic(args.messages, seen_ratio=args.seen_ratio)
+        # 其余文件夹各放少量邮件，空轮询时只用STATUS检查
+        self.folders = [f"Folder{index}" for index in range(1, args.folders)]
+        for name in self.folders:
+            self.server.mailbox(name).add_synthetic(10)
+        self.results = {"config": vars(args)}
+
+    def measure(self, name, seconds, messages=None):
+        """记录一个阶段的耗时、服务器发出的字节数和解析速度"""
+        result = {"seconds": round(seconds, 4), "bytes": self.server.bytes_sent, "commands": self.server.commands}
+        if messages is not None:
+            result["messages"] = messages
+            result["messages_per_sec"] = round(messages / seconds, 1) if seconds else None
+        self.results[name] = result
+        self.server.reset_stats()
+
+    async def run(self):
+        args = self.args
+        if args.parse_workers:
+            self.results["parse"] = await compare_parse(args, self.server.factory)
+        engine = BenchEngine(os.path.join(tempfile.mkdtemp(), "sync_state.db"), args.snippet, args.parse_workers)
+        account = dict(ACCOUNT_DEFAULTS, name="bench", server="127.0.0.1", port=self.server.port,
+                       email="user", password="pass", ssl=False, check_interval=args.interval,
+                       min_interval=args.interval, max_interval=args.interval, mailboxes=["INBOX"] + self.folders,
+                       initial_sync="baseline" if args.baseline else "unseen")
+        monitor = AccountMonitor(account, engine)
+
+        start = time.perf_counter()
+        await monitor.connect()
+        self.measure("connect", time.perf_counter() - start)
+
+        # 首次同步：所有未读邮件都要取邮件头、解析、去重
+        start = time.perf_counter()
+        await monitor.sync()
+        self.measure("initial_sync", time.perf_counter() - start, engine.alerted)
+        # 首次同步从最新的邮件开始分批提醒，第一次提醒不必等全部取完
+        if engine.first_alert_time is not None:
+            self.results["initial_sync"]["first_alert_ms"] = round((engine.first_alert_time - start) * 1000, 1)
+
+        # 没有新邮件时的轮询
+        latencies = []
+        for _ in range(args.polls):
+            start = time.perf_counter()
+            await monitor.sync()
+            latencies.append(time.perf_counter() - start)
+        self.measure("idle_poll", sum(latencies))
+        self.results["idle_poll"].update(percentiles(latencies))
+
+        # 增量同步：一次到达一批新邮件
+        before = engine.alerted
+        self.mailbox.add_synthetic(args.batch)
+        start = time.perf_counter()
+        await monitor.sync()
+        self.measure("incremental_sync", time.perf_counter() - start, engine.alerted - before)
+
+        # 提醒延迟：从服务器收到邮件到提醒回调被调用
+        stop_event = asyncio.Event()
+        task = asyncio.create_task(monitor.run(stop_event))
+        delays = []
+        for _ in range(args.alerts):
+            await asyncio.sleep(0.2)
+            engine.alert_event.clear()
+            start = time.perf_counter()
+            self.mailbox.append()
+            try:
+                await asyncio.wait_for(engine.alert_event.wait(), args.interval + 5)
+                delays.append(engine.alert_time - start)
+            except asyncio.TimeoutError:
+                delays.append(float("inf"))
+        stop_event.set()
+        await task
+        self.results["time_to_alert"] = percentiles(delays)
+        self.results["stages"] = stage_totals(engine.metrics)
+        self.results["logins"] = self.server.logins
+        self.results["peak_rss_mb"] = peak_rss_mb()
+        engine.parser.close()
+        self.server.shutdown()
+        return self.results
+
+
+async def compare_parse(args, factory):
+    """只比较解析：同一批邮件头在当前线程和进程池中解析的耗时(不含网络)"""
+    items = [(uid, factory(uid).split(b"\r\n\r\n", 1)[0] + b"\r\n\r\n") for uid in range(1, args.messages + 1)]
+    start = time.perf_counter()
+    parse_header_records(items)
+    serial = time.perf_counter() - start
+
+    parser = HeaderParser(args.parse_workers)
+    try:
+        # 第一次调用启动子进程，每个子进程分到一块，单独计时
+        start = time.perf_counter()
+        await parser.submit(items[:max(POOL_THRESHOLD, PARSE_CHUNK * args.parse_workers)])
+        warmup = time.perf_counter() - start
+        start = time.perf_counter()
+        await parser.submit(items)
+        pooled = time.perf_counter() - start
+    finally:
+        parser.close()
+    return {
+        "messages": len(items),
+        "workers": args.parse_workers,
+        "serial_ms": round(serial * 1000, 1),
+        "pool_ms": round(pooled * 1000, 1),
+        "pool_start_ms": round(warmup * 1000, 1),
+        "speedup": round(serial / pooled, 2) if pooled else None,
+    }
+
+
+def measure_dedup(count, lookups=100000):
+    """已处理记录：写入count条唯一标识后的Bloom过滤器内存、数据库大小和查询速度"""
+    from mail_store import ProcessedStore
+    path = os.path.join(tempfile.mkdtemp(), "processed_emails.db")
+    store = ProcessedStore(path, max_records=0, max_age_days=0)
+    try:
+        start = time.perf_counter()
+        for offset in range(0, count, 10000):
+            store.add_many([f"mid:{uid}.bench@example.com" for uid in range(offset, min(count, offset + 10000))])
+        insert = time.perf_counter() - start
+        # 重新打开时从数据库重建Bloom过滤器
+        store.close()
+        start = time.perf_counter()
+        store = ProcessedStore(path, max_records=0, max_age_days=0)
+        load = time.perf_counter() - start
+
+        start = time.perf_counter()
+        misses = sum(f"mid:new{uid}@example.com" in store for uid in range(lookups))
+        miss_seconds = time.perf_counter() - start
+        start = time.perf_counter()
+        hits = sum(f"mid:{uid}.bench@example.com" in store for uid in range(0, count, max(1, count // lookups)))
+        hit_seconds = time.perf_counter() - start
+        return {
+            "records": len(store),
+            "bloom_kb": round(store.bloom.memory_bytes / 1024, 1),
+            "db_mb": round(os.path.getsize(path) / 1024 / 1024, 2),
+            "insert_per_sec": round(count / insert) if insert else None,
+            "load_ms": round(load * 1000, 1),
+            "miss_us": round(miss_seconds / lookups * 1e6, 2),
+            "false_positives": misses,
+            "hit_us": round(hit_seconds / max(hits, 1) * 1e6, 2),
+        }
+    finally:
+        store.close()
+
+
+def measure_stop(read_timeout=1.0):
+    """停止延迟：IDLE等待中、取信被服务器卡住时分别调用 stop() 到监控线程结束的耗时，
+    以及服务器不响应时读取超时被发现的耗时(毫秒)
+    """
+    import threading
+    from mail_engine import MonitorEngine
+    results = {}
+    for scenario in ("idle", "stalled_fetch", "read_timeout"):
+        server = FakeImapServer().start()
+        if scenario != "idle":
+            server.mailbox().add_synthetic(100)
+            server.stall.add("FETCH")
+        account = dict(ACCOUNT_DEFAULTS, name="bench", server="127.0.0.1", port=server.port, email="user",
+                       password="pass", ssl=False, mailboxes=["INBOX"],
+                       read_timeout=read_timeout if scenario == "read_timeout" else 60)
+        messages = []
+        engine = MonitorEngine([account], SyncStateStore(os.path.join(tempfile.mkdtemp(), "sync_state.db")),
+                               set(), on_new_mail=lambda name, emails: None, on_status=messages.append)
+        thread = threading.Thread(target=engine.run, daemon=True)
+        started = time.perf_counter()
+        thread.start()
+        # 等到连接完成，再多等一会儿让账号进入IDLE或卡在FETCH上
+        while not any("已连接" in msg for msg in messages):
+            time.sleep(0.01)
+        if scenario == "read_timeout":
+            while not any("没有响应" in msg for msg in messages):
+                time.sleep(0.01)
+            results[scenario] = round((time.perf_counter() - started) * 1000, 1)
+            engine.stop()
+        else:
+            time.sleep(0.3)
+            start = time.perf_counter()
+            engine.stop()
+            thread.join(5)
+            results[scenario] = round((time.perf_counter() - start) * 1000, 1)
+        thread.join(5)
+        server.shutdown()
+    return results
+
+
+STARTUP_MODULES = ("mail_core", "mail_daemon", "enhanced_email_alert")
+
+
+def measure_startup(runs=5):
+    """冷启动：在新进程中导入各入口模块，返回导入耗时和进程总耗时的中位数(毫秒)"""
+    import subprocess
+    here = os.path.dirname(os.path.abspath(__file__))
+    results = {}
+    for module in STARTUP_MODULES:
+        imports, walls = [], []
+        for _ in range(runs):
+            start = time.perf_counter()
+            proc = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                                  cwd=here, capture_output=True, text=True)
+            walls.append(time.perf_counter() - start)
+            last = proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else ""
+            # 最后一行是本模块：import time: 自身 | 累计 | 模块名
+            if proc.returncode != 0 or not last.endswith(f"| {module}"):
+                break
+            imports.append(int(last.split("|")[1]) / 1e6)
+        results[module] = {
+            "import_ms": round(statistics.median(imports) * 1000, 1) if imports else None,
+            "process_ms": round(statistics.median(walls) * 1000, 1),
+        }
+    return results
+
+
+def percentiles(values):
+    values = sorted(values)
+    return {
+        "p50_ms": round(statistics.median(values) * 1000, 2),
+        "p95_ms": round(values[min(len(values) - 1, int(len(values) * 0.95))] * 1000, 2),
+        "max_ms": round(values[-1] * 1000, 2),
+    }
+
+
+def print_report(results):
+    config = results["config"]
+    print(f"邮件数 {config['messages']}，正文 {config['size']} 字节，{config['mime']}，{config['charset']}，"
+          f"{config['folders']}个文件夹")
+    for name in ("connect", "initial_sync", "idle_poll", "incremental_sync"):
+        result = results[name]
+        line = f"{name:<18}{result['seconds'] * 1000:>10.1f} ms{result['bytes']:>14,} B{result['commands']:>8} 条命令"
+        if "messages_per_sec" in result:
+            line += f"{result['messages']:>10} 封{result['messages_per_sec'] or 0:>12,.0f} 封/秒"
+        if "p50_ms" in result:
+            line += f"  p50 {result['p50_ms']} ms  p95 {result['p95_ms']} ms"
+        if "first_alert_ms" in result:
+            line += f"  首次提醒 {result['first_alert_ms']} ms"
+        print(line)
+    if "parse" in results:
+        parse = results["parse"]
+        print(f"{'parse':<18}当前线程 {parse['serial_ms']} ms  {parse['workers']}个子进程 {parse['pool_ms']} ms  "
+              f"加速 {parse['speedup']}x  (子进程启动 {parse['pool_start_ms']} ms)")
+    alert = results["time_to_alert"]
+    print(f"{'time_to_alert':<18}p50 {alert['p50_ms']} ms  p95 {alert['p95_ms']} ms  max {alert['max_ms']} ms")
+    for stage, total in results["stages"].items():
+        print(f"  {stage:<16}{total['total_ms']:>10.1f} ms{total['count']:>8} 次")
+    print(f"{'logins':<18}{results['logins']}")
+    if results["peak_rss_mb"] is not None:
+        print(f"{'peak_rss':<18}{results['peak_rss_mb']:.1f} MB")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="邮件轮询流程基准测试")
+    parser.add_argument("--messages", type=int, default=10000, help="邮箱中预置的邮件数")
+    parser.add_argument("--seen-ratio", type=float, default=0.0, help="预置邮件中已读的比例")
+    parser.add_argument("--size", type=int, default=2000, help="每封邮件正文字节数")
+    parser.add_argument("--mime", choices=["plain", "alternative", "attachment"], default="plain")
+    parser.add_argument("--charset", default="utf-8")
+    parser.add_argument("--folders", type=int, default=1, help="监控的文件夹数(含INBOX)")
+    parser.add_argument("--polls", type=int, default=20, help="空轮询次数")
+    parser.add_argument("--batch", type=int, default=100, help="增量同步的新邮件数")
+    parser.add_argument("--alerts", type=int, default=10, help="测量提醒延迟的次数")
+    parser.add_argument("--snippet", type=int, default=0, help="每封新邮件取正文摘要的字节数，0为不取")
+    parser.add_argument("--parse-workers", type=int, default=0,
+                        help="解析邮件头的子进程数，并与当前线程解析对比；0为只在当前线程解析")
+    parser.add_argument("--interval", type=int, default=1, help="不支持IDLE时的轮询间隔(秒)")
+    parser.add_argument("--no-idle", action="store_true", help="模拟不支持IDLE的服务器")
+    parser.add_argument("--baseline", action="store_true", help="首次同步只记下基线，不取现有邮件")
+    parser.add_argument("--json", action="store_true", help="以JSON输出结果")
+    parser.add_argument("--startup", action="store_true", help="只测量各入口模块的冷启动耗时")
+    parser.add_argument("--dedup", type=int, default=0, help="只测量写入这么多条已处理记录后的内存和查询速度")
+    parser.add_argument("--stop", action="store_true", help="只测量停止监控的延迟和读取超时")
+    args = parser.parse_args(argv)
+
+    if args.startup:
+        results = measure_startup()
+        if args.json:
+            print(json.dumps(results, ensure_ascii=False, indent=2))
+        else:
+            for module, result in results.items():
+                imported = f"{result['import_ms']:.1f} ms" if result['import_ms'] is not None else "导入失败"
+                print(f"{module:<22}导入 {imported:>10}  进程 {result['process_ms']:.1f} ms")
+        return 0
+
+    if args.dedup:
+        results = measure_dedup(args.dedup)
+        if args.json:
+            print(json.dumps(results, ensure_ascii=False, indent=2))
+        else:
+            print(f"已处理记录 {results['records']:,} 条：Bloom过滤器 {results['bloom_kb']:,} KB，"
+                  f"数据库 {results['db_mb']} MB，写入 {results['insert_per_sec']:,} 条/秒，启动加载 {results['load_ms']} ms")
+            print(f"未处理邮件查询 {results['miss_us']} us/次(误报 {results['false_positives']} 次)，"
+                  f"已处理邮件查询 {results['hit_us']} us/次")
+        return 0
+
+    if args.stop:
+        results = measure_stop()
+        if args.json:
+            print(json.dumps(results, ensure_ascii=False, indent=2))
+        else:
+            print(f"停止延迟：IDLE等待中 {results['idle']} ms，取信卡住时 {results['stalled_fetch']} ms")
+            print(f"服务器不响应时 {results['read_timeout']} ms 后断开重连(读取超时1秒)")
+        return 0
+
+    results = asyncio.run(Benchmark(args).run())
+    if args.json:
+        print(json.dumps(results, ensure_ascii=False, indent=2))
+    else:
+        print_report(results)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
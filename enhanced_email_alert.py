@@ -4,52 +4,49 @@
 功能：收到邮件后循环播放音乐，手动确认后停止，支持配置保存和自动开始监控
 """
 
+import time
+# 冷启动计时从导入本模块开始
+STARTED = time.perf_counter()
+
 import os
 import sys
-import time
-import threading
-import winsound
-import json
-import imaplib
-import email
-import hashlib
-from email.header import decode_header
-from tkinter import Tk, Label, Button, Frame, messagebox, filedialog, Entry, StringVar, Scrollbar, Text, Checkbutton, BooleanVar
+import queue
+from tkinter import Tk, Toplevel, Label, Button, Frame, messagebox, filedialog, Entry, StringVar, Scrollbar, Text, Listbox, Checkbutton, BooleanVar, OptionMenu
 from datetime import datetime
-import psutil
+from mail_audio import AudioError, AudioPlayer, write_default_tone
+from mail_core import MailAlertCore
+from mail_digest import DEFAULT_WINDOW, AlertDigest
+from mail_instance import SingleInstance
+
+# 状态框最多保留的行数，更早的行被丢弃
+STATUS_MAX_LINES = 1000
+# 界面线程刷新状态队列的间隔(毫秒)
+STATUS_FLUSH_MS = 100
+# 状态栏中正文摘要最多显示的字数
+PREVIEW_CHARS = 100
+# 提醒窗口列表中最多显示的邮件数
+DIGEST_MAX_ROWS = 500
+# 历史查找的时间范围：名称 -> 开始时间相对今天0点的天数(None为不限)
+HISTORY_RANGES = {"今天": 0, "昨天": 1, "最近7天": 6, "最近30天": 29, "全部": None}
 
 class EnhancedEmailAlert:
     def __init__(self):
         self.is_running = False
         self.is_alerting = False
         self.sound_file = "alert.wav"
-        self.processed_emails = set()
-        self.processed_file = "processed_emails.json"
-        self.config_file = "app_config.json"
-        
-        # 默认配置
-        self.default_config = {
-            "email_settings": {
-                "server": "imap.qq.com",
-                "port": "993",
-                "email": "",
-                "password": ""
-            },
-            "alert_settings": {
-                "sound_file": "alert.wav",
-                "alert_mode": "popup",
-                "check_interval": 30,
-                "auto_start": False  # 新增：是否自动开始监控
-            },
-            "window_position": {
-                "width": 600,
-                "height": 500
-            }
-        }
+        self.status_queue = queue.SimpleQueue()
+        self.audio = AudioPlayer(on_error=self.enqueue_status)
+        # 新邮件由引擎线程放入队列，界面线程合并成一次提醒
+        self.alert_queue = queue.SimpleQueue()
+        self.alert_dialog = None
         
         # 加载配置和已处理的邮件记录
-        self.load_config()
-        self.load_processed_emails()
+        self.core = MailAlertCore(on_status=self.enqueue_status)
+        self.config = self.core.config
+        self.processed_emails = self.core.processed_emails
+        self.digest = AlertDigest(self.config["alert_settings"].get("digest_window", DEFAULT_WINDOW))
+        # 远程确认(POST /ack)也通过队列交给界面线程
+        self.core.on_ack = lambda: self.alert_queue.put(None)
         
         self.create_ui()
         
@@ -57,53 +54,22 @@ class EnhancedEmailAlert:
         if self.config["alert_settings"]["auto_start"]:
             self.auto_start_monitoring()
     
-    def load_config(self):
-        """加载应用程序配置"""
-        try:
-            if os.path.exists(self.config_file):
-                with open(self.config_file, 'r', encoding='utf-8') as f:
-                    self.config = json.load(f)
-            else:
-                self.config = self.default_config.copy()
-                self.save_config()
-        except Exception as e:
-            print(f"加载配置失败: {e}")
-            self.config = self.default_config.copy()
+    def sync_settings(self, *args):
+        """在界面线程中更新提醒设置的副本(整体替换，其他线程读到的总是一致的一份)"""
+        self.settings = {"alert_mode": self.alert_mode.get(), "sound_file": self.sound_var.get()}
     
     def save_config(self):
         """保存应用程序配置"""
-        try:
-            with open(self.config_file, 'w', encoding='utf-8') as f:
-                json.dump(self.config, f, ensure_ascii=False, indent=2)
-        except Exception as e:
-            print(f"保存配置失败: {e}")
+        self.core.save_config()
     
-    def load_processed_emails(self):
-        """加载已处理的邮件记录"""
-        try:
-            if os.path.exists(self.processed_file):
-                with open(self.processed_file, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-                    self.processed_emails = set(data.get('processed_emails', []))
-                    
-                    if len(self.processed_emails) > 1000:
-                        self.processed_emails = set(list(self.processed_emails)[-1000:])
-        except Exception as e:
-            print(f"加载已处理邮件记录失败: {e}")
-            self.processed_emails = set()
-    
-    def save_processed_emails(self):
-        """保存已处理的邮件记录"""
-        try:
-            with open(self.processed_file, 'w', encoding='utf-8') as f:
-                json.dump({'processed_emails': list(self.processed_emails)}, f, ensure_ascii=False)
-        except Exception as e:
-            print(f"保存已处理邮件记录失败: {e}")
+    def mark_processed(self, new_emails):
+        """标记邮件为已处理，一次写入"""
+        self.core.mark_processed(new_emails)
     
     def get_email_hash(self, email_data):
         """生成邮件的唯一标识哈希"""
-        content = f"{email_data.get('from', '')}_{email_data.get('subject', '')}_{email_data.get('date', '')}"
-        return hashlib.md5(content.encode('utf-8')).hexdigest()
+        from mail_engine import email_hash
+        return email_hash(email_data)
     
     def create_ui(self):
         """创建用户界面"""
@@ -154,6 +120,10 @@ class EnhancedEmailAlert:
         Label(alert_frame, text="提醒模式:").grid(row=0, column=0, sticky="w")
         
         self.alert_mode = StringVar(value=self.config["alert_settings"]["alert_mode"])
+        # 引擎线程不能读取Tk变量：变量修改时在界面线程更新普通字典的副本，其他线程只读副本
+        self.sync_settings()
+        self.alert_mode.trace_add("write", self.sync_settings)
+        self.sound_var.trace_add("write", self.sync_settings)
         
         self.popup_mode_btn = Button(
             alert_frame, 
@@ -212,7 +182,10 @@ class EnhancedEmailAlert:
         status_frame = Frame(self.root, padx=10, pady=10)
         status_frame.pack(fill="both", expand=True)
         
-        Label(status_frame, text="运行状态:", font=("Arial", 10, "bold")).pack(anchor="w")
+        status_header = Frame(status_frame)
+        status_header.pack(fill="x")
+        Label(status_header, text="运行状态:", font=("Arial", 10, "bold")).pack(side="left")
+        Button(status_header, text="查找历史邮件", command=self.show_history_window).pack(side="right")
         
         # 创建带滚动条的文本框
         text_frame = Frame(status_frame)
@@ -225,6 +198,8 @@ class EnhancedEmailAlert:
         self.status_text.pack(side="left", fill="both", expand=True)
         
         scrollbar.config(command=self.status_text.yview)
+        self.root.after(STATUS_FLUSH_MS, self.flush_status)
+        self.root.after(STATUS_FLUSH_MS, self.flush_alerts)
         
         # 初始状态
         self.update_status("程序已启动，配置已加载")
@@ -280,187 +255,126 @@ class EnhancedEmailAlert:
     
     def test_sound(self):
         """测试声音文件"""
-        sound_file = self.sound_var.get()
-        if not os.path.exists(sound_file):
-            messagebox.showerror("错误", "声音文件不存在！")
-            return
-        
         try:
-            winsound.PlaySound(sound_file, winsound.SND_FILENAME)
-            self.update_status("测试声音播放成功")
-        except Exception as e:
-            messagebox.showerror("错误", f"播放声音失败: {str(e)}")
+            self.audio.play_once(self.sound_var.get())
+            self.update_status(f"测试声音播放成功 ({self.audio.backend.name})")
+        except AudioError as e:
+            messagebox.showerror("错误", str(e))
     
     def update_status(self, msg):
-        """更新状态显示"""
+        """更新状态显示(可在任意线程调用)"""
+        self.core.status(msg)
+    
+    def enqueue_status(self, msg):
+        """只放入队列，由界面线程批量刷新"""
         current_time = datetime.now().strftime("%H:%M:%S")
-        self.status_text.insert("end", f"[{current_time}] {msg}\n")
-        self.status_text.see("end")
-        self.root.update_idletasks()
+        self.status_queue.put(f"[{current_time}] {msg}")
     
-    def play_alert_once(self):
-        """播放一次提醒声音"""
-        sound_file = self.sound_var.get()
-        if not os.path.exists(sound_file):
-            self.update_status("错误: 声音文件不存在！")
-            return
-        
+    def flush_status(self):
+        """在界面线程中定时取出队列中的状态，一次写入文本框，并只保留最近的行"""
+        lines = []
         try:
-            winsound.PlaySound(sound_file, winsound.SND_FILENAME)
-        except:
+            while True:
+                lines.append(self.status_queue.get_nowait())
+        except queue.Empty:
             pass
+        
+        if lines:
+            self.status_text.insert("end", "\n".join(lines[-STATUS_MAX_LINES:]) + "\n")
+            line_count = int(self.status_text.index("end-1c").split(".")[0]) - 1
+            if line_count > STATUS_MAX_LINES:
+                self.status_text.delete("1.0", f"{line_count - STATUS_MAX_LINES + 1}.0")
+            self.status_text.see("end")
+        
+        self.root.after(STATUS_FLUSH_MS, self.flush_status)
+    
+    def play_alert_once(self):
+        """播放一次提醒声音，不阻塞"""
+        try:
+            self.audio.play_once(self.settings["sound_file"])
+        except AudioError as e:
+            self.update_status(f"错误: {e}")
     
     def play_alert_loop(self):
-        """循环播放提醒声音"""
-        sound_file = self.sound_var.get()
-        if not os.path.exists(sound_file):
-            self.update_status("错误: 声音文件不存在！")
-            return
-        
+        """循环播放提醒声音直到 stop_alert()，不阻塞"""
         try:
-            while self.is_alerting:
-                winsound.PlaySound(sound_file, winsound.SND_FILENAME)
-                for i in range(20):
-                    if not self.is_alerting:
-                        break
-                    time.sleep(0.1)
-        except:
-            pass
+            self.audio.play_loop(self.settings["sound_file"])
+        except AudioError as e:
+            self.update_status(f"错误: {e}")
     
     def stop_alert(self):
         """停止提醒"""
         self.is_alerting = False
+        self.audio.stop()
         self.update_status("提醒已停止")
     
-    def get_email_content(self, msg):
-        """获取邮件内容"""
-        content = ""
-        if msg.is_multipart():
-            for part in msg.walk():
-                content_type = part.get_content_type()
-                if content_type == "text/plain":
-                    try:
-                        payload = part.get_payload(decode=True)
-                        if payload:
-                            content = payload.decode('utf-8', errors='ignore')
-                            break
-                    except:
-                        pass
-        else:
-            content_type = msg.get_content_type()
-            if content_type == "text/plain":
-                try:
-                    payload = msg.get_payload(decode=True)
-                    if payload:
-                        content = payload.decode('utf-8', errors='ignore')
-                except:
-                    pass
-        return content
+    def show_previews(self, emails):
+        """在状态栏显示正文摘要(配置了 preview_bytes 时才有)"""
+        for email_info in emails:
+            if email_info.get('snippet'):
+                self.update_status(f"  {email_info['subject']}: {email_info['snippet'][:PREVIEW_CHARS]}")
     
     def decode_header(self, header):
         """解码邮件头"""
-        if not header:
-            return ""
-        try:
-            decoded_parts = decode_header(header)
-            decoded_str = ""
-            for part, encoding in decoded_parts:
-                if isinstance(part, bytes):
-                    if encoding:
-                        decoded_str += part.decode(encoding)
-                    else:
-                        decoded_str += part.decode('utf-8', errors='ignore')
-                else:
-                    decoded_str += part
-            return decoded_str
-        except:
-            return str(header)
-    
-    def check_email(self):
-        """检查新邮件"""
-        check_interval = int(self.interval_var.get())
-        
-        while self.is_running:
-            try:
-                # 连接邮件服务器
-                mail = imaplib.IMAP4_SSL(self.server_var.get(), int(self.port_var.get()))
-                mail.login(self.email_var.get(), self.password_var.get())
-                mail.select("INBOX")
-                
-                # 搜索未读邮件
-                status, messages = mail.search(None, "UNSEEN")
-                if status == "OK" and messages[0]:
-                    email_ids = messages[0].split()
-                    new_emails = []
-                    
-                    for email_id in email_ids:
-                        status, msg_data = mail.fetch(email_id, '(RFC822)')
-                        if status != "OK":
-                            continue
-                            
-                        msg = email.message_from_bytes(msg_data[0][1])
-                        subject = self.decode_header(msg['Subject'])
-                        from_addr = self.decode_header(msg['From'])
-                        date = msg['Date']
-                        
-                        email_data = {
-                            'from': from_addr,
-                            'subject': subject,
-                            'date': date
-                        }
-                        email_hash = self.get_email_hash(email_data)
-                        
-                        if email_hash in self.processed_emails:
-                            self.update_status(f"跳过已处理邮件: {subject}")
-                            continue
-                        
-                        new_emails.append({
-                            'id': email_id,
-                            'hash': email_hash,
-                            'subject': subject,
-                            'from': from_addr,
-                            'date': date
-                        })
-                    
-                    if new_emails:
-                        email_count = len(new_emails)
-                        self.update_status(f"收到 {email_count} 封新邮件，开始提醒！")
-                        
-                        if self.alert_mode.get() == "once":
-                            self.play_alert_once()
-                            self.update_status("已播放一次提醒声音")
-                            
-                            for email_info in new_emails:
-                                self.processed_emails.add(email_info['hash'])
-                                self.update_status(f"标记邮件为已处理: {email_info['subject']}")
-                            
-                            self.save_processed_emails()
-                            
-                        else:
-                            self.is_alerting = True
-                            alert_thread = threading.Thread(target=self.play_alert_loop)
-                            alert_thread.daemon = True
-                            alert_thread.start()
-                            
-                            self.show_alert_dialog(email_count, new_emails)
-                
-                mail.close()
-                mail.logout()
-                
-            except Exception as e:
-                self.update_status(f"检查邮件错误: {str(e)}")
+        from mail_parse import decode_mime_header
+        return decode_mime_header(header)
+    
+    def handle_new_emails(self, account, new_emails):
+        """收到新邮件后提醒(在引擎的线程池中调用，只读取设置的副本，不访问Tk)"""
+        default_action = "once" if self.settings["alert_mode"] == "once" else "loop"
+        groups = self.core.route(new_emails, default_action)
+        
+        once_emails = groups.get("once")
+        if once_emails:
+            self.update_status(f"[{account}] 收到 {len(once_emails)} 封新邮件，开始提醒！")
+            self.show_previews(once_emails)
+            self.play_alert_once()
+            self.update_status("已播放一次提醒声音")
             
-            for i in range(check_interval):
-                if not self.is_running:
-                    break
-                time.sleep(1)
-    
-    def show_alert_dialog(self, count, new_emails):
-        """显示提醒对话框"""
-        dialog = Tk()
+            self.mark_processed(once_emails)
+            
+        loop_emails = groups.get("loop")
+        if loop_emails:
+            email_count = len(loop_emails)
+            self.update_status(f"[{account}] 收到 {email_count} 封新邮件，开始提醒！")
+            self.show_previews(loop_emails)
+            # 不在这里弹窗：交给界面线程合并提醒，本账号的监控立即继续
+            self.alert_queue.put(loop_emails)
+    
+    def flush_alerts(self):
+        """在界面线程中定时取出新邮件并入提醒：没有提醒窗口时等邮件停止到达再弹出，已有窗口时直接更新"""
+        added = 0
+        try:
+            while True:
+                new_emails = self.alert_queue.get_nowait()
+                if new_emails is None:
+                    # 远程确认：与点击确认按钮相同
+                    if len(self.digest):
+                        self.confirm_alert()
+                    continue
+                added += self.digest.add(new_emails)
+        except queue.Empty:
+            pass
+        
+        if self.digest.shown:
+            if added:
+                self.refresh_alert_dialog()
+        elif self.digest.ready():
+            self.show_alert_dialog()
+        
+        self.root.after(STATUS_FLUSH_MS, self.flush_alerts)
+    
+    def show_alert_dialog(self):
+        """显示提醒窗口，开始循环播放声音"""
+        self.digest.shown = True
+        self.is_alerting = True
+        self.play_alert_loop()
+        
+        dialog = Toplevel(self.root)
         dialog.title("新邮件提醒")
-        dialog.geometry("400x200")
+        dialog.geometry("480x320")
         dialog.attributes('-topmost', True)
+        dialog.protocol("WM_DELETE_WINDOW", self.confirm_alert)
         
         dialog.update_idletasks()
         x = (dialog.winfo_screenwidth() // 2) - (dialog.winfo_width() // 2)
@@ -468,48 +382,139 @@ class EnhancedEmailAlert:
         dialog.geometry(f"+{x}+{y}")
         
         Label(dialog, text="📧 新邮件提醒", font=("Arial", 14, "bold"), fg="blue").pack(pady=10)
-        Label(dialog, text=f"收到 {count} 封新邮件！", font=("Arial", 11)).pack(pady=5)
-        Label(dialog, text="点击确认停止提醒", font=("Arial", 9)).pack(pady=5)
+        self.alert_count_label = Label(dialog, font=("Arial", 11))
+        self.alert_count_label.pack(pady=5)
         
-        def confirm():
-            self.stop_alert()
-            
-            # 标记邮件为已处理
-            for email_info in new_emails:
-                self.processed_emails.add(email_info['hash'])
-                self.update_status(f"标记邮件为已处理: {email_info['subject']}")
-            
-            self.save_processed_emails()
-            dialog.destroy()
+        list_frame = Frame(dialog)
+        list_frame.pack(fill="both", expand=True, padx=10)
+        scrollbar = Scrollbar(list_frame)
+        scrollbar.pack(side="right", fill="y")
+        self.alert_list = Listbox(list_frame, yscrollcommand=scrollbar.set, height=6)
+        self.alert_list.pack(side="left", fill="both", expand=True)
+        scrollbar.config(command=self.alert_list.yview)
         
-        Button(dialog, text="确认收到", command=confirm, 
+        Label(dialog, text="点击确认停止提醒", font=("Arial", 9)).pack(pady=5)
+        Button(dialog, text="确认收到", command=self.confirm_alert, 
                bg="green", fg="white", font=("Arial", 10, "bold"), width=10).pack(pady=10)
         
         self.alert_dialog = dialog
-        dialog.mainloop()
+        self.alert_rows = 0
+        self.refresh_alert_dialog()
+    
+    def refresh_alert_dialog(self):
+        """更新提醒窗口中的邮件数和列表，只追加新到的邮件"""
+        accounts = self.digest.accounts()
+        detail = "，".join(f"{account} {count} 封" for account, count in accounts.items()) if len(accounts) > 1 else ""
+        self.alert_count_label.config(text=f"收到 {len(self.digest)} 封新邮件！" + (f"({detail})" if detail else ""))
+        
+        rows = self.digest.emails[self.alert_rows:DIGEST_MAX_ROWS]
+        for email_info in rows:
+            self.alert_list.insert("end", f"[{email_info['account']}] {email_info['from']} - {email_info['subject']}")
+        self.alert_rows += len(rows)
+        if len(self.digest) > DIGEST_MAX_ROWS:
+            self.alert_list.delete(DIGEST_MAX_ROWS)
+            self.alert_list.insert("end", f"…… 另有 {len(self.digest) - DIGEST_MAX_ROWS} 封")
+    
+    def close_alert_dialog(self):
+        if self.alert_dialog is not None:
+            try:
+                self.alert_dialog.destroy()
+            except Exception:
+                pass
+            self.alert_dialog = None
+    
+    def confirm_alert(self):
+        """确认提醒：停止声音，把提醒中的全部邮件标记为已处理"""
+        self.stop_alert()
+        self.close_alert_dialog()
+        emails = self.digest.take()
+        if emails:
+            self.mark_processed(emails)
+    
+    def show_history_window(self):
+        """打开历史邮件查找窗口，已打开时提到前面"""
+        if getattr(self, "history_window", None) is not None and self.history_window.winfo_exists():
+            self.history_window.lift()
+            return
+        
+        window = Toplevel(self.root)
+        window.title("查找历史邮件")
+        window.geometry("640x420")
+        
+        form = Frame(window, padx=10, pady=10)
+        form.pack(fill="x")
+        Label(form, text="发件人:").grid(row=0, column=0, sticky="w")
+        self.history_sender_var = StringVar()
+        sender_entry = Entry(form, textvariable=self.history_sender_var, width=20)
+        sender_entry.grid(row=0, column=1, padx=5)
+        Label(form, text="主题关键词:").grid(row=0, column=2, sticky="w")
+        self.history_keyword_var = StringVar()
+        keyword_entry = Entry(form, textvariable=self.history_keyword_var, width=20)
+        keyword_entry.grid(row=0, column=3, padx=5)
+        self.history_range_var = StringVar(value="最近7天")
+        OptionMenu(form, self.history_range_var, *HISTORY_RANGES).grid(row=0, column=4, padx=5)
+        Button(form, text="查找", command=self.search_history, width=8).grid(row=0, column=5, padx=5)
+        for entry in (sender_entry, keyword_entry):
+            entry.bind("<Return>", lambda event: self.search_history())
+        
+        list_frame = Frame(window, padx=10)
+        list_frame.pack(fill="both", expand=True)
+        scrollbar = Scrollbar(list_frame)
+        scrollbar.pack(side="right", fill="y")
+        self.history_list = Listbox(list_frame, yscrollcommand=scrollbar.set)
+        self.history_list.pack(side="left", fill="both", expand=True)
+        scrollbar.config(command=self.history_list.yview)
+        
+        self.history_result_label = Label(window, anchor="w", padx=10, pady=5)
+        self.history_result_label.pack(fill="x")
+        
+        self.history_window = window
+        sender_entry.focus_set()
+        self.search_history()
+    
+    def search_history(self):
+        """按界面上的条件查找历史记录，在界面线程中直接查询(只需几毫秒)"""
+        from mail_history import format_row
+        days = HISTORY_RANGES[self.history_range_var.get()]
+        since = until = None
+        if days is not None:
+            today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0).timestamp()
+            since = today - days * 86400
+            # "昨天"只到今天0点
+            until = today if self.history_range_var.get() == "昨天" else None
+        
+        start = time.perf_counter()
+        rows = self.core.history.search(self.history_sender_var.get(), self.history_keyword_var.get(), since, until)
+        elapsed = (time.perf_counter() - start) * 1000
+        
+        self.history_list.delete(0, "end")
+        for row in rows:
+            acked = "" if row["acked_at"] else "  (未确认)"
+            self.history_list.insert("end", format_row(row) + acked)
+        self.history_result_label.config(text=f"找到 {len(rows)} 封，用时 {elapsed:.1f} ms")
     
     def clear_records(self):
         """清空已处理邮件记录"""
         if messagebox.askyesno("确认", "确定要清空所有已处理邮件记录吗？"):
             self.processed_emails.clear()
-            self.save_processed_emails()
             self.update_status("已清空所有邮件记录")
     
     def save_current_settings(self):
         """保存当前设置到配置文件"""
-        self.config["email_settings"] = {
+        # 用update保留界面上没有的配置项(如日志文件)
+        self.config.setdefault("email_settings", {}).update({
             "server": self.server_var.get(),
             "port": self.port_var.get(),
             "email": self.email_var.get(),
             "password": self.password_var.get()
-        }
+        })
         
-        self.config["alert_settings"] = {
+        self.config.setdefault("alert_settings", {}).update({
             "sound_file": self.sound_var.get(),
             "alert_mode": self.alert_mode.get(),
             "check_interval": int(self.interval_var.get()),
             "auto_start": self.auto_start_var.get()  # 保存自动开始设置
-        }
+        })
         
         self.save_config()
         self.update_status("设置已保存")
@@ -529,9 +534,13 @@ class EnhancedEmailAlert:
         self.start_btn.config(state="disabled")
         self.stop_btn.config(state="normal")
         
-        monitor_thread = threading.Thread(target=self.check_email)
-        monitor_thread.daemon = True
-        monitor_thread.start()
+        self.core.start(self.handle_new_emails)
+        
+        # 上次没有确认的邮件不会再从服务器取到，重新放回提醒
+        pending = self.core.pending_alerts()
+        if pending:
+            self.update_status(f"有 {len(pending)} 封邮件上次提醒后没有确认，重新提醒")
+            self.alert_queue.put(pending)
         
         self.update_status("邮件监控已启动，正在检查新邮件...")
         self.update_status(f"检查间隔: {self.interval_var.get()}秒")
@@ -540,15 +549,16 @@ class EnhancedEmailAlert:
     def stop_monitor(self):
         """停止监控"""
         self.is_running = False
+        self.core.stop()
         self.stop_alert()
         self.start_btn.config(state="normal")
         self.stop_btn.config(state="disabled")
         
-        if hasattr(self, 'alert_dialog'):
-            try:
-                self.alert_dialog.destroy()
-            except:
-                pass
+        self.close_alert_dialog()
+        # 没有确认的邮件留在历史记录中，下次开始监控时重新提醒
+        pending = self.digest.take()
+        if pending:
+            self.update_status(f"有 {len(pending)} 封新邮件未确认，下次开始监控时重新提醒")
         
         self.update_status("邮件监控已停止")
     
@@ -557,11 +567,12 @@ class EnhancedEmailAlert:
         self.save_current_settings()
         
         if self.is_running:
-            if messagebox.askokcancel("退出", "邮件监控正在运行，确定要退出吗？"):
-                self.stop_monitor()
-                self.root.destroy()
-        else:
-            self.root.destroy()
+            if not messagebox.askokcancel("退出", "邮件监控正在运行，确定要退出吗？"):
+                return
+            self.stop_monitor()
+        # 等待监控线程结束(进行中的取信会被中断)，再保存同步状态、已处理记录并关闭通知目标
+        self.core.close()
+        self.root.destroy()
     
     def run(self):
         """运行程序"""
@@ -569,48 +580,24 @@ class EnhancedEmailAlert:
 
 def main():
     """主函数"""
-    current_pid = os.getpid()
-    current_script = os.path.basename(__file__)
-    
-    for proc in psutil.process_iter(['pid', 'name']):
-        try:
-            if proc.info['pid'] != current_pid and proc.info['name'] in ['python.exe', 'pythonw.exe']:
-                cmdline = proc.cmdline()
-                if len(cmdline) > 1 and current_script in cmdline[1]:
-                    messagebox.showwarning("警告", "程序已在运行中！")
-                    return
-        except (psutil.NoSuchProcess, psutil.AccessDenied):
-            continue
+    # 锁文件随进程退出自动释放，不需要扫描系统进程
+    instance = SingleInstance()
+    if not instance.acquire():
+        messagebox.showwarning("警告", "程序已在运行中！")
+        return
     
     # 创建默认声音文件
     if not os.path.exists("alert.wav"):
         try:
-            import wave
-            import struct
-            import math
-            
-            sample_rate = 8000
-            duration = 1.0
-            frequency = 600
-            
-            with wave.open("alert.wav", "w") as wav_file:
-                wav_file.setnchannels(1)
-                wav_file.setsampwidth(2)
-                wav_file.setframerate(sample_rate)
-                
-                frames = []
-                for i in range(int(duration * sample_rate)):
-                    value = int(32767.0 * math.sin(2 * math.pi * frequency * i / sample_rate))
-                    frames.append(struct.pack('h', value))
-                
-                wav_file.writeframes(b''.join(frames))
-                
+            write_default_tone("alert.wav")
             print("已创建默认提示音文件: alert.wav")
         except Exception as e:
             print(f"创建默认声音文件失败: {e}")
     
     app = EnhancedEmailAlert()
+    app.update_status(f"启动耗时 {(time.perf_counter() - STARTED) * 1000:.0f} ms")
     app.run()
+    instance.release()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,482 @@
+# -*- coding: utf-8 -*-
+"""
+本地IMAP模拟服务器 - 用于基准测试和调试，不需要真实邮箱
+只实现监控用到的命令：CAPABILITY/LOGIN/SELECT/EXAMINE/STATUS/NOOP/IDLE/SEARCH/FETCH/LOGOUT，
+FETCH 支持 BODYSTRUCTURE 和按段号的部分取信 BODY[1.2]<0.n>
+合成邮件只保存UID，内容在取信时按UID生成，几百万封邮件也只占几十MB内存
+
+用法: python fake_imap_server.py --messages 10000 --size 20000 --mime attachment
+"""
+
+import re
+import sys
+import time
+import bisect
+import random
+import argparse
+import threading
+import socketserver
+from array import array
+from email.header import Header
+from email import message_from_bytes
+from email.parser import BytesHeaderParser
+
+SUBJECTS = ["项目周报", "Meeting notes", "发票通知", "Build failed", "系统告警", "Re: 合同确认"]
+SENDERS = [("张三", "zhangsan"), ("Alice", "alice"), ("运维中心", "ops"), ("Bob Smith", "bob")]
+
+
+def make_message(uid, size=2000, mime="plain", charset="utf-8"):
+    """按UID确定性地生成一封邮件；mime可选 plain / alternative / attachment"""
+    rng = random.Random(uid)
+    name, user = SENDERS[rng.randrange(len(SENDERS))]
+    subject = f"{SUBJECTS[rng.randrange(len(SUBJECTS))]} #{uid}"
+    sender = f"{Header(name, charset).encode()} <{user}@example.com>"
+    date = time.strftime("%a, %d %b %Y %H:%M:%S +0800", time.localtime(1700000000 + uid * 60))
+    text = ("邮件正文 " * 8 + "\r\n").encode(charset, errors="replace")
+    body = (text * (size // len(text) + 1))[:max(size, 1)]
+
+    headers = (f"From: {sender}\r\n"
+               f"To: team@example.com\r\n"
+               f"Subject: {Header(subject, charset).encode()}\r\n"
+               f"Date: {date}\r\n"
+               f"Message-ID: <{uid}.{rng.randrange(10 ** 9)}@example.com>\r\n"
+               f"MIME-Version: 1.0\r\n").encode("ascii")
+    if mime == "plain":
+        return (headers + f"Content-Type: text/plain; charset={charset}\r\n"
+                          f"Content-Transfer-Encoding: 8bit\r\n\r\n".encode("ascii") + body)
+
+    boundary = f"=_b{uid}"
+    html = b"<html><body>" + body[:size // 2] + b"</body></html>"
+    parts = [f"--{boundary}\r\nContent-Type: text/plain; charset={charset}\r\n"
+             f"Content-Transfer-Encoding: 8bit\r\n\r\n".encode("ascii") + body[:max(size // 4, 1)],
+             f"--{boundary}\r\nContent-Type: text/html; charset={charset}\r\n"
+             f"Content-Transfer-Encoding: 8bit\r\n\r\n".encode("ascii") + html]
+    subtype = "alternative"
+    if mime == "attachment":
+        subtype = "mixed"
+        blob = bytes(rng.getrandbits(8) for _ in range(64)) * (size // 64 + 1)
+        encoded = b"\r\n".join(blob[i:i + 57].hex().encode("ascii") for i in range(0, size, 57))
+        parts.append(f"--{boundary}\r\nContent-Type: application/octet-stream; name=\"data.bin\"\r\n"
+                     f"Content-Disposition: attachment; filename=\"data.bin\"\r\n\r\n".encode("ascii") + encoded)
+    return (headers + f"Content-Type: multipart/{subtype}; boundary=\"{boundary}\"\r\n\r\n".encode("ascii")
+            + b"\r\n".join(parts) + f"\r\n--{boundary}--\r\n".encode("ascii"))
+
+
+def imap_string(value):
+    return '"' + str(value).replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+
+def part_bytes(part):
+    """某一段未解码的原始内容；8位正文在 get_payload() 中已按字符集解码，需按原字符集编码回去"""
+    payload = part.get_payload()
+    if not isinstance(payload, str):
+        return b""
+    try:
+        return payload.encode(part.get_content_charset() or "ascii", "replace")
+    except LookupError:
+        return payload.encode("utf-8", "replace")
+
+
+def body_structure(part):
+    """按RFC 3501生成 BODYSTRUCTURE"""
+    if part.is_multipart():
+        children = "".join(body_structure(child) for child in part.get_payload())
+        return (f"({children} {imap_string(part.get_content_subtype().upper())} "
+                f"(\"BOUNDARY\" {imap_string(part.get_boundary())}) NIL NIL NIL)")
+    params = (part.get_params() or [])[1:]
+    param_list = "(" + " ".join(f"{imap_string(k.upper())} {imap_string(v)}" for k, v in params) + ")" if params else "NIL"
+    data = part_bytes(part)
+    encoding = part.get("Content-Transfer-Encoding", "7bit").upper()
+    fields = [imap_string(part.get_content_maintype().upper()), imap_string(part.get_content_subtype().upper()),
+              param_list, "NIL", "NIL", imap_string(encoding), str(len(data))]
+    if part.get_content_maintype() == "text":
+        fields.append(str(data.count(b"\n")))
+    disposition = part.get_content_disposition()
+    if disposition:
+        filename = part.get_filename()
+        disposition = (f"({imap_string(disposition.upper())} "
+                       + (f"(\"FILENAME\" {imap_string(filename)})" if filename else "NIL") + ")")
+    fields += ["NIL", disposition or "NIL", "NIL", "NIL"]
+    return "(" + " ".join(fields) + ")"
+
+
+def find_section(msg, section):
+    """按段号 1.2 找到对应的段，找不到时返回None"""
+    part = msg
+    for number in section.split("."):
+        if part.is_multipart():
+            children = part.get_payload()
+            index = int(number) - 1
+            if not 0 <= index < len(children):
+                return None
+            part = children[index]
+        elif number != "1":
+            return None
+    return part
+
+
+class FakeMailbox:
+    """内存中的邮箱：UID数组 + 只为有标记或显式追加的邮件保存数据"""
+
+    def __init__(self, name="INBOX", uidvalidity=1, factory=make_message):
+        self.name = name
+        self.uidvalidity = uidvalidity
+        self.factory = factory
+        self.uidnext = 1
+        self.modseq = 1
+        self.uids = array("Q")
+        self.flags = {}
+        self.raw = {}
+        self.lock = threading.Lock()
+        self.listeners = []
+
+    def __len__(self):
+        return len(self.uids)
+
+    def append(self, raw=None, flags=()):
+        """追加一封邮件(raw为None时按UID合成)，通知处于IDLE的连接，返回UID"""
+        with self.lock:
+            uid = self.uidnext
+            self.uidnext += 1
+            self.modseq += 1
+            self.uids.append(uid)
+            if raw is not None:
+                self.raw[uid] = raw
+            if flags:
+                self.flags[uid] = set(flags)
+            count = len(self.uids)
+            listeners = list(self.listeners)
+        for listener in listeners:
+            listener(count)
+        return uid
+
+    def add_synthetic(self, count, seen_ratio=0.0):
+        """批量加入合成邮件，不通知IDLE连接"""
+        with self.lock:
+            start = self.uidnext
+            self.uids.extend(range(start, start + count))
+            self.uidnext += count
+            self.modseq += 1
+            if seen_ratio:
+                step = max(1, round(1 / seen_ratio))
+                for uid in range(start, start + count, step):
+                    self.flags[uid] = {"\\Seen"}
+
+    def message(self, uid):
+        raw = self.raw.get(uid)
+        return raw if raw is not None else self.factory(uid)
+
+    def is_seen(self, uid):
+        return "\\Seen" in self.flags.get(uid, ())
+
+    def uid_range(self, lo, hi):
+        """UID在[lo, hi]内的 (序号, UID) 列表"""
+        start = bisect.bisect_left(self.uids, lo)
+        end = bisect.bisect_right(self.uids, hi)
+        return [(i + 1, self.uids[i]) for i in range(start, end)]
+
+
+def parse_set(spec, maximum):
+    """把IMAP序列集解析成若干 (下限, 上限) 区间"""
+    ranges = []
+    for part in spec.split(","):
+        if ":" in part:
+            a, b = part.split(":")
+            a = maximum if a == "*" else int(a)
+            b = maximum if b == "*" else int(b)
+            ranges.append((min(a, b), max(a, b)))
+        else:
+            n = maximum if part == "*" else int(part)
+            ranges.append((n, n))
+    return ranges
+
+
+class FakeImapServer(socketserver.ThreadingTCPServer):
+    """每个连接一个线程的明文IMAP服务器，统计收发字节数"""
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address=("127.0.0.1", 0), idle=True, condstore=True, username="user", password="pass",
+                 factory=make_message):
+        super().__init__(address, FakeImapHandler)
+        self.idle = idle
+        self.condstore = condstore
+        self.username = username
+        self.password = password
+        self.factory = factory
+        self.mailboxes = {}
+        # 收到这些命令(如 "FETCH")后不再响应，模拟卡住的服务器
+        self.stall = set()
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.commands = 0
+        self.logins = 0
+        self.stats_lock = threading.Lock()
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def mailbox(self, name="INBOX"):
+        if name not in self.mailboxes:
+            self.mailboxes[name] = FakeMailbox(name, factory=self.factory)
+        return self.mailboxes[name]
+
+    def start(self):
+        """在后台线程中运行，返回自身"""
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return self
+
+    def reset_stats(self):
+        with self.stats_lock:
+            self.bytes_sent = self.bytes_received = self.commands = 0
+
+
+class FakeImapHandler(socketserver.StreamRequestHandler):
+    # 缓冲写出，每条命令处理完再flush
+    wbufsize = 64 * 1024
+
+    def send(self, data):
+        if isinstance(data, str):
+            data = data.encode()
+        with self.server.stats_lock:
+            self.server.bytes_sent += len(data)
+        self.wfile.write(data)
+
+    def readline(self):
+        line = self.rfile.readline()
+        with self.server.stats_lock:
+            self.server.bytes_received += len(line)
+        return line
+
+    def handle(self):
+        self.selected = None
+        self.send_lock = threading.Lock()
+        capabilities = ["IMAP4rev1"]
+        if self.server.idle:
+            capabilities.append("IDLE")
+        if self.server.condstore:
+            capabilities.append("CONDSTORE")
+        self.capabilities = " ".join(capabilities)
+        self.send(f"* OK [CAPABILITY {self.capabilities}] fake imap ready\r\n")
+        self.wfile.flush()
+        while True:
+            line = self.readline()
+            if not line:
+                return
+            line = line.decode("utf-8", errors="replace").rstrip("\r\n")
+            with self.server.stats_lock:
+                self.server.commands += 1
+            tag, _, rest = line.partition(" ")
+            command, _, args = rest.partition(" ")
+            command = command.upper()
+            uid = command == "UID"
+            if uid:
+                command, _, args = args.partition(" ")
+                command = command.upper()
+            handler = getattr(self, "cmd_" + command.lower(), None)
+            if command in self.server.stall:
+                continue
+            try:
+                with self.send_lock:
+                    if handler is None:
+                        self.send(f"{tag} BAD unknown command\r\n")
+                        keep_open = True
+                    else:
+                        keep_open = handler(tag, args, uid) is not False
+                    self.wfile.flush()
+            except (OSError, ValueError) as e:
+                if isinstance(e, OSError):
+                    return
+                self.send(f"{tag} BAD {e}\r\n")
+                self.wfile.flush()
+                keep_open = True
+            if not keep_open:
+                return
+
+    def cmd_capability(self, tag, args, uid):
+        self.send(f"* CAPABILITY {self.capabilities}\r\n{tag} OK done\r\n")
+
+    def cmd_login(self, tag, args, uid):
+        user, _, password = args.partition(" ")
+        if user.strip('"') != self.server.username or password.strip('"') != self.server.password:
+            self.send(f"{tag} NO [AUTHENTICATIONFAILED] invalid credentials\r\n")
+            return
+        with self.server.stats_lock:
+            self.server.logins += 1
+        self.send(f"{tag} OK logged in\r\n")
+
+    def cmd_select(self, tag, args, uid):
+        box = self.server.mailbox(args.strip('"'))
+        self.selected = box
+        self.send(f"* {len(box)} EXISTS\r\n* 0 RECENT\r\n"
+                  f"* OK [UIDVALIDITY {box.uidvalidity}] uids valid\r\n"
+                  f"* OK [UIDNEXT {box.uidnext}] predicted next uid\r\n"
+                  f"* OK [HIGHESTMODSEQ {box.modseq}] modseq\r\n"
+                  f"{tag} OK [READ-WRITE] selected\r\n")
+
+    cmd_examine = cmd_select
+
+    def cmd_status(self, tag, args, uid):
+        name, _, items = args.strip().rpartition(" (")
+        box = self.server.mailbox(name.strip('"'))
+        values = {"MESSAGES": len(box), "UIDNEXT": box.uidnext, "UIDVALIDITY": box.uidvalidity,
+                  "HIGHESTMODSEQ": box.modseq,
+                  "UNSEEN": len(box) - sum(1 for f in box.flags.values() if "\\Seen" in f)}
+        wanted = items.rstrip(")").upper().split()
+        result = " ".join(f"{key} {values[key]}" for key in wanted if key in values)
+        self.send(f'* STATUS "{box.name}" ({result})\r\n{tag} OK status done\r\n')
+
+    def cmd_noop(self, tag, args, uid):
+        if self.selected is not None:
+            self.send(f"* {len(self.selected)} EXISTS\r\n")
+        self.send(f"{tag} OK noop done\r\n")
+
+    def cmd_idle(self, tag, args, uid):
+        box = self.selected
+
+        def notify(count):
+            try:
+                with self.send_lock:
+                    self.send(f"* {count} EXISTS\r\n")
+                    self.wfile.flush()
+            except (OSError, ValueError):
+                pass
+
+        self.send("+ idling\r\n")
+        self.wfile.flush()
+        box.listeners.append(notify)
+        # IDLE期间释放发送锁，让新邮件通知可以写出
+        self.send_lock.release()
+        try:
+            line = self.readline()
+        finally:
+            self.send_lock.acquire()
+            box.listeners.remove(notify)
+        if not line:
+            return False
+        self.send(f"{tag} OK idle done\r\n")
+
+    def cmd_close(self, tag, args, uid):
+        self.selected = None
+        self.send(f"{tag} OK closed\r\n")
+
+    def cmd_logout(self, tag, args, uid):
+        self.send(f"* BYE logging out\r\n{tag} OK bye\r\n")
+        return False
+
+    def _resolve(self, spec, uid):
+        """把序列集解析成 (序号, UID) 列表"""
+        box = self.selected
+        with box.lock:
+            if not box.uids:
+                return []
+            result = []
+            if uid:
+                for lo, hi in parse_set(spec, box.uids[-1]):
+                    result.extend(box.uid_range(lo, hi))
+            else:
+                for lo, hi in parse_set(spec, len(box.uids)):
+                    result.extend((seq, box.uids[seq - 1]) for seq in range(max(lo, 1), min(hi, len(box.uids)) + 1))
+            return result
+
+    def cmd_search(self, tag, args, uid):
+        tokens = args.upper().split()
+        if tokens[:1] == ["CHARSET"]:
+            tokens = tokens[2:]
+        spec = "1:*"
+        by_uid = True
+        if "UID" in tokens:
+            spec = tokens[tokens.index("UID") + 1]
+        elif tokens and re.match(r"^[\d:*,]+$", tokens[0]):
+            spec, by_uid = tokens[0], False
+        unseen = "UNSEEN" in tokens
+        box = self.selected
+        found = [(seq, u) for seq, u in self._resolve(spec, by_uid) if not (unseen and box.is_seen(u))]
+        numbers = " ".join(str(u if uid else seq) for seq, u in found)
+        self.send(f"* SEARCH {numbers}".rstrip() + f"\r\n{tag} OK search done\r\n")
+
+    def cmd_fetch(self, tag, args, uid):
+        spec, _, items = args.partition(" ")
+        upper = items.upper()
+        box = self.selected
+        fields = re.search(r"BODY(?:\.PEEK)?\[HEADER\.FIELDS \(([^)]*)\)\]", upper)
+        partial = re.search(r"BODY(?:\.PEEK)?\[([\d.]*)\](?:<(\d+)\.(\d+)>)?", upper)
+        parser = BytesHeaderParser()
+        for seq, u in self._resolve(spec, uid):
+            out = []
+            if uid or "UID" in upper:
+                out.append(f"UID {u}")
+            if "FLAGS" in upper:
+                out.append(f"FLAGS ({' '.join(sorted(box.flags.get(u, ())))})")
+            literal = None
+            if fields or partial or "RFC822" in upper or "BODYSTRUCTURE" in upper:
+                raw = box.message(u)
+                if "RFC822.SIZE" in upper:
+                    out.append(f"RFC822.SIZE {len(raw)}")
+                if "BODYSTRUCTURE" in upper:
+                    out.append(f"BODYSTRUCTURE {body_structure(message_from_bytes(raw))}")
+                if fields:
+                    names = fields.group(1).split()
+                    head = raw.split(b"\r\n\r\n", 1)[0] + b"\r\n\r\n"
+                    msg = parser.parsebytes(head)
+                    data = b"".join(f"{k}: {v}\r\n".encode("utf-8", "surrogateescape")
+                                    for k, v in msg.items() if k.upper() in names) + b"\r\n"
+                    literal = (f"BODY[HEADER.FIELDS ({fields.group(1)})]", data)
+                elif partial and not partial.group(1):
+                    data = raw
+                    name = "BODY[]"
+                    if partial.group(2) is not None:
+                        start, length = int(partial.group(2)), int(partial.group(3))
+                        data = raw[start:start + length]
+                        name = f"BODY[]<{start}>"
+                    literal = (name, data)
+                elif partial:
+                    part = find_section(message_from_bytes(raw), partial.group(1))
+                    data = part_bytes(part) if part is not None else b""
+                    name = f"BODY[{partial.group(1)}]"
+                    if partial.group(2) is not None:
+                        start, length = int(partial.group(2)), int(partial.group(3))
+                        data = data[start:start + length]
+                        name += f"<{start}>"
+                    literal = (name, data)
+                elif re.search(r"RFC822(?![.\w])", upper):
+                    literal = ("RFC822", raw)
+                if literal and "PEEK" not in upper:
+                    box.flags.setdefault(u, set()).add("\\Seen")
+            head = f"* {seq} FETCH (" + " ".join(out)
+            if literal is None:
+                self.send(head + ")\r\n")
+                continue
+            name, data = literal
+            self.send(head + (" " if out else "") + f"{name} {{{len(data)}}}\r\n")
+            self.send(data)
+            self.send(")\r\n")
+        self.send(f"{tag} OK fetch done\r\n")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="本地IMAP模拟服务器")
+    parser.add_argument("--port", type=int, default=1143)
+    parser.add_argument("--messages", type=int, default=1000, help="INBOX中预置的合成邮件数")
+    parser.add_argument("--size", type=int, default=2000, help="每封邮件正文字节数")
+    parser.add_argument("--mime", choices=["plain", "alternative", "attachment"], default="plain")
+    parser.add_argument("--charset", default="utf-8", help="邮件头和正文编码，如 utf-8 / gbk / gb2312")
+    parser.add_argument("--no-idle", action="store_true", help="不声明IDLE能力")
+    args = parser.parse_args(argv)
+
+    factory = lambda uid: make_message(uid, args.size, args.mime, args.charset)
+    server = FakeImapServer(("127.0.0.1", args.port), idle=not args.no_idle, factory=factory)
+    server.mailbox().add_synthetic(args.messages)
+    print(f"模拟IMAP服务器: 127.0.0.1:{server.port} 用户 user / 密码 pass，INBOX {args.messages} 封邮件")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,230 @@
+# -*- coding: utf-8 -*-
+"""
+提醒声音 - WAV文件只读取解码一次，之后从内存播放
+播放在后台线程进行，不阻塞调用方；stop() 立即打断正在播放的声音，不必等一遍放完
+后端可替换：Windows用winsound，Linux用aplay，都没有时用只记录不出声的空后端
+"""
+
+import os
+import sys
+import math
+import wave
+import shutil
+import threading
+import subprocess
+from array import array
+
+# 循环提醒时两遍之间的间隔(秒)
+LOOP_GAP = 2.0
+
+# 默认提示音：600Hz正弦波，1秒，8kHz单声道16位
+DEFAULT_TONE = {"frequency": 600, "duration": 1.0, "sample_rate": 8000}
+
+# aplay 的采样格式，按每个采样的字节数
+APLAY_FORMATS = {1: "U8", 2: "S16_LE", 3: "S24_3LE", 4: "S32_LE"}
+
+
+class AudioError(Exception):
+    """声音文件无法读取或播放"""
+
+
+class Sound:
+    """解码到内存中的WAV：原始PCM数据和完整的WAV文件内容"""
+
+    def __init__(self, path):
+        self.path = path
+        try:
+            stat = os.stat(path)
+            with open(path, "rb") as f:
+                self.wav_bytes = f.read()
+            with wave.open(path, "rb") as wav_file:
+                self.channels = wav_file.getnchannels()
+                self.sample_width = wav_file.getsampwidth()
+                self.frame_rate = wav_file.getframerate()
+                self.pcm = wav_file.readframes(wav_file.getnframes())
+        except FileNotFoundError:
+            raise AudioError(f"声音文件不存在: {path}") from None
+        except (OSError, EOFError, wave.Error) as e:
+            raise AudioError(f"无法读取声音文件 {path}: {e}") from None
+        # 文件被替换后重新加载
+        self.signature = (stat.st_mtime_ns, stat.st_size)
+
+    @property
+    def duration(self):
+        frame_bytes = self.channels * self.sample_width
+        return len(self.pcm) / frame_bytes / self.frame_rate if frame_bytes and self.frame_rate else 0.0
+
+    def is_current(self, path):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return False
+        return path == self.path and (stat.st_mtime_ns, stat.st_size) == self.signature
+
+
+def tone_pcm(frequency, duration, sample_rate, amplitude=32767):
+    """生成正弦波的16位PCM数据：只计算一个完整周期，再整段重复"""
+    # 整数个波形恰好占满的最少采样数，如 600Hz/8kHz 时40个采样正好3个波形
+    period = sample_rate // math.gcd(sample_rate, frequency)
+    cycle = array("h", (int(amplitude * math.sin(2 * math.pi * frequency * i / sample_rate)) for i in range(period)))
+    count = int(duration * sample_rate)
+    samples = (cycle * (count // period + 1))[:count]
+    if sys.byteorder == "big":
+        samples.byteswap()
+    return samples.tobytes()
+
+
+def write_default_tone(path, frequency=DEFAULT_TONE["frequency"], duration=DEFAULT_TONE["duration"],
+                       sample_rate=DEFAULT_TONE["sample_rate"]):
+    """生成默认提示音WAV文件"""
+    with wave.open(path, "wb") as wav_file:
+        wav_file.setnchannels(1)
+        wav_file.setsampwidth(2)
+        wav_file.setframerate(sample_rate)
+        wav_file.writeframes(tone_pcm(frequency, duration, sample_rate))
+
+
+class WinsoundBackend:
+    """Windows：从内存播放WAV(SND_MEMORY)，停止时 PlaySound(None) 立即打断"""
+
+    name = "winsound"
+
+    def __init__(self):
+        import winsound
+        self.winsound = winsound
+
+    def play(self, sound, stop_event):
+        # SND_MEMORY 不能与 SND_ASYNC 同用，在播放线程中同步播放
+        if stop_event.is_set():
+            return
+        self.winsound.PlaySound(sound.wav_bytes, self.winsound.SND_MEMORY | self.winsound.SND_NODEFAULT)
+
+    def stop(self):
+        self.winsound.PlaySound(None, 0)
+
+
+class AplayBackend:
+    """Linux：把PCM数据写入 aplay 的标准输入，停止时结束进程"""
+
+    name = "aplay"
+
+    def __init__(self, command="aplay"):
+        self.command = shutil.which(command)
+        if self.command is None:
+            raise AudioError(f"找不到 {command}")
+        self.process = None
+        self.lock = threading.Lock()
+
+    def play(self, sound, stop_event):
+        sample_format = APLAY_FORMATS.get(sound.sample_width)
+        if sample_format is None:
+            raise AudioError(f"不支持的采样位数: {sound.sample_width * 8}")
+        args = [self.command, "-q", "-t", "raw", "-f", sample_format,
+                "-c", str(sound.channels), "-r", str(sound.frame_rate), "-"]
+        with self.lock:
+            if stop_event.is_set():
+                return
+            self.process = subprocess.Popen(args, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL,
+                                            stderr=subprocess.DEVNULL)
+        process = self.process
+        try:
+            process.stdin.write(sound.pcm)
+            process.stdin.close()
+        except (BrokenPipeError, OSError):
+            pass
+        process.wait()
+        with self.lock:
+            if self.process is process:
+                self.process = None
+
+    def stop(self):
+        with self.lock:
+            if self.process is not None and self.process.poll() is None:
+                self.process.kill()
+
+
+class NullBackend:
+    """不出声，只记录播放；按声音时长等待，stop() 同样立即生效。用于测试和没有声卡的环境"""
+
+    name = "null"
+
+    def __init__(self):
+        self.plays = []
+
+    def play(self, sound, stop_event):
+        self.plays.append(sound.path)
+        stop_event.wait(sound.duration)
+
+    def stop(self):
+        pass
+
+
+def default_backend():
+    """按平台选择可用的后端"""
+    for backend in (WinsoundBackend, AplayBackend):
+        try:
+            return backend()
+        except (ImportError, AudioError):
+            continue
+    return NullBackend()
+
+
+class AudioPlayer:
+    """缓存声音并在后台线程播放，同一时间只播放一个声音"""
+
+    def __init__(self, backend=None, on_error=print):
+        self.backend = backend if backend is not None else default_backend()
+        self.on_error = on_error
+        self.sound = None
+        self.thread = None
+        self.looping = False
+        self.stop_event = threading.Event()
+        self.lock = threading.Lock()
+        self.play_lock = threading.Lock()
+
+    def load(self, path):
+        """读取并缓存声音文件；文件没有变化时直接使用缓存"""
+        with self.lock:
+            if self.sound is None or not self.sound.is_current(path):
+                self.sound = Sound(path)
+            return self.sound
+
+    def play_once(self, path):
+        """播放一遍，立即返回；正在循环播放时不打断"""
+        self._start(self.load(path), loop=False)
+
+    def play_loop(self, path, gap=LOOP_GAP):
+        """循环播放直到 stop()，立即返回"""
+        self._start(self.load(path), loop=True, gap=gap)
+
+    def stop(self):
+        """停止播放，正在播放的声音立即中断"""
+        self.stop_event.set()
+        self.backend.stop()
+        thread = self.thread
+        if thread is not None and thread is not threading.current_thread():
+            thread.join(timeout=1)
+
+    @property
+    def is_playing(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    def _start(self, sound, loop, gap=LOOP_GAP):
+        # 多个账号可能同时提醒，由引擎的不同线程调用
+        with self.play_lock:
+            if not loop and self.looping and self.is_playing:
+                return
+            self.stop()
+            self.looping = loop
+            self.stop_event = threading.Event()
+            self.thread = threading.Thread(target=self._play, args=(sound, loop, gap, self.stop_event), daemon=True)
+            self.thread.start()
+
+    def _play(self, sound, loop, gap, stop_event):
+        try:
+            while not stop_event.is_set():
+                self.backend.play(sound, stop_event)
+                if not loop or stop_event.wait(gap):
+                    break
+        except Exception as e:
+            self.on_error(f"播放声音失败: {e}")
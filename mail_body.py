@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+"""
+邮件正文摘要 - 按需取正文，不下载整封邮件
+先取 BODYSTRUCTURE 找出正文所在的文本段，再用部分取信 BODY.PEEK[段]<0.字节数> 只下载开头一段，
+按邮件声明的编码(base64/quoted-printable)和字符集(GBK/GB2312等)解码，附件不会被下载
+"""
+
+import re
+import codecs
+import binascii
+from itertools import takewhile
+from html import unescape
+
+# 规则需要检查正文时默认取的字节数
+SNIPPET_BYTES = 4096
+
+# 这些字符集按超集解码，避免生僻字乱码
+CHARSET_ALIASES = {
+    "gb2312": "gb18030",
+    "gbk": "gb18030",
+    "x-gbk": "gb18030",
+    "cp936": "gb18030",
+    "big5": "big5hkscs",
+    # 声明为ASCII的邮件常常直接带着8位文字
+    "us-ascii": "utf-8",
+    "ascii": "utf-8",
+}
+
+# 记号：括号、带引号的字符串、原子(BODY[HEADER.FIELDS (A B)]<0> 方括号里的空格和括号也属于原子)
+TOKEN_RE = re.compile(rb'([()])|"((?:[^"\\]|\\.)*)"|([^\s()"\[]+(?:\[[^\]]*\][^\s()]*)?)')
+QUOTED_ESCAPE_RE = re.compile(rb"\\(.)")
+TAG_RE = re.compile(r"<(script|style)\b.*?</\1\s*>|<[^>]*>", re.IGNORECASE | re.DOTALL)
+SPACE_RE = re.compile(r"\s+")
+
+
+def tokenize(parts):
+    """把一条FETCH响应(文本行与字面量交替)拆成记号：( ) 原子(bytes) 字符串(bytearray) None(NIL)"""
+    for part in parts:
+        if isinstance(part, tuple):
+            line, literal = part
+            yield from tokenize_text(line[:line.rindex(b"{")])
+            yield bytearray(literal)
+        else:
+            yield from tokenize_text(part)
+
+
+def tokenize_text(text):
+    for match in TOKEN_RE.finditer(text):
+        paren, quoted, atom = match.groups()
+        if paren is not None:
+            yield paren
+        elif quoted is not None:
+            yield bytearray(QUOTED_ESCAPE_RE.sub(rb"\1", quoted))
+        elif atom.upper() == b"NIL":
+            yield None
+        else:
+            yield atom
+
+
+def parse_list(tokens):
+    """把记号流读成嵌套列表，遇到 ) 返回；字符串是bytearray，不会与括号混淆"""
+    items = []
+    for token in tokens:
+        if isinstance(token, bytes) and token == b"(":
+            items.append(parse_list(tokens))
+        elif isinstance(token, bytes) and token == b")":
+            return items
+        else:
+            items.append(token)
+    return items
+
+
+def parse_fetch_items(parts):
+    """解析一条 * n FETCH (...) 响应，返回 {"UID": 5, "BODYSTRUCTURE": [...], "BODY[1]<0>": b"..."}"""
+    tokens = iter(tokenize(parts))
+    for token in tokens:
+        if isinstance(token, bytes) and token == b"(":
+            break
+    values = parse_list(tokens)
+    items = {}
+    for key, value in zip(values[0::2], values[1::2]):
+        key = bytes(key).decode("ascii", errors="replace").upper()
+        if key == "UID":
+            value = int(value)
+        items[key] = value
+    return items
+
+
+def text(value):
+    return bytes(value).decode("ascii", errors="replace") if value is not None else ""
+
+
+def params(value):
+    """BODYSTRUCTURE 中的参数表 ("CHARSET" "GBK" "NAME" "a.txt") 转成字典"""
+    if not isinstance(value, list):
+        return {}
+    return {text(k).lower(): text(v) for k, v in zip(value[0::2], value[1::2])}
+
+
+def find_text_part(structure, prefix=""):
+    """在 BODYSTRUCTURE 中找正文：优先 text/plain，其次 text/html，跳过附件和内嵌邮件
+
+    返回 {"section", "subtype", "encoding", "charset", "size"}，没有正文时返回None
+    """
+    plain = html = None
+    for section, part in walk_parts(structure, prefix):
+        subtype = text(part[1]).lower()
+        disposition = part[9] if len(part) > 9 and isinstance(part[9], list) else None
+        if disposition and text(disposition[0]).lower() == "attachment":
+            continue
+        info = {
+            "section": section,
+            "subtype": subtype,
+            "encoding": text(part[5]).lower(),
+            "charset": params(part[2]).get("charset", "us-ascii"),
+            "size": int(part[6]) if part[6] else 0,
+        }
+        if subtype == "plain" and plain is None:
+            plain = info
+        elif subtype == "html" and html is None:
+            html = info
+    return plain or html
+
+
+def walk_parts(structure, prefix=""):
+    """依次给出各个 text/* 段的 (段号, 结构)"""
+    if structure and isinstance(structure[0], list):
+        # 多段结构：开头连续的列表是各子段，之后是子类型和参数
+        children = takewhile(lambda item: isinstance(item, list), structure)
+        for number, child in enumerate(children, 1):
+            yield from walk_parts(child, f"{prefix}.{number}" if prefix else str(number))
+    elif len(structure) > 6 and text(structure[0]).lower() == "text":
+        # 单段邮件的正文段号也是1
+        yield prefix or "1", structure
+
+
+def decode_transfer(data, encoding, truncated=False):
+    """按 Content-Transfer-Encoding 解码，截断的数据去掉末尾不完整的部分"""
+    if encoding == "base64":
+        data = re.sub(rb"[^A-Za-z0-9+/=]", b"", data)
+        data = data[:len(data) - len(data) % 4]
+        try:
+            return binascii.a2b_base64(data)
+        except binascii.Error:
+            return b""
+    if encoding == "quoted-printable":
+        if truncated:
+            data = re.sub(rb"=[0-9A-Fa-f]?$", b"", data)
+        return binascii.a2b_qp(data)
+    return data
+
+
+def decode_charset(data, charset, truncated=False):
+    """按声明的字符集解码，未知字符集按UTF-8；截断处被切开的多字节字符直接丢弃"""
+    charset = (charset or "us-ascii").strip().lower()
+    charset = CHARSET_ALIASES.get(charset, charset)
+    try:
+        decoder = codecs.getincrementaldecoder(charset)(errors="replace")
+    except LookupError:
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    return decoder.decode(data, final=not truncated)
+
+
+def decode_snippet(data, part):
+    """把取回的正文片段解码成去掉多余空白的文本"""
+    truncated = len(data) < part["size"]
+    content = decode_charset(decode_transfer(bytes(data), part["encoding"], truncated), part["charset"], truncated)
+    if part["subtype"] == "html":
+        content = unescape(TAG_RE.sub(" ", content))
+    return SPACE_RE.sub(" ", content).strip()
@@ -0,0 +1,349 @@
+# -*- coding: utf-8 -*-
+"""
+邮件提醒核心 - 不依赖界面
+负责配置、已处理邮件记录、同步状态和监控引擎，Tk界面和后台服务都建立在它之上
+"""
+
+import os
+import json
+import copy
+import logging
+import threading
+
+from mail_history import HistoryStore
+from mail_metrics import MetricsServer, registry
+from mail_store import ProcessedStore
+
+# 默认配置
+DEFAULT_CONFIG = {
+    "email_settings": {
+        "server": "imap.qq.com",
+        "port": "993",
+        "email": "",
+        "password": ""
+    },
+    "alert_settings": {
+        "sound_file": "alert.wav",
+        "alert_mode": "popup",
+        "check_interval": 30,
+        "auto_start": False,  # 新增：是否自动开始监控
+        "log_file": "",  # 状态日志文件，为空则不写文件
+        "preview_bytes": 0,  # 提醒时显示的正文摘要字节数，0表示不取正文
+        "digest_window": 2,  # 弹窗提醒前等待后续邮件的秒数，期间到达的邮件合并成一次提醒
+        "parse_workers": 0,  # 积压邮件较多时解析邮件头的子进程数，0表示不使用子进程
+        "processed_max_records": 100000,  # 已处理记录保留的条数，0表示不限(几百万条也只占几MB内存)
+        "processed_max_days": 180  # 已处理记录保留的天数，0表示不限
+    },
+    # 附加监控的账号，每项字段同 email_settings，可另加 name/mailbox/mailboxes/check_interval
+    "accounts": [],
+    # 提醒规则，按顺序取第一条命中的规则，格式见 alert_rules.py
+    "rules": [],
+    # 提醒通知目标(webhook/desktop/jsonl/socket)，格式见 mail_notify.py
+    "notifiers": [],
+    # 指标HTTP端口，0表示不开启；同一端口上可 POST /ack 远程确认提醒
+    "metrics_port": 0,
+    # 指标服务监听的地址，改为 0.0.0.0 才能从其他机器访问，此时应设置 ack_token
+    "metrics_host": "127.0.0.1",
+    # 远程确认需要带上的口令(?token=)，为空则不检查
+    "ack_token": "",
+    "window_position": {
+        "width": 600,
+        "height": 500
+    }
+}
+
+# 状态日志文件轮转大小和备份个数
+LOG_FILE_MAX_BYTES = 1024 * 1024
+LOG_FILE_BACKUPS = 3
+# 退出时等待监控线程结束的最长秒数，引擎自身在 STOP_GRACE 后中断进行中的命令
+STOP_TIMEOUT = 2
+
+
+class MailAlertCore:
+    """配置、已处理记录、同步状态和监控引擎的组合，不导入任何界面库"""
+
+    def __init__(self, config_file="app_config.json", on_status=print, shard=None):
+        self.config_file = config_file
+        # 分片运行时的工作进程编号：与其他进程共用记录文件，日志文件按分片分开
+        self.shard = shard
+        # 只监控这些账号(account_id)，None表示配置中的全部账号
+        self.account_ids = None
+        # 正在监控的账号名，待确认邮件数只统计这些账号
+        self.account_names = []
+        self.processed_file = "processed_emails.db"
+        self.legacy_processed_file = "processed_emails.json"
+        self.sync_file = "sync_state.db"
+        self.legacy_sync_file = "sync_state.json"
+        self.history_file = "mail_history.db"
+        self.on_status = on_status
+        self.status_logger = None
+        self.engine = None
+        self.monitor_thread = None
+        self.metrics = registry
+        self.metrics_server = None
+        self.notifier = None
+        # 界面设置：远程确认时调用，没有设置时不提供确认地址
+        self.on_ack = None
+
+        self.load_config()
+        self.setup_log_file()
+        self.load_processed_emails()
+        # 提醒过的邮件的发件人、主题等，确认后仍可查找
+        self.history = HistoryStore(self.history_file)
+        # 规则和监控引擎(asyncio/ssl)在开始监控时才加载，界面可以先显示出来
+        self.rules = None
+        self.sync_store = None
+
+    def load_config(self):
+        """加载应用程序配置"""
+        try:
+            if os.path.exists(self.config_file):
+                with open(self.config_file, 'r', encoding='utf-8') as f:
+                    self.config = json.load(f)
+            else:
+                self.config = copy.deepcopy(DEFAULT_CONFIG)
+                self.save_config()
+        except Exception as e:
+            print(f"加载配置失败: {e}")
+            self.config = copy.deepcopy(DEFAULT_CONFIG)
+
+    def save_config(self):
+        """保存应用程序配置"""
+        try:
+            with open(self.config_file, 'w', encoding='utf-8') as f:
+                json.dump(self.config, f, ensure_ascii=False, indent=2)
+        except Exception as e:
+            print(f"保存配置失败: {e}")
+
+    def setup_log_file(self):
+        """配置了日志文件时，把状态同时写入按大小轮转的文件"""
+        log_file = self.config.get("alert_settings", {}).get("log_file")
+        if not log_file:
+            return
+        if self.shard is not None:
+            # 轮转文件不能由多个进程同时写
+            root, ext = os.path.splitext(log_file)
+            log_file = f"{root}.{self.shard}{ext}"
+        from logging.handlers import RotatingFileHandler
+        try:
+            handler = RotatingFileHandler(log_file, maxBytes=LOG_FILE_MAX_BYTES,
+                                          backupCount=LOG_FILE_BACKUPS, encoding='utf-8')
+            handler.setFormatter(logging.Formatter("%(asctime)s %(message)s"))
+            self.status_logger = logging.getLogger("mail_alert.status")
+            self.status_logger.setLevel(logging.INFO)
+            self.status_logger.propagate = False
+            self.status_logger.addHandler(handler)
+        except Exception as e:
+            print(f"打开日志文件失败: {e}")
+
+    def processed_retention(self):
+        """已处理记录的保留条数和天数，配置中没有时使用 mail_store 的默认值"""
+        from mail_store import MAX_AGE_DAYS, MAX_RECORDS
+        settings = self.config.get("alert_settings", {})
+        return {
+            "max_records": int(settings.get("processed_max_records", MAX_RECORDS) or 0),
+            "max_age_days": float(settings.get("processed_max_days", MAX_AGE_DAYS) or 0),
+        }
+
+    def load_processed_emails(self):
+        """打开已处理的邮件记录，首次运行时导入旧版JSON记录"""
+        self.processed_emails = ProcessedStore(self.processed_file, **self.processed_retention())
+        try:
+            imported = self.processed_emails.import_json(self.legacy_processed_file)
+            if imported:
+                print(f"已导入旧版邮件记录 {imported} 条")
+        except Exception as e:
+            print(f"导入旧版邮件记录失败: {e}")
+
+    def load_rules(self):
+        """编译提醒规则，规则有误时不使用任何规则"""
+        from alert_rules import RuleError, RuleSet
+        try:
+            self.rules = RuleSet(self.config.get("rules") or [])
+        except RuleError as e:
+            print(f"提醒规则有误，已忽略全部规则: {e}")
+            self.rules = RuleSet()
+
+    def load_notifier(self):
+        """按配置创建通知目标，只创建一次"""
+        if self.notifier is None:
+            from mail_notify import load_notifier
+            self.notifier = load_notifier(self.config, self.metrics, self.status)
+
+    def body_bytes(self):
+        """每封新邮件取正文开头的字节数：规则检查正文或提醒显示摘要时才取，0表示不取"""
+        from mail_body import SNIPPET_BYTES
+        body_bytes = int(self.config.get("alert_settings", {}).get("preview_bytes") or 0)
+        if self.rules is not None and self.rules.needs_body:
+            body_bytes = max(body_bytes, SNIPPET_BYTES)
+        return body_bytes
+
+    def route(self, new_emails, default_action="loop"):
+        """按提醒规则给新邮件分组，只需记录的邮件直接标记为已处理
+
+        返回 {"loop": [...], "once": [...]}，没有命中规则的邮件使用 default_action
+        """
+        account = new_emails[0]['account'] if new_emails else ""
+        with self.metrics.timer("rules", account=account):
+            groups = self.rules.route(new_emails, default_action)
+        with self.metrics.timer("persistence", account=account):
+            self.history.record(new_emails)
+        self.update_pending_metric()
+        for email_info in new_emails:
+            if email_info['rule']:
+                self.metrics.inc("mail_rule_matches_total", rule=email_info['rule'])
+        silent = groups.pop("silent", None)
+        if silent:
+            for email_info in silent:
+                self.status(f"[{email_info['rule']}] 静默记录: {email_info['from']} - {email_info['subject']}")
+            self.mark_processed(silent)
+        self.notify(account, [email_info for group in groups.values() for email_info in group])
+        return groups
+
+    def status(self, msg):
+        """输出状态(可在任意线程调用)"""
+        if self.status_logger is not None:
+            self.status_logger.info(msg)
+        self.on_status(msg)
+
+    def start_metrics_server(self):
+        """配置了端口时启动指标HTTP服务，只启动一次"""
+        port = int(self.config.get("metrics_port") or 0)
+        if not port or self.metrics_server is not None:
+            return
+        host = self.config.get("metrics_host") or "127.0.0.1"
+        try:
+            self.metrics_server = MetricsServer(self.metrics, port, host, actions={"/ack": self.handle_ack}).start()
+            self.status(f"指标服务: http://{host}:{port}/metrics")
+        except OSError as e:
+            self.status(f"启动指标服务失败: {e}")
+
+    def handle_ack(self, params):
+        """POST /ack：远程确认当前提醒(在HTTP服务线程中调用)"""
+        token = self.config.get("ack_token")
+        if token and params.get("token") != token:
+            return 403, {"ok": False, "error": "token错误"}
+        if self.on_ack is None:
+            return 409, {"ok": False, "error": "没有需要确认的提醒"}
+        self.on_ack()
+        self.status("已收到远程确认")
+        return 200, {"ok": True}
+
+    def ack_url(self):
+        if self.on_ack is None or self.metrics_server is None:
+            return None
+        host, port = self.metrics_server.address[0], self.metrics_server.port
+        return f"http://{'127.0.0.1' if host in ('', '0.0.0.0') else host}:{port}/ack"
+
+    def notify(self, account, emails):
+        """把需要提醒的邮件交给通知队列，不等待发送"""
+        if self.notifier is not None and emails:
+            from mail_notify import build_event
+            self.notifier.notify(build_event(account, emails, self.ack_url()))
+
+    def mark_processed(self, new_emails):
+        """标记邮件为已处理，一次写入"""
+        account = new_emails[0]['account'] if new_emails else ""
+        keys = [email_info['key'] for email_info in new_emails]
+        with self.metrics.timer("persistence", account=account):
+            self.processed_emails.add_many(keys)
+            self.history.acknowledge(keys)
+        self.update_pending_metric()
+        for email_info in new_emails:
+            self.status(f"标记邮件为已处理: {email_info['subject']}")
+
+    def update_pending_metric(self):
+        """按提醒历史更新各账号待确认的邮件数；只统计本进程监控的账号，分片运行时不重复计数"""
+        counts = self.history.unacknowledged_counts()
+        for name in self.account_names:
+            self.metrics.set("mail_pending_alerts", counts.get(name, 0), account=name)
+
+    def pending_alerts(self):
+        """上次提醒后没有确认就停止或退出的邮件：引擎不会再次取到它们，需要重新提醒
+
+        已经标记为已处理的(例如另一个进程确认过)只补记确认时间；返回的邮件与引擎取到的格式相同
+        """
+        rows = self.history.unacknowledged()
+        if not rows:
+            return []
+        processed = self.processed_emails.existing([row['mail_key'] for row in rows])
+        if processed:
+            self.history.acknowledge(processed)
+            self.update_pending_metric()
+        return [{'key': row['mail_key'], 'account': row['account'], 'mailbox': row['mailbox'],
+                 'from': row['sender'], 'subject': row['subject'], 'date': row['date'],
+                 'arrived': row['received_at'], 'action': row['action'], 'rule': row['rule']}
+                for row in rows if row['mail_key'] not in processed]
+
+    def create_engine(self, on_new_mail):
+        """按当前配置创建监控引擎；on_new_mail(账号名, 新邮件列表)"""
+        from mail_engine import MonitorEngine, SyncStateStore, account_id, load_accounts
+        if self.sync_store is None:
+            self.sync_store = SyncStateStore(self.sync_file)
+            try:
+                imported = self.sync_store.import_json(self.legacy_sync_file)
+                if imported:
+                    self.status(f"已导入旧版同步状态 {imported} 个邮箱")
+            except Exception as e:
+                self.status(f"导入旧版同步状态失败: {e}")
+        self.load_rules()
+        self.load_notifier()
+        accounts = load_accounts(self.config)
+        if self.account_ids is not None:
+            accounts = [account for account in accounts if account_id(account) in self.account_ids]
+        self.start_metrics_server()
+        self.engine = MonitorEngine(accounts, self.sync_store, self.processed_emails,
+                                    on_new_mail=on_new_mail, on_status=self.status, metrics=self.metrics,
+                                    body_bytes=self.body_bytes(),
+                                    parse_workers=int(self.config.get("alert_settings", {}).get("parse_workers") or 0))
+        self.account_names = [account["name"] for account in accounts]
+        self.update_pending_metric()
+        self.status(f"监控账号数: {len(accounts)}")
+        return self.engine
+
+    def run(self, on_new_mail):
+        """在当前线程阻塞运行监控，直到 stop() 被调用"""
+        self._run_engine(self.create_engine(on_new_mail))
+
+    def start(self, on_new_mail):
+        """在后台线程运行监控"""
+        engine = self.create_engine(on_new_mail)
+        self.monitor_thread = threading.Thread(target=self._run_engine, args=(engine,))
+        self.monitor_thread.daemon = True
+        self.monitor_thread.start()
+
+    def _run_engine(self, engine):
+        try:
+            engine.run()
+        except Exception as e:
+            self.status(f"监控引擎异常退出: {str(e)}")
+
+    def stop(self, timeout=None):
+        """停止监控引擎，可从任意线程调用；给出timeout时等待后台监控线程结束，返回是否已结束"""
+        if self.engine is not None:
+            self.engine.stop()
+            self.engine = None
+        thread = self.monitor_thread
+        if timeout is None or thread is None:
+            return thread is None or not thread.is_alive()
+        thread.join(timeout)
+        if thread.is_alive():
+            return False
+        self.monitor_thread = None
+        return True
+
+    def close(self):
+        """停止监控并等待其结束，再保存和关闭各个存储；退出前调用"""
+        if not self.stop(STOP_TIMEOUT):
+            self.status(f"监控线程 {STOP_TIMEOUT} 秒内没有结束")
+        if self.notifier is not None:
+            self.notifier.close()
+            self.notifier = None
+        if self.metrics_server is not None:
+            self.metrics_server.stop()
+            self.metrics_server = None
+        if self.sync_store is not None:
+            self.sync_store.close()
+            self.sync_store = None
+        self.processed_emails.close()
+        self.history.close()
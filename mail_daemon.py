@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+"""
+无界面后台服务 - 读取 app_config.json，运行与界面版相同的监控流程
+适合在没有显示器的服务器上用 systemd 等方式运行，不导入 tkinter
+
+用法: python mail_daemon.py [-c app_config.json] [-w 工作进程数]
+"""
+
+import time
+# 冷启动计时从导入本模块开始
+STARTED = time.perf_counter()
+
+import sys
+import signal
+import logging
+import argparse
+
+from mail_core import MailAlertCore
+from mail_instance import SingleInstance
+
+logger = logging.getLogger("mail_alert")
+
+# 日志中正文摘要最多显示的字数
+PREVIEW_CHARS = 200
+
+
+class MailDaemon:
+    """后台服务：新邮件写入日志并直接标记为已处理"""
+
+    # 收到这些信号时让引擎正常退出
+    STOP_SIGNALS = (signal.SIGTERM, signal.SIGINT)
+
+    def __init__(self, config_file, shard=None, account_ids=None):
+        self.core = MailAlertCore(config_file, on_status=logger.info, shard=shard)
+        if account_ids is not None:
+            self.core.account_ids = set(account_ids)
+
+    def handle_new_emails(self, account, new_emails):
+        """收到新邮件后提醒(在引擎的线程池中调用)"""
+        groups = self.core.route(new_emails)
+        alerted = [email_info for group in groups.values() for email_info in group]
+        for email_info in alerted:
+            rule = f" ({email_info['rule']})" if email_info['rule'] else ""
+            logger.warning(f"[{account}] 新邮件{rule}: {email_info['from']} - {email_info['subject']}")
+            if email_info.get('snippet'):
+                logger.info(f"    {email_info['snippet'][:PREVIEW_CHARS]}")
+        if alerted:
+            self.core.mark_processed(alerted)
+
+    def run(self):
+        if not self.core.config.get("email_settings", {}).get("email") and not self.core.config.get("accounts"):
+            logger.error(f"配置文件中没有邮箱账号: {self.core.config_file}")
+            return 1
+
+        # SIGTERM(systemd停止服务) 和 Ctrl+C 都让引擎正常退出
+        for signum in self.STOP_SIGNALS:
+            signal.signal(signum, lambda *args: self.core.stop())
+
+        logger.info(f"启动耗时 {(time.perf_counter() - STARTED) * 1000:.0f} ms")
+        self.core.run(self.handle_new_emails)
+        self.core.close()
+        logger.info("邮件监控已停止")
+        return 0
+
+
+def main(argv=None):
+    """主函数"""
+    parser = argparse.ArgumentParser(description="邮件提醒后台服务")
+    parser.add_argument("-c", "--config", default="app_config.json", help="配置文件路径")
+    parser.add_argument("-v", "--verbose", action="store_true", help="输出调试信息")
+    parser.add_argument("-w", "--workers", type=int, default=1,
+                        help="账号很多时按一致性哈希分到多个工作进程，由本进程监督；1为单进程运行")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.INFO,
+                        format="%(asctime)s %(levelname)s %(message)s")
+    # 与界面版共用当前目录下的记录文件，同一目录只能运行一个
+    with SingleInstance() as acquired:
+        if not acquired:
+            logger.error("程序已在运行中")
+            return 1
+        if args.workers > 1:
+            from mail_supervisor import Supervisor
+            return Supervisor(args.config, args.workers, args.verbose).run()
+        return MailDaemon(args.config).run()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+"""
+提醒汇总 - 把一段时间内陆续到达的新邮件合并成一次提醒
+第一封邮件到达后等待邮件停止到达(防抖窗口)再提醒，持续到达时最多等待 max_wait 秒；
+提醒显示期间到达的邮件直接并入当前提醒，直到用户确认
+"""
+
+import time
+
+# 防抖窗口默认值(秒)
+DEFAULT_WINDOW = 2.0
+# 持续有邮件到达时，第一封邮件最多等待的倍数
+MAX_WAIT_FACTOR = 5
+
+
+class AlertDigest:
+    """待确认的新邮件；不涉及界面和线程，由界面线程调用"""
+
+    def __init__(self, window=DEFAULT_WINDOW, max_wait=None, clock=time.monotonic):
+        self.window = max(0.0, float(window))
+        self.max_wait = float(max_wait if max_wait is not None else self.window * MAX_WAIT_FACTOR)
+        self.clock = clock
+        self.emails = []
+        self.keys = set()
+        self.first_at = None
+        self.last_at = None
+        self.shown = False
+
+    def __len__(self):
+        return len(self.emails)
+
+    def add(self, new_emails):
+        """加入新邮件(同一封邮件只计一次)，返回实际加入的封数"""
+        added = 0
+        for email_info in new_emails:
+            if email_info['key'] in self.keys:
+                continue
+            self.keys.add(email_info['key'])
+            self.emails.append(email_info)
+            added += 1
+        if added:
+            now = self.clock()
+            if self.first_at is None:
+                self.first_at = now
+            self.last_at = now
+        return added
+
+    def ready(self):
+        """是否应该显示提醒：邮件停止到达超过防抖窗口，或第一封邮件已等待太久"""
+        if self.shown or not self.emails:
+            return False
+        now = self.clock()
+        return now - self.last_at >= self.window or now - self.first_at >= self.max_wait
+
+    def accounts(self):
+        """涉及的账号及各自的邮件数"""
+        counts = {}
+        for email_info in self.emails:
+            counts[email_info['account']] = counts.get(email_info['account'], 0) + 1
+        return counts
+
+    def take(self):
+        """用户确认：取出全部邮件并清空"""
+        emails = self.emails
+        self.emails = []
+        self.keys = set()
+        self.first_at = self.last_at = None
+        self.shown = False
+        return emails
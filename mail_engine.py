@@ -0,0 +1,1036 @@
+# -*- coding: utf-8 -*-
+"""
+邮件监控引擎 - 基于asyncio，单进程单线程同时监控多个邮箱账号
+每个账号一条长连接：支持IDLE时等待服务器推送，否则在同一连接上NOOP轮询
+"""
+
+import re
+import ssl
+import json
+import os
+import time
+import socket
+import base64
+import asyncio
+import hashlib
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from mail_body import decode_snippet, find_text_part, parse_fetch_items
+from mail_metrics import registry
+from mail_parse import HeaderParser, header_literals
+from mail_scheduler import PollScheduler
+
+# 提醒只需要这些邮件头，取信时不下载正文和附件
+HEADER_FIELDS = ("SUBJECT", "FROM", "DATE", "MESSAGE-ID")
+FETCH_BATCH_SIZE = 500
+# 首次同步和大量积压时每条SEARCH覆盖的UID范围，内存和单条响应的长度都与邮箱大小无关
+SEARCH_WINDOW = 5000
+# 单行响应的长度上限，新邮件很多时一条SEARCH的结果超过asyncio默认的64KB
+READ_LIMIT = 1024 * 1024
+
+# 账号配置的默认值，accounts 中每一项只需写出与默认不同的字段
+ACCOUNT_DEFAULTS = {
+    "name": "",
+    "server": "imap.qq.com",
+    "port": "993",
+    "email": "",
+    "password": "",
+    "mailbox": "INBOX",
+    "ssl": True,
+    # 首次同步(或UIDVALIDITY变化)时：unseen 提醒现有未读邮件，baseline 只记下当前最大UID，不取信也不提醒
+    "initial_sync": "unseen",
+    "connect_timeout": 30,
+    "read_timeout": 60,
+}
+
+# 连接和读取超时(秒)的默认值，读取超时针对每次等待服务器数据；
+# IDLE等待推送时不计，期间半开的连接由TCP保活发现
+CONNECT_TIMEOUT = ACCOUNT_DEFAULTS["connect_timeout"]
+READ_TIMEOUT = ACCOUNT_DEFAULTS["read_timeout"]
+KEEPALIVE_IDLE = 60
+KEEPALIVE_INTERVAL = 15
+KEEPALIVE_COUNT = 4
+# 停止时给各账号正常退出(结束IDLE、LOGOUT)的时间，超过后取消，中断进行中的命令
+STOP_GRACE = 0.5
+# RFC 2177 要求客户端至少每29分钟重新发起一次IDLE
+IDLE_RENEW = 29 * 60
+
+LITERAL_RE = re.compile(rb"\{(\d+)\}\r\n$")
+
+
+class ImapError(Exception):
+    """服务器返回NO/BAD"""
+
+
+class ImapAbort(ImapError):
+    """连接已断开或协议错误，需要重新连接"""
+
+
+class ImapAuthError(ImapError):
+    """登录被拒绝(用户名或密码/授权码错误)"""
+
+
+def email_hash(email_data):
+    """生成邮件的唯一标识哈希"""
+    content = f"{email_data.get('from', '')}_{email_data.get('subject', '')}_{email_data.get('date', '')}"
+    return hashlib.md5(content.encode('utf-8')).hexdigest()
+
+
+def email_key(email_data):
+    """去重用的唯一标识：优先用Message-ID，没有时用邮箱+UIDVALIDITY+UID，都没有时用邮件头哈希
+
+    不依赖邮件头的解码结果，邮件头相同的不同邮件也不会被当成同一封
+    """
+    if email_data.get('message_id'):
+        return "mid:" + email_data['message_id']
+    if email_data.get('uidvalidity') and email_data.get('id'):
+        return (f"uid:{email_data.get('account', '')}/{email_data.get('mailbox', '')}/"
+                f"{email_data['uidvalidity']}/{email_data['id']}")
+    return "hash:" + email_data.get('hash', email_hash(email_data))
+
+
+def compress_uids(uids):
+    """把UID列表压缩成IMAP序列集，如 [1,2,3,5] -> 1:3,5"""
+    ranges = []
+    for uid in sorted(set(uids)):
+        if ranges and uid == ranges[-1][1] + 1:
+            ranges[-1][1] = uid
+        else:
+            ranges.append([uid, uid])
+    return ",".join(str(a) if a == b else f"{a}:{b}" for a, b in ranges)
+
+
+def backlog_uids(backlog):
+    """积压分段 [[起, 止, 搜索条件]] 中还要检查的UID范围之和"""
+    return sum(high - low + 1 for low, high, _ in backlog or ())
+
+
+def account_id(account):
+    """账号的唯一标识：地址+服务器+端口，分片和同步状态都按它区分账号"""
+    return f"{account['email']}@{account['server']}:{account['port']}"
+
+
+def load_accounts(config):
+    """从配置生成账号列表：主账号(email_settings)加上 accounts 中的附加账号"""
+    interval = int(config.get("alert_settings", {}).get("check_interval", 30))
+    entries = [config.get("email_settings", {})] + list(config.get("accounts", []))
+
+    accounts = []
+    for entry in entries:
+        if not entry.get("email"):
+            continue
+        account = dict(ACCOUNT_DEFAULTS, check_interval=interval)
+        account.update(entry)
+        account["name"] = account["name"] or account["email"]
+        # mailboxes 为要监控的全部文件夹，第一个保持选中(IDLE/NOOP)，其余每次轮询用STATUS检查
+        account["mailboxes"] = list(dict.fromkeys(entry.get("mailboxes") or [account["mailbox"]]))
+        account["mailbox"] = account["mailboxes"][0]
+        accounts.append(account)
+    return accounts
+
+
+class SyncStateStore:
+    """各邮箱的UID同步状态(UIDVALIDITY + 已同步的最大UID + 积压分段)，保存在SQLite中
+
+    每个邮箱一行，更新只改内存并交给后台线程写入，不占用事件循环；后台线程把一段时间内的更新
+    合并成一个事务，只写有变化的行。分片运行时多个进程共用同一个数据库，各自只写自己的邮箱
+    """
+
+    def __init__(self, path="sync_state.db"):
+        self.path = path
+        self.state = {}
+        # 等待写入的 {邮箱: 状态}，由后台线程取走
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.closing = False
+        self.writer = None
+
+        self.db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS sync_state ("
+                        "key TEXT PRIMARY KEY, uidvalidity INTEGER, last_uid INTEGER NOT NULL, backlog TEXT)")
+        self.load()
+
+    def load(self):
+        """加载同步状态"""
+        try:
+            for key, uidvalidity, last_uid, backlog in self.db.execute(
+                    "SELECT key, uidvalidity, last_uid, backlog FROM sync_state"):
+                state = {"uidvalidity": uidvalidity, "last_uid": last_uid}
+                if backlog:
+                    state["backlog"] = json.loads(backlog)
+                self.state[key] = state
+        except (sqlite3.Error, ValueError) as e:
+            print(f"加载同步状态失败: {e}")
+
+    def import_json(self, json_path):
+        """导入旧版 sync_state.json，成功后改名，只导入一次；多个进程同时打开时只有一个导入"""
+        with self.lock:
+            with self.db:
+                # 先取得写锁再检查文件，其他进程等到改名之后才能进来
+                self.db.execute("BEGIN IMMEDIATE")
+                if not os.path.exists(json_path):
+                    return 0
+                with open(json_path, 'r', encoding='utf-8') as f:
+                    legacy = json.load(f)
+                self.db.executemany("INSERT OR IGNORE INTO sync_state (key, uidvalidity, last_uid, backlog) "
+                                    "VALUES (?, ?, ?, ?)", [self.row(key, state) for key, state in legacy.items()])
+                os.replace(json_path, json_path + ".migrated")
+        for key, state in legacy.items():
+            self.state.setdefault(key, state)
+        return len(legacy)
+
+    @staticmethod
+    def row(key, state):
+        backlog = state.get("backlog")
+        return key, state.get("uidvalidity"), int(state.get("last_uid") or 0), json.dumps(backlog) if backlog else None
+
+    def get(self, key):
+        return self.state.get(key)
+
+    def update(self, key, uidvalidity, last_uid, backlog=None):
+        """记录邮箱已同步到的UID和尚未处理的积压分段 [[起, 止, 搜索条件]]，有变化时才交给后台线程写入"""
+        new_state = {"uidvalidity": uidvalidity, "last_uid": last_uid}
+        if backlog:
+            new_state["backlog"] = [list(segment) for segment in backlog]
+        if self.state.get(key) == new_state:
+            return
+        self.state[key] = new_state
+        with self.lock:
+            self.pending[key] = new_state
+            if self.writer is None:
+                self.writer = threading.Thread(target=self._write_loop, name="sync-state", daemon=True)
+                self.writer.start()
+        self.wakeup.set()
+
+    def _write_loop(self):
+        while True:
+            self.wakeup.wait()
+            with self.lock:
+                self.wakeup.clear()
+                pending, self.pending = self.pending, {}
+                closing = self.closing
+            if pending:
+                self.write(pending)
+            if closing:
+                return
+
+    def write(self, pending):
+        try:
+            with self.db:
+                self.db.execute("BEGIN")
+                self.db.executemany("INSERT OR REPLACE INTO sync_state (key, uidvalidity, last_uid, backlog) "
+                                    "VALUES (?, ?, ?, ?)", [self.row(key, state) for key, state in pending.items()])
+        except sqlite3.Error as e:
+            print(f"保存同步状态失败: {e}")
+            # 留到下次一起写入，期间更新过的以新的为准
+            with self.lock:
+                for key, state in pending.items():
+                    self.pending.setdefault(key, state)
+
+    def close(self):
+        """写完尚未保存的状态后关闭；退出前调用"""
+        with self.lock:
+            self.closing = True
+            writer = self.writer
+        if writer is not None:
+            self.wakeup.set()
+            writer.join()
+        elif self.pending:
+            self.write(self.pending)
+        self.db.close()
+
+
+class AsyncImapClient:
+    """最小化的asyncio IMAP客户端，只实现监控需要的命令"""
+
+    def __init__(self, host, port, use_ssl=True, read_timeout=READ_TIMEOUT):
+        self.host = host
+        self.port = int(port)
+        self.use_ssl = use_ssl
+        self.read_timeout = read_timeout
+        self.reader = None
+        self.writer = None
+        self.capabilities = set()
+        self.tag_counter = 0
+        self.timed_out = False
+        # 读取超时的看门狗：进行中的限时读取数、最近一次读取开始或完成的时间
+        self.timed_reads = 0
+        self.last_activity = 0.0
+        self.watchdog = None
+
+    async def connect(self, timeout=CONNECT_TIMEOUT):
+        """建立连接并读取服务器问候"""
+        context = ssl.create_default_context() if self.use_ssl else None
+        self.reader, self.writer = await asyncio.wait_for(
+            asyncio.open_connection(self.host, self.port, ssl=context, limit=READ_LIMIT), timeout)
+        set_keepalive(self.writer.get_extra_info("socket"))
+        greeting = await asyncio.wait_for(self._readline(timed=False), timeout)
+        if not greeting.startswith((b"* OK", b"* PREAUTH")):
+            raise ImapAbort(f"服务器拒绝连接: {greeting.decode('utf-8', errors='ignore').strip()}")
+
+    async def login(self, username, password):
+        try:
+            await self.command("LOGIN", quote(username), quote(password))
+        except ImapAbort:
+            raise
+        except ImapError as e:
+            raise ImapAuthError(str(e)) from None
+        # 登录后服务器能力可能变化，重新获取
+        untagged = await self.command("CAPABILITY")
+        self.capabilities = set()
+        for line in untagged_lines(untagged, b"CAPABILITY"):
+            self.capabilities.update(line.decode('ascii', errors='ignore').upper().split()[2:])
+
+    async def select(self, mailbox):
+        """选择邮箱，返回 {UIDVALIDITY, UIDNEXT, EXISTS} 中服务器给出的值"""
+        untagged = await self.command("SELECT", quote(mailbox))
+        info = {}
+        for parts in untagged:
+            line = parts[0] if isinstance(parts[0], bytes) else parts[0][0]
+            match = re.match(rb"\* OK \[(UIDVALIDITY|UIDNEXT) (\d+)\]", line)
+            if match:
+                info[match.group(1).decode()] = int(match.group(2))
+            match = re.match(rb"\* (\d+) EXISTS", line)
+            if match:
+                info["EXISTS"] = int(match.group(1))
+        return info
+
+    async def status(self, mailbox, items):
+        """STATUS 查询邮箱而不选择它，返回 {UIDNEXT, UIDVALIDITY, MESSAGES, ...} 中服务器给出的值"""
+        untagged = await self.command("STATUS", quote(mailbox), f"({' '.join(items)})")
+        info = {}
+        for line in untagged_lines(untagged, b"STATUS"):
+            match = re.search(rb"\(([^()]*)\)\s*$", line)
+            if match is None:
+                continue
+            fields = match.group(1).split()
+            for key, value in zip(fields[::2], fields[1::2]):
+                if value.isdigit():
+                    info[key.decode('ascii', errors='ignore').upper()] = int(value)
+        return info
+
+    async def uid_search(self, criteria):
+        """UID SEARCH，返回整数UID列表"""
+        untagged = await self.command("UID SEARCH", criteria)
+        uids = []
+        for line in untagged_lines(untagged, b"SEARCH"):
+            uids.extend(int(uid) for uid in line.split()[2:])
+        return uids
+
+    async def uid_fetch(self, uid_set, query):
+        """UID FETCH，返回与imaplib相同形状的数据：(头, 字面量) 元组与字节串混合的列表"""
+        untagged = await self.command("UID FETCH", uid_set, query)
+        data = []
+        for parts in untagged:
+            first = parts[0] if isinstance(parts[0], bytes) else parts[0][0]
+            if b" FETCH " not in first:
+                continue
+            for part in parts:
+                if isinstance(part, tuple):
+                    data.append((part[0][2:] if part[0].startswith(b"* ") else part[0], part[1]))
+                else:
+                    data.append(part[2:] if part.startswith(b"* ") else part)
+        return data
+
+    async def uid_fetch_items(self, uid_set, query):
+        """UID FETCH，把每条响应解析成数据项，返回 {uid: {"BODYSTRUCTURE": [...], ...}}"""
+        untagged = await self.command("UID FETCH", uid_set, query)
+        result = {}
+        for parts in untagged:
+            first = parts[0] if isinstance(parts[0], bytes) else parts[0][0]
+            if b" FETCH " not in first:
+                continue
+            items = parse_fetch_items(parts)
+            if "UID" in items:
+                result[items["UID"]] = items
+        return result
+
+    async def noop(self):
+        """发送NOOP，返回期间是否收到新邮件通知"""
+        untagged = await self.command("NOOP")
+        return any(is_change_line(parts[0]) for parts in untagged if isinstance(parts[0], bytes))
+
+    async def idle(self, timeout, stop_event):
+        """RFC 2177 IDLE：等待服务器推送，最长timeout秒；stop_event被设置时立即结束"""
+        tag = self._next_tag()
+        await self._send(tag + b" IDLE")
+        line = await self._readline()
+        if not line.startswith(b"+"):
+            await self._read_until_tagged(tag, line)
+            raise ImapError("服务器拒绝了IDLE")
+
+        changed = False
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + min(timeout, IDLE_RENEW)
+        stop_wait = asyncio.ensure_future(stop_event.wait())
+        try:
+            while not changed and not stop_event.is_set():
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                read = asyncio.ensure_future(self._readline(timed=False))
+                done, _ = await asyncio.wait({read, stop_wait}, timeout=remaining,
+                                             return_when=asyncio.FIRST_COMPLETED)
+                if read not in done:
+                    # 取消读取并等待其结束，之后才能在同一个reader上继续读
+                    read.cancel()
+                    try:
+                        await read
+                    except asyncio.CancelledError:
+                        pass
+                    break
+                changed = is_change_line(read.result())
+        finally:
+            stop_wait.cancel()
+
+        await self._send(b"DONE")
+        return await self._read_until_tagged(tag) or changed
+
+    async def logout(self):
+        """正常退出并关闭连接"""
+        try:
+            await asyncio.wait_for(self.command("LOGOUT"), STOP_GRACE)
+        except Exception:
+            pass
+        self.close()
+
+    def close(self):
+        if self.watchdog is not None:
+            self.watchdog.cancel()
+            self.watchdog = None
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = self.writer = None
+
+    async def command(self, name, *args):
+        """发送命令并读取到完成响应，返回未标记响应列表；NO/BAD时抛出ImapError"""
+        tag = self._next_tag()
+        await self._send(b" ".join([tag, name.encode()] + [arg.encode() for arg in args]))
+        untagged = []
+        while True:
+            parts = await self._read_response()
+            first = parts[0] if isinstance(parts[0], bytes) else parts[0][0]
+            if first.startswith(tag + b" "):
+                result = first[len(tag) + 1:]
+                if not result.upper().startswith(b"OK"):
+                    raise ImapError(f"{name} 失败: {result.decode('utf-8', errors='ignore')}")
+                return untagged
+            if first.startswith(b"* BYE"):
+                raise ImapAbort(first.decode('utf-8', errors='ignore'))
+            untagged.append(parts)
+
+    def _next_tag(self):
+        self.tag_counter += 1
+        return f"A{self.tag_counter:04d}".encode()
+
+    async def _send(self, line):
+        if self.writer is None:
+            raise ImapAbort("未连接")
+        self.writer.write(line + b"\r\n")
+        await self.writer.drain()
+
+    async def _readline(self, timed=True):
+        """读取一行；timed为False时不受读取超时限制(IDLE等待推送)"""
+        if self.reader is None:
+            raise ImapAbort("未连接")
+        if timed:
+            self._watch()
+        try:
+            line = await self.reader.readline()
+        except ConnectionError as e:
+            raise self._abort_error(e) from None
+        finally:
+            if timed:
+                self._unwatch()
+        if self.timed_out or not line:
+            raise self._abort_error(None)
+        return line
+
+    async def _readexactly(self, count):
+        self._watch()
+        try:
+            return await self.reader.readexactly(count)
+        except (asyncio.IncompleteReadError, ConnectionError) as e:
+            raise self._abort_error(e) from None
+        finally:
+            self._unwatch()
+
+    def _watch(self):
+        """开始一次限时读取；整个连接只有一个看门狗定时器，不给每行套 wait_for 任务"""
+        if not self.read_timeout:
+            return
+        loop = asyncio.get_running_loop()
+        self.timed_reads += 1
+        self.last_activity = loop.time()
+        if self.watchdog is None:
+            self.watchdog = loop.call_at(self.last_activity + self.read_timeout, self._check_watchdog)
+
+    def _unwatch(self):
+        if not self.read_timeout:
+            return
+        self.timed_reads -= 1
+        self.last_activity = asyncio.get_running_loop().time()
+
+    def _check_watchdog(self):
+        """限时读取超过read_timeout没有进展时中止连接，挂起的读取随即结束"""
+        self.watchdog = None
+        if not self.timed_reads or self.writer is None:
+            return
+        loop = asyncio.get_running_loop()
+        deadline = self.last_activity + self.read_timeout
+        if loop.time() < deadline:
+            self.watchdog = loop.call_at(deadline, self._check_watchdog)
+            return
+        self.timed_out = True
+        self.writer.transport.abort()
+
+    def _abort_error(self, error):
+        if self.timed_out:
+            return ImapAbort(f"服务器{self.read_timeout:g}秒没有响应")
+        return ImapAbort(f"连接中断: {error}" if error else "服务器关闭了连接")
+
+    async def _read_response(self):
+        """读取一条完整响应，字面量 {n} 被读成 (头, 数据) 元组"""
+        parts = []
+        line = await self._readline()
+        while True:
+            match = LITERAL_RE.search(line)
+            if match is None:
+                parts.append(line.rstrip(b"\r\n"))
+                return parts
+            literal = await self._readexactly(int(match.group(1)))
+            parts.append((line.rstrip(b"\r\n"), literal))
+            line = await self._readline()
+
+    async def _read_until_tagged(self, tag, line=None):
+        """读取到指定tag的完成响应为止，返回期间是否出现新邮件通知"""
+        changed = False
+        while True:
+            if line is None:
+                line = await self._readline()
+            if line.startswith(tag + b" "):
+                return changed
+            if line.startswith(b"* BYE"):
+                raise ImapAbort(line.decode('utf-8', errors='ignore').strip())
+            changed = is_change_line(line) or changed
+            line = None
+
+
+def set_keepalive(sock):
+    """开启TCP保活：长时间IDLE时对方掉线(半开连接)也能在几分钟内发现，各平台支持的选项不同"""
+    if sock is None:
+        return
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        for name, value in (("TCP_KEEPIDLE", KEEPALIVE_IDLE), ("TCP_KEEPINTVL", KEEPALIVE_INTERVAL),
+                            ("TCP_KEEPCNT", KEEPALIVE_COUNT)):
+            if hasattr(socket, name):
+                sock.setsockopt(socket.IPPROTO_TCP, getattr(socket, name), value)
+    except OSError:
+        pass
+
+
+def quote(value):
+    """IMAP带引号字符串"""
+    return '"' + str(value).replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+
+def encode_mailbox(name):
+    """邮箱名按IMAP修改版UTF-7编码(RFC 3501 5.1.3)，中文文件夹名需要编码后才能发给服务器
+
+    纯ASCII的名称原样使用，可以直接填写服务器列出的已编码名称
+    """
+    if name.isascii():
+        return name
+    result = []
+    pending = []
+
+    def flush():
+        if pending:
+            data = base64.b64encode("".join(pending).encode("utf-16-be")).rstrip(b"=")
+            result.append("&" + data.decode("ascii").replace("/", ",") + "-")
+            pending.clear()
+
+    for char in name:
+        if 0x20 <= ord(char) <= 0x7e:
+            flush()
+            result.append("&-" if char == "&" else char)
+        else:
+            pending.append(char)
+    flush()
+    return "".join(result)
+
+
+def untagged_lines(untagged, kind):
+    """筛选指定类型的未标记响应行，如 * SEARCH / * CAPABILITY"""
+    for parts in untagged:
+        line = parts[0] if isinstance(parts[0], bytes) else parts[0][0]
+        if line.upper().startswith(b"* " + kind):
+            yield line
+
+
+def is_change_line(line):
+    """未标记响应是否表示邮箱有新邮件"""
+    return line.startswith(b"* ") and (b" EXISTS" in line or b" RECENT" in line)
+
+
+class Folder:
+    """账号下一个被监控的文件夹：最近一次SELECT和STATUS的结果"""
+
+    __slots__ = ("name", "uidvalidity", "uidnext", "status", "error")
+
+    def __init__(self, name):
+        self.name = name
+        self.uidvalidity = None
+        self.uidnext = None
+        self.status = None
+        self.error = None
+
+
+class AccountMonitor:
+    """单个账号的监控协程：长连接、UID增量同步、批量取邮件头，以及独立的失败退避
+
+    第一个文件夹保持选中，用IDLE或NOOP等待新邮件；其余文件夹每次轮询只发一条STATUS，
+    有新邮件时才SELECT和SEARCH，监控多个文件夹的开销与一个空闲文件夹相近
+    """
+
+    def __init__(self, account, engine):
+        self.account = account
+        self.engine = engine
+        self.name = account["name"]
+        self.folders = [Folder(name) for name in account.get("mailboxes") or [account.get("mailbox", "INBOX")]]
+        self.primary = self.folders[0]
+        self.selected = None
+        self.check_interval = int(account.get("check_interval", 30))
+        self.client = None
+        self.scheduler = PollScheduler(self.check_interval, account.get("min_interval"), account.get("max_interval"))
+        self.metrics = engine.metrics
+
+    def state_key(self, folder):
+        """同步状态的键：账号+服务器+端口+邮箱"""
+        return f"{account_id(self.account)}/{folder.name}"
+
+    def status(self, msg):
+        self.engine.status(f"[{self.name}] {msg}")
+
+    def timer(self, stage):
+        """统计本账号一个轮询阶段的耗时"""
+        return self.metrics.timer(stage, account=self.name)
+
+    async def run(self, stop_event):
+        """监控循环，直到stop_event被设置"""
+        while not stop_event.is_set():
+            try:
+                if self.client is None:
+                    await self.connect()
+                    mode = "IDLE推送" if "IDLE" in self.client.capabilities else "NOOP轮询"
+                    if len(self.folders) > 1:
+                        mode += f"，{len(self.folders)}个文件夹"
+                    self.status(f"已连接邮件服务器 ({mode})")
+                    self.metrics.set("mail_connected", 1, account=self.name)
+
+                new_count = await self.sync()
+                recovered = self.scheduler.failures > 0
+                self.scheduler.record_success(new_count)
+                if recovered:
+                    self.status(f"已恢复，{self.scheduler.cadence()}")
+                self.metrics.inc("mail_polls_total", account=self.name)
+                self.metrics.set("mail_last_success_timestamp_seconds", time.time(), account=self.name)
+                self.metrics.set("mail_poll_interval_seconds", self.scheduler.poll_interval(), account=self.name)
+
+                # 等待服务器推送或下一次轮询
+                await self.wait_for_changes(stop_event)
+
+            except asyncio.CancelledError:
+                # 停止时被取消：进行中的命令已中断，连接状态未知，直接断开
+                self.disconnect()
+                raise
+            except Exception as e:
+                self.disconnect()
+                self.metrics.inc("mail_errors_total", account=self.name, type=type(e).__name__)
+                delay = self.scheduler.record_failure("auth" if isinstance(e, ImapAuthError) else "network")
+                self.metrics.set("mail_poll_interval_seconds", delay, account=self.name)
+                self.status(f"检查邮件错误: {str(e) or type(e).__name__}，{delay:.0f}秒后重试 ({self.scheduler.cadence()})")
+                await wait_event(stop_event, delay)
+
+        if self.client is not None:
+            try:
+                await self.client.logout()
+            finally:
+                self.disconnect()
+
+    async def connect(self):
+        """建立连接、登录并选择邮箱"""
+        client = AsyncImapClient(self.account["server"], self.account["port"], self.account.get("ssl", True),
+                                 read_timeout=float(self.account.get("read_timeout") or 0) or None)
+        try:
+            with self.timer("connect"):
+                await client.connect(float(self.account.get("connect_timeout") or CONNECT_TIMEOUT))
+            with self.timer("login"):
+                await client.login(self.account["email"], self.account["password"])
+            self.client = client
+            await self.select(self.primary)
+        except BaseException:
+            client.close()
+            self.client = None
+            raise
+
+    async def select(self, folder):
+        """选择文件夹，记下它的UIDVALIDITY和UIDNEXT"""
+        with self.timer("select"):
+            info = await self.client.select(encode_mailbox(folder.name))
+        folder.uidvalidity = info.get("UIDVALIDITY")
+        folder.uidnext = info.get("UIDNEXT")
+        self.selected = folder
+
+    def disconnect(self):
+        """丢弃当前连接，下次循环重新连接"""
+        if self.client is not None:
+            self.client.close()
+        self.client = None
+        self.selected = None
+        self.metrics.set("mail_connected", 0, account=self.name)
+
+    async def wait_for_changes(self, stop_event):
+        if "IDLE" in self.client.capabilities:
+            # 只有选中的文件夹会推送，有其他文件夹时最多等到下一次轮询
+            timeout = IDLE_RENEW if len(self.folders) == 1 else self.scheduler.next_delay()
+            try:
+                return await self.client.idle(timeout, stop_event)
+            except ImapAbort:
+                raise
+            except ImapError:
+                # 服务器声明了IDLE却拒绝执行，降级为NOOP轮询
+                self.client.capabilities.discard("IDLE")
+        await wait_event(stop_event, self.scheduler.next_delay())
+        if stop_event.is_set():
+            return False
+        return await self.client.noop()
+
+    async def highest_uid(self, folder):
+        """当前邮箱中最大的UID，邮箱为空时返回0"""
+        if folder.uidnext:
+            return folder.uidnext - 1
+        data = await self.client.uid_fetch("*", "(UID)")
+        for item in data:
+            match = re.search(rb"UID (\d+)", item[0] if isinstance(item, tuple) else item)
+            if match:
+                return int(match.group(1))
+        return 0
+
+    async def lowest_uid(self):
+        """当前邮箱中最小的UID(第1封邮件)，邮箱为空时返回0"""
+        try:
+            untagged = await self.client.command("FETCH", "1", "(UID)")
+        except ImapAbort:
+            raise
+        except ImapError:
+            return 0
+        for parts in untagged:
+            match = re.search(rb"UID (\d+)", parts[0] if isinstance(parts[0], bytes) else parts[0][0])
+            if match:
+                return int(match.group(1))
+        return 0
+
+    async def plan_sync(self, folder):
+        """确定本次同步的范围，返回 (直接搜索到的新邮件UID, 同步后的最大UID, 积压分段)
+
+        积压分段 [[起, 止, 搜索条件]] 按UID从新到旧排列，之后按 SEARCH_WINDOW 分段搜索
+        """
+        state = self.engine.sync_store.get(self.state_key(folder))
+
+        if state is None or state.get("uidvalidity") != folder.uidvalidity:
+            # 首次同步或邮箱被重建：以当前最大UID为基线，现有未读邮件作为积压从新到旧提醒
+            if state is not None:
+                self.status(f"UIDVALIDITY已变化，重新同步邮箱: {folder.name}")
+            last_uid = await self.highest_uid(folder)
+            if self.account.get("initial_sync") == "baseline" or last_uid == 0:
+                if last_uid:
+                    self.status(f"已记录现有邮件为基线，不提醒: {folder.name}")
+                return [], last_uid, []
+            return [], last_uid, [[await self.lowest_uid() or 1, last_uid, "UNSEEN"]]
+
+        last_uid = state.get("last_uid", 0)
+        backlog = [list(segment) for segment in state.get("backlog", [])]
+        top = (folder.uidnext or 1) - 1
+        if top - last_uid > SEARCH_WINDOW:
+            # 积压很多(如长时间离线后重连)：SELECT时已有的邮件分段处理，之后到达的直接搜索
+            backlog.insert(0, [last_uid + 1, top, "ALL"])
+            last_uid = top
+        # "UID n:*" 在没有新邮件时也会返回最大UID，需要再过滤一次
+        uids = [uid for uid in await self.client.uid_search(f"UID {last_uid + 1}:*") if uid > last_uid]
+        # SELECT时UIDNEXT之前的邮件都已包含在搜索结果中；末尾邮件被删除时也推进到UIDNEXT，
+        # 否则STATUS会一直显示该文件夹有新邮件
+        last_uid = max([last_uid, top] + uids)
+        return uids, last_uid, backlog
+
+    async def folder_changed(self, folder):
+        """用一条STATUS检查未选中的文件夹是否可能有新邮件；文件夹不存在等错误只提示一次并跳过"""
+        items = ["UIDNEXT", "UIDVALIDITY", "MESSAGES"]
+        if "CONDSTORE" in self.client.capabilities:
+            items.append("HIGHESTMODSEQ")
+        try:
+            with self.timer("status"):
+                info = await self.client.status(encode_mailbox(folder.name), items)
+        except ImapAbort:
+            raise
+        except ImapError as e:
+            if folder.error != str(e):
+                self.status(f"检查文件夹失败: {folder.name}: {e}")
+            folder.error = str(e)
+            return False
+        folder.error = None
+        previous, folder.status = folder.status, info
+
+        state = self.engine.sync_store.get(self.state_key(folder))
+        if state is None or state.get("uidvalidity") != info.get("UIDVALIDITY"):
+            return True
+        if state.get("backlog"):
+            # 上次同步中断，还有积压分段没有处理
+            return True
+        if info.get("UIDNEXT"):
+            # 只有大于已同步最大UID的邮件才是新邮件
+            return info["UIDNEXT"] - 1 > state.get("last_uid", 0)
+        # 服务器没有给出UIDNEXT时，邮件数或HIGHESTMODSEQ有变化才检查
+        return info != previous
+
+    async def iter_headers(self, uids, batch_size=FETCH_BATCH_SIZE):
+        """按批次只取所需邮件头(BODY.PEEK不会标记已读)，逐批产出 (本批UID, {uid: (主题, 发件人, 日期, Message-ID)})
+
+        按给出的顺序取；交给进程池解析时，一批在解析的同时就去取下一批
+        """
+        query = f"(UID BODY.PEEK[HEADER.FIELDS ({' '.join(HEADER_FIELDS)})])"
+        pending = None
+        for start in range(0, len(uids) + batch_size, batch_size):
+            batch = uids[start:start + batch_size]
+            parsing = None
+            if batch:
+                with self.timer("fetch"):
+                    data = await self.client.uid_fetch(compress_uids(batch), query)
+                with self.timer("parse"):
+                    parsing = self.engine.parser.submit(header_literals(data))
+            if pending is not None:
+                with self.timer("parse"):
+                    headers = {record[0]: record[1:] for record in await pending[1]}
+                self.metrics.inc("mail_messages_fetched_total", len(headers), account=self.name)
+                yield pending[0], headers
+            if parsing is None:
+                return
+            pending = (batch, parsing)
+
+    async def fetch_snippets(self, uids, max_bytes, batch_size=FETCH_BATCH_SIZE):
+        """取正文开头：先取BODYSTRUCTURE找出正文段，再只取该段前max_bytes字节，返回 {uid: 文本}"""
+        uids = sorted(uids)
+        parts = {}
+        for start in range(0, len(uids), batch_size):
+            uid_set = compress_uids(uids[start:start + batch_size])
+            for uid, items in (await self.client.uid_fetch_items(uid_set, "(UID BODYSTRUCTURE)")).items():
+                part = find_text_part(items.get("BODYSTRUCTURE") or [])
+                if part is not None:
+                    parts[uid] = part
+
+        # 同一段号的邮件一起取
+        sections = {}
+        for uid, part in parts.items():
+            sections.setdefault(part["section"], []).append(uid)
+        snippets = {}
+        fetched = 0
+        for section, section_uids in sections.items():
+            for start in range(0, len(section_uids), batch_size):
+                uid_set = compress_uids(section_uids[start:start + batch_size])
+                data = await self.client.uid_fetch_items(uid_set, f"(UID BODY.PEEK[{section}]<0.{max_bytes}>)")
+                for uid, items in data.items():
+                    raw = items.get(f"BODY[{section}]<0>", items.get(f"BODY[{section}]")) or b""
+                    fetched += len(raw)
+                    snippets[uid] = decode_snippet(raw, parts[uid])
+        self.metrics.inc("mail_body_bytes_total", fetched, account=self.name)
+        return snippets
+
+    async def sync(self):
+        """同步选中的主文件夹，再用STATUS检查其余文件夹，只选择有新邮件的，返回新邮件数"""
+        new_count = await self.sync_folder(self.primary)
+        for folder in self.folders[1:]:
+            if await self.folder_changed(folder):
+                await self.select(folder)
+                new_count += await self.sync_folder(folder)
+        if self.selected is not self.primary:
+            # IDLE/NOOP 只对选中的文件夹有效
+            await self.select(self.primary)
+        return new_count
+
+    async def sync_folder(self, folder):
+        """在已选中的文件夹中查找新邮件，过滤已处理的，从新到旧逐批交给引擎提醒，返回新邮件数
+
+        新到达的邮件用一条SEARCH查出；首次同步的未读邮件和大量积压按UID分段搜索，
+        每段处理完记下进度，内存占用与邮箱大小无关，中断后下次从剩下的分段继续
+        """
+        key = self.state_key(folder)
+        with self.timer("search"):
+            uids, last_uid, backlog = await self.plan_sync(folder)
+        self.set_backlog(folder, len(uids) + backlog_uids(backlog))
+        new_count = await self.alert_uids(folder, uids)
+        # 新到达的邮件已全部提醒后再推进同步位置，避免断线时漏掉邮件
+        with self.timer("persistence"):
+            self.engine.sync_store.update(key, folder.uidvalidity, last_uid, backlog)
+        self.set_backlog(folder, backlog_uids(backlog))
+
+        while backlog:
+            low, high, criteria = backlog[0]
+            start = max(low, high - SEARCH_WINDOW + 1)
+            with self.timer("search"):
+                uids = [uid for uid in await self.client.uid_search(f"UID {start}:{high} {criteria}")
+                        if start <= uid <= high]
+            new_count += await self.alert_uids(folder, uids)
+            if start > low:
+                backlog[0] = [low, start - 1, criteria]
+            else:
+                backlog.pop(0)
+            with self.timer("persistence"):
+                self.engine.sync_store.update(key, folder.uidvalidity, last_uid, backlog)
+            self.set_backlog(folder, backlog_uids(backlog))
+        return new_count
+
+    def set_backlog(self, folder, count):
+        self.metrics.set("mail_backlog_uids", count, account=self.name, folder=folder.name)
+
+    async def alert_uids(self, folder, uids):
+        """提醒一组UID中的新邮件：从新到旧每取回一批就提醒一批，返回新邮件数"""
+        count = 0
+        async for new_emails in self.iter_new_emails(folder, sorted(uids, reverse=True)):
+            count += len(new_emails)
+            self.metrics.inc("mail_new_messages_total", len(new_emails), account=self.name)
+            with self.timer("dispatch"):
+                await self.engine.dispatch(self, new_emails)
+        return count
+
+    async def iter_new_emails(self, folder, uids):
+        """按给出的UID顺序逐批取邮件头、去重、取正文摘要，产出每批中未处理过的邮件"""
+        async for batch, headers in self.iter_headers(uids):
+            emails = []
+            for email_id in batch:
+                record = headers.get(email_id)
+                if record is None:
+                    continue
+                subject, sender, date, message_id = record
+                emails.append({
+                    'id': email_id,
+                    'account': self.name,
+                    'mailbox': folder.name,
+                    'uidvalidity': folder.uidvalidity,
+                    'subject': subject,
+                    'from': sender,
+                    'date': date,
+                    'message_id': message_id
+                })
+
+            with self.timer("dedup"):
+                new_emails = []
+                for email_data in emails:
+                    email_data['hash'] = email_hash(email_data)
+                    email_data['key'] = email_key(email_data)
+                    # 旧版记录只有邮件头哈希
+                    if email_data['key'] in self.engine.processed or email_data['hash'] in self.engine.processed:
+                        self.status(f"跳过已处理邮件: {email_data['subject']}")
+                        continue
+                    new_emails.append(email_data)
+
+            # 需要正文摘要时(规则检查正文或提醒显示预览)才取，只取正文开头
+            if new_emails and self.engine.body_bytes:
+                try:
+                    with self.timer("body"):
+                        snippets = await self.fetch_snippets([email_data['id'] for email_data in new_emails],
+                                                             self.engine.body_bytes)
+                except ImapAbort:
+                    raise
+                except ImapError as e:
+                    self.status(f"获取正文摘要失败: {e}")
+                    snippets = {}
+                for email_data in new_emails:
+                    email_data['snippet'] = snippets.get(email_data['id'], "")
+
+            if new_emails:
+                yield new_emails
+
+
+async def wait_event(event, timeout):
+    """等待事件或超时，返回事件是否被设置"""
+    try:
+        await asyncio.wait_for(event.wait(), timeout)
+        return True
+    except asyncio.TimeoutError:
+        return False
+
+
+class MonitorEngine:
+    """在一个事件循环中并发运行所有账号的监控"""
+
+    def __init__(self, accounts, sync_store, processed, on_new_mail, on_status=print, metrics=None, body_bytes=0,
+                 parse_workers=0):
+        self.accounts = accounts
+        # 每封新邮件取正文开头的字节数，0表示不取正文
+        self.body_bytes = body_bytes
+        # 解析邮件头的子进程数，0表示在事件循环线程中解析
+        self.parser = HeaderParser(parse_workers)
+        self.metrics = metrics if metrics is not None else registry
+        self.sync_store = sync_store
+        self.processed = processed
+        self.on_new_mail = on_new_mail
+        self.on_status = on_status
+        self.monitors = [AccountMonitor(account, self) for account in accounts]
+        self.loop = None
+        self.stop_event = None
+        self.stop_requested = False
+        # 提醒回调用自己的线程池：停止时不等待仍在执行的回调，默认线程池会被 asyncio.run 等待
+        self.executor = None
+
+    def status(self, msg):
+        self.on_status(msg)
+
+    async def dispatch(self, monitor, new_emails):
+        """把新邮件交给提醒回调；回调可能阻塞(弹窗)，放到线程池中执行，不影响其他账号"""
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(thread_name_prefix="mail-alert")
+        await self.loop.run_in_executor(self.executor, self.on_new_mail, monitor.name, new_emails)
+
+    async def run_async(self):
+        self.loop = asyncio.get_running_loop()
+        self.stop_event = asyncio.Event()
+        if self.stop_requested:
+            return
+        tasks = [asyncio.ensure_future(monitor.run(self.stop_event)) for monitor in self.monitors]
+        monitors = asyncio.gather(*tasks, return_exceptions=True)
+        stop_wait = asyncio.ensure_future(self.stop_event.wait())
+        try:
+            await asyncio.wait({monitors, stop_wait}, return_when=asyncio.FIRST_COMPLETED)
+            if self.stop_event.is_set():
+                # 空闲的账号收到停止事件后立即结束IDLE并退出；
+                # 正在取信或服务器不响应的，超过STOP_GRACE后取消，停止延迟有上限
+                stop_started = self.loop.time()
+                _, pending = await asyncio.wait(tasks, timeout=STOP_GRACE)
+                for task in pending:
+                    task.cancel()
+                await monitors
+                elapsed = (self.loop.time() - stop_started) * 1000
+                self.status(f"监控已停止 (用时 {elapsed:.0f} ms，中断 {len(pending)} 个账号)")
+        finally:
+            stop_wait.cancel()
+            for task in tasks:
+                task.cancel()
+            self.parser.close()
+            if self.executor is not None:
+                self.executor.shutdown(wait=False)
+
+    def run(self):
+        """阻塞运行直到 stop() 被调用"""
+        asyncio.run(self.run_async())
+
+    def stop(self):
+        """可从任意线程调用"""
+        self.stop_requested = True
+        if self.loop is not None and self.stop_event is not None:
+            self.loop.call_soon_threadsafe(self.stop_event.set)
@@ -0,0 +1,207 @@
+# -*- coding: utf-8 -*-
+"""
+提醒历史 - 每封提醒过的邮件的发件人、主题、日期和提醒方式保存在SQLite中
+发件人和主题建有FTS5全文索引(trigram分词，中文按子串匹配)，按发件人、关键词和时间范围查找
+只需几毫秒，不需要再连接邮件服务器
+
+用法: python mail_history.py [--from 发件人] [--keyword 关键词] [--days 7]
+"""
+
+import sys
+import time
+import sqlite3
+import argparse
+import threading
+from email.utils import parsedate_to_datetime
+
+# 保留最近的记录条数和天数，超出的按时间从旧到新淘汰
+MAX_RECORDS = 200000
+MAX_AGE_DAYS = 365
+# 每追加这么多条检查一次是否需要淘汰
+PRUNE_EVERY = 500
+# 一次查询最多返回的条数
+SEARCH_LIMIT = 200
+# trigram分词最短能匹配3个字符，更短的词用LIKE在时间范围内逐行匹配
+FTS_MIN_CHARS = 3
+
+COLUMNS = ("mail_key", "account", "mailbox", "sender", "subject", "date", "received_at", "alerted_at", "acked_at",
+           "action", "rule")
+
+
+def header_timestamp(date):
+    """邮件头 Date 对应的时间戳，无法解析时返回None"""
+    try:
+        return parsedate_to_datetime(date).timestamp()
+    except (TypeError, ValueError, IndexError):
+        return None
+
+
+def fts_phrase(column, text):
+    """FTS5查询中限定列的短语，双引号按FTS5的规则转义"""
+    return f'{column}: "{text.replace(chr(34), chr(34) * 2)}"'
+
+
+class HistoryStore:
+    """提醒过的邮件的历史记录，可在多个线程中使用"""
+
+    def __init__(self, path="mail_history.db", max_records=MAX_RECORDS, max_age_days=MAX_AGE_DAYS):
+        self.path = path
+        self.max_records = max_records
+        self.max_age_days = max_age_days
+        self.lock = threading.Lock()
+        self.added_since_prune = 0
+
+        self.db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS history ("
+                        "id INTEGER PRIMARY KEY, mail_key TEXT UNIQUE NOT NULL, account TEXT, mailbox TEXT, "
+                        "sender TEXT, subject TEXT, date TEXT, received_at REAL NOT NULL, "
+                        "alerted_at REAL NOT NULL, acked_at REAL, action TEXT, rule TEXT)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS history_received_idx ON history(received_at)")
+        # 只索引未确认的行，统计待确认的邮件不需要扫描全表
+        self.db.execute("CREATE INDEX IF NOT EXISTS history_unacked_idx ON history(account) WHERE acked_at IS NULL")
+        self.fts = self.create_fts()
+        self.prune()
+
+    def create_fts(self):
+        """建立外部内容的FTS5索引和同步触发器；SQLite没有编译FTS5时返回False，查询全部改用LIKE"""
+        try:
+            self.db.execute("CREATE VIRTUAL TABLE IF NOT EXISTS history_fts USING fts5("
+                            "sender, subject, content='history', content_rowid='id', tokenize='trigram')")
+        except sqlite3.OperationalError:
+            return False
+        self.db.execute("CREATE TRIGGER IF NOT EXISTS history_ai AFTER INSERT ON history BEGIN "
+                        "INSERT INTO history_fts(rowid, sender, subject) VALUES (new.id, new.sender, new.subject); END")
+        self.db.execute("CREATE TRIGGER IF NOT EXISTS history_ad AFTER DELETE ON history BEGIN "
+                        "INSERT INTO history_fts(history_fts, rowid, sender, subject) "
+                        "VALUES ('delete', old.id, old.sender, old.subject); END")
+        return True
+
+    def __len__(self):
+        with self.lock:
+            return self.db.execute("SELECT COUNT(*) FROM history").fetchone()[0]
+
+    def record(self, emails, alerted_at=None):
+        """在一个事务中记录一批提醒过的邮件；同一封邮件再次提醒时保留第一次的记录"""
+        alerted_at = time.time() if alerted_at is None else alerted_at
+        rows = []
+        for email_info in emails:
+            received_at = email_info.get('arrived') or header_timestamp(email_info.get('date'))
+            rows.append((email_info['key'], email_info.get('account'), email_info.get('mailbox'),
+                         email_info.get('from', ''), email_info.get('subject', ''),
+                         str(email_info['date']) if email_info.get('date') is not None else None,
+                         received_at or alerted_at, alerted_at, email_info.get('action'), email_info.get('rule')))
+        with self.lock:
+            with self.db:
+                self.db.execute("BEGIN")
+                self.db.executemany("INSERT OR IGNORE INTO history (mail_key, account, mailbox, sender, subject, date, "
+                                    "received_at, alerted_at, action, rule) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                                    rows)
+            self.added_since_prune += len(rows)
+            need_prune = self.added_since_prune >= PRUNE_EVERY
+        if need_prune:
+            self.prune()
+
+    def acknowledge(self, keys, acked_at=None):
+        """记录邮件被确认(标记为已处理)的时间"""
+        acked_at = time.time() if acked_at is None else acked_at
+        with self.lock:
+            with self.db:
+                self.db.execute("BEGIN")
+                self.db.executemany("UPDATE history SET acked_at = ? WHERE mail_key = ? AND acked_at IS NULL",
+                                    [(acked_at, key) for key in keys])
+
+    def unacknowledged_counts(self):
+        """各账号提醒过但还没有确认的邮件数 {账号: 封数}"""
+        with self.lock:
+            rows = self.db.execute("SELECT account, COUNT(*) FROM history WHERE acked_at IS NULL "
+                                   "GROUP BY account").fetchall()
+        return dict(rows)
+
+    def unacknowledged(self):
+        """提醒过但还没有确认的邮件，按邮件时间从旧到新返回字典列表"""
+        with self.lock:
+            rows = self.db.execute(f"SELECT {', '.join(COLUMNS)} FROM history WHERE acked_at IS NULL "
+                                   "ORDER BY received_at").fetchall()
+        return [dict(zip(COLUMNS, row)) for row in rows]
+
+    def search(self, sender=None, keyword=None, since=None, until=None, limit=SEARCH_LIMIT):
+        """按发件人(姓名或地址的一部分)、主题关键词和邮件时间范围查找，返回最新的在前的字典列表"""
+        conditions, params, phrases = [], [], []
+        for column, text in (("sender", sender), ("subject", keyword)):
+            text = (text or "").strip()
+            if not text:
+                continue
+            if self.fts and len(text) >= FTS_MIN_CHARS:
+                phrases.append(fts_phrase(column, text))
+            else:
+                conditions.append(f"h.{column} LIKE ? ESCAPE '\\'")
+                params.append("%" + text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%")
+        if since is not None:
+            conditions.append("h.received_at >= ?")
+            params.append(since)
+        if until is not None:
+            conditions.append("h.received_at < ?")
+            params.append(until)
+
+        sql = f"SELECT {', '.join('h.' + column for column in COLUMNS)} FROM history h"
+        if phrases:
+            sql += " JOIN history_fts ON history_fts.rowid = h.id"
+            conditions.insert(0, "history_fts MATCH ?")
+            params.insert(0, " AND ".join(phrases))
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        sql += " ORDER BY h.received_at DESC LIMIT ?"
+        params.append(limit)
+        with self.lock:
+            rows = self.db.execute(sql, params).fetchall()
+        return [dict(zip(COLUMNS, row)) for row in rows]
+
+    def prune(self):
+        """按时间和条数淘汰最旧的记录，全文索引由触发器同步删除"""
+        with self.lock:
+            self.added_since_prune = 0
+            if self.max_age_days:
+                cutoff = time.time() - self.max_age_days * 86400
+                self.db.execute("DELETE FROM history WHERE alerted_at < ?", (cutoff,))
+            if self.max_records:
+                self.db.execute("DELETE FROM history WHERE id <= ("
+                                "SELECT id FROM history ORDER BY id DESC LIMIT 1 OFFSET ?)", (self.max_records,))
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+
+def format_row(row):
+    """一条历史记录的单行显示：邮件时间 [账号] 发件人 - 主题"""
+    when = time.strftime("%Y-%m-%d %H:%M", time.localtime(row["received_at"]))
+    return f"{when} [{row['account']}] {row['sender']} - {row['subject']}"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="查找提醒过的邮件")
+    parser.add_argument("--db", default="mail_history.db", help="历史记录文件")
+    parser.add_argument("--from", dest="sender", help="发件人姓名或地址的一部分")
+    parser.add_argument("--keyword", help="主题关键词")
+    parser.add_argument("--days", type=float, help="只查找最近几天的邮件")
+    parser.add_argument("--limit", type=int, default=SEARCH_LIMIT, help="最多显示的条数")
+    args = parser.parse_args(argv)
+
+    store = HistoryStore(args.db)
+    try:
+        start = time.perf_counter()
+        rows = store.search(args.sender, args.keyword,
+                            since=time.time() - args.days * 86400 if args.days else None, limit=args.limit)
+        elapsed = (time.perf_counter() - start) * 1000
+    finally:
+        store.close()
+    for row in rows:
+        print(format_row(row))
+    print(f"共 {len(rows)} 条，用时 {elapsed:.1f} ms")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
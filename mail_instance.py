@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+"""
+单实例检查 - 对锁文件加排他锁，进程退出(包括崩溃)时系统自动释放
+不需要枚举系统中的进程，检查耗时与进程数量无关
+"""
+
+import os
+
+LOCK_FILE = "app.lock"
+
+
+class SingleInstance:
+    """同一目录(同一份配置和记录)只允许一个程序运行"""
+
+    def __init__(self, path=LOCK_FILE):
+        self.path = path
+        self.file = None
+
+    def acquire(self):
+        """加锁成功返回True，已有实例在运行时返回False"""
+        if self.file is not None:
+            return True
+        lock_file = open(self.path, "a+")
+        try:
+            lock(lock_file)
+        except OSError:
+            lock_file.close()
+            return False
+        # 写入进程号，方便排查是哪个进程占用
+        lock_file.seek(0)
+        lock_file.truncate()
+        lock_file.write(str(os.getpid()))
+        lock_file.flush()
+        self.file = lock_file
+        return True
+
+    def release(self):
+        if self.file is not None:
+            try:
+                unlock(self.file)
+            finally:
+                self.file.close()
+                self.file = None
+
+    def __enter__(self):
+        return self.acquire()
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+if os.name == "nt":
+    import msvcrt
+
+    def lock(lock_file):
+        lock_file.seek(0)
+        msvcrt.locking(lock_file.fileno(), msvcrt.LK_NBLCK, 1)
+
+    def unlock(lock_file):
+        lock_file.seek(0)
+        msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+else:
+    import fcntl
+
+    def lock(lock_file):
+        fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+
+    def unlock(lock_file):
+        fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
@@ -0,0 +1,276 @@
+# -*- coding: utf-8 -*-
+"""
+监控指标 - 轮询各阶段的耗时直方图、计数器和状态值
+通过本地HTTP端口输出 Prometheus 文本格式(/metrics) 和 JSON 快照(/metrics.json)
+"""
+
+import sys
+import json
+import time
+import threading
+from contextlib import contextmanager
+
+# 阶段耗时直方图的桶(秒)
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+HELP = {
+    "mail_stage_seconds": "轮询各阶段耗时: connect/login/select/status/search/fetch/parse/dedup/body/dispatch/rules/persistence/notify",
+    "mail_polls_total": "完成的同步次数",
+    "mail_messages_fetched_total": "取回邮件头的邮件数",
+    "mail_new_messages_total": "去重后需要提醒的新邮件数",
+    "mail_errors_total": "按异常类型统计的错误数",
+    "mail_body_bytes_total": "为正文摘要下载的字节数",
+    "mail_rule_matches_total": "按提醒规则统计的命中邮件数",
+    "mail_pending_alerts": "已提醒、尚未确认(标记为已处理)的邮件数",
+    "mail_backlog_uids": "文件夹中待检查的UID数：本轮的新邮件加上积压分段的UID范围",
+    "mail_connected": "是否已连接服务器",
+    "mail_last_success_timestamp_seconds": "最近一次成功同步的时间",
+    "mail_poll_interval_seconds": "当前轮询间隔，失败时为退避时间",
+    "mail_notify_sent_total": "发送成功的通知数",
+    "mail_notify_failed_total": "重试后仍发送失败的通知数",
+    "mail_notify_dropped_total": "队列已满被丢弃的通知数",
+    "mail_notify_queue_depth": "等待发送的通知数",
+    "mail_worker_up": "分片工作进程是否在运行并按时报告",
+    "mail_worker_accounts": "分配给分片工作进程的账号数",
+    "mail_worker_restarts_total": "分片工作进程异常退出或无响应后被重启的次数",
+    "mail_worker_last_report_timestamp_seconds": "分片工作进程最近一次报告的时间",
+}
+
+
+def label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+class Metrics:
+    """线程安全的指标集合"""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+        # load() 按来源记下载入的指标，下次载入同一来源时先删除
+        self.loaded = {}
+
+    def inc(self, name, value=1, **labels):
+        key = (name, label_key(labels))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        with self.lock:
+            self.gauges[(name, label_key(labels))] = value
+
+    def observe(self, name, value, **labels):
+        key = (name, label_key(labels))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    histogram[0][i] += 1
+            histogram[1] += value
+            histogram[2] += 1
+
+    @contextmanager
+    def timer(self, stage, **labels):
+        """统计一个阶段的耗时，可用在协程中(计入await的网络等待时间)"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe("mail_stage_seconds", time.perf_counter() - start, stage=stage, **labels)
+
+    def snapshot(self):
+        """JSON友好的快照"""
+        with self.lock:
+            counters = dict(self.counters)
+            gauges = dict(self.gauges)
+            histograms = {key: (list(h[0]), h[1], h[2]) for key, h in self.histograms.items()}
+
+        def entries(items, value):
+            return [dict(labels, name=name, **value(v)) for (name, labels), v in sorted(items.items())]
+
+        return {
+            "timestamp": time.time(),
+            "counters": entries(counters, lambda v: {"value": v}),
+            "gauges": entries(gauges, lambda v: {"value": v}),
+            "histograms": entries(histograms, lambda h: {
+                "count": h[2], "sum": round(h[1], 6),
+                "buckets": dict(zip(map(str, self.buckets), h[0]))}),
+        }
+
+    def load(self, snapshot, **labels):
+        """用另一个进程的快照替换上次以同样标签载入的指标，分片运行时汇总各工作进程的指标"""
+        source = label_key(labels)
+
+        def entry_key(entry, *fields):
+            entry = {key: value for key, value in entry.items() if key not in fields}
+            return entry.pop("name"), label_key(dict(entry, **labels))
+
+        with self.lock:
+            for table, key in self.loaded.pop(source, ()):
+                table.pop(key, None)
+            loaded = self.loaded[source] = []
+            for entry in snapshot.get("counters", []):
+                key = entry_key(entry, "value")
+                self.counters[key] = entry["value"]
+                loaded.append((self.counters, key))
+            for entry in snapshot.get("gauges", []):
+                key = entry_key(entry, "value")
+                self.gauges[key] = entry["value"]
+                loaded.append((self.gauges, key))
+            for entry in snapshot.get("histograms", []):
+                key = entry_key(entry, "count", "sum", "buckets")
+                counts = [entry["buckets"].get(str(bound), 0) for bound in self.buckets]
+                self.histograms[key] = [counts, entry["sum"], entry["count"]]
+                loaded.append((self.histograms, key))
+
+    def render_prometheus(self):
+        """Prometheus 文本格式"""
+        with self.lock:
+            counters = dict(self.counters)
+            gauges = dict(self.gauges)
+            histograms = {key: (list(h[0]), h[1], h[2]) for key, h in self.histograms.items()}
+
+        lines = []
+        typed = set()
+
+        def header(name, kind):
+            if name not in typed:
+                typed.add(name)
+                if name in HELP:
+                    lines.append(f"# HELP {name} {HELP[name]}")
+                lines.append(f"# TYPE {name} {kind}")
+
+        for (name, labels), value in sorted(counters.items()):
+            header(name, "counter")
+            lines.append(f"{name}{format_labels(labels)} {value}")
+        for (name, labels), value in sorted(gauges.items()):
+            header(name, "gauge")
+            lines.append(f"{name}{format_labels(labels)} {value}")
+        for (name, labels), (counts, total, count) in sorted(histograms.items()):
+            header(name, "histogram")
+            for bound, bucket_count in zip(self.buckets, counts):
+                lines.append(f"{name}_bucket{format_labels(labels + (('le', str(bound)),))} {bucket_count}")
+            lines.append(f"{name}_bucket{format_labels(labels + (('le', '+Inf'),))} {count}")
+            lines.append(f"{name}_sum{format_labels(labels)} {total}")
+            lines.append(f"{name}_count{format_labels(labels)} {count}")
+        return "\n".join(lines) + "\n"
+
+
+def escape_label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{escape_label(v)}"' for k, v in labels) + "}"
+
+
+def stage_totals(metrics):
+    """各阶段的累计耗时(毫秒)和次数"""
+    totals = {}
+    for entry in metrics.snapshot()["histograms"]:
+        if entry["name"] == "mail_stage_seconds":
+            totals[entry["stage"]] = {"total_ms": round(entry["sum"] * 1000, 2), "count": entry["count"]}
+    return totals
+
+
+def peak_rss_mb():
+    """本进程的峰值常驻内存(MB)，无法获取时返回None"""
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux单位是KB，macOS是字节
+        return peak / 1024 / 1024 if sys.platform == "darwin" else peak / 1024
+    except ImportError:
+        pass
+    try:
+        import psutil
+        info = psutil.Process().memory_info()
+        return getattr(info, "peak_wset", info.rss) / 1024 / 1024
+    except Exception:
+        return None
+
+
+# 进程内默认的指标集合
+registry = Metrics()
+
+
+class MetricsServer:
+    """在后台线程中提供 /metrics 和 /metrics.json，默认只监听本机地址
+
+    actions 为 {路径: 回调}，POST 到该路径时以查询参数字典调用回调，回调返回 (状态码, JSON内容)；
+    带 Origin 头的 POST 来自浏览器中的网页，一律拒绝，其他网站不能借用户的浏览器触发这些操作
+    """
+
+    def __init__(self, metrics, port, host="127.0.0.1", actions=None):
+        self.metrics = metrics
+        self.address = (host, port)
+        self.actions = dict(actions or {})
+        self.httpd = None
+
+    def start(self):
+        # 只有配置了指标端口才用得到，用到时再导入
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        from urllib.parse import parse_qs, urlsplit
+        metrics = self.metrics
+        actions = self.actions
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path == "/metrics":
+                    body = metrics.render_prometheus().encode("utf-8")
+                    content_type = "text/plain; version=0.0.4; charset=utf-8"
+                elif self.path == "/metrics.json":
+                    body = json.dumps(metrics.snapshot(), ensure_ascii=False).encode("utf-8")
+                    content_type = "application/json; charset=utf-8"
+                else:
+                    self.send_error(404)
+                    return
+                self.reply(200, body, content_type)
+
+            def do_POST(self):
+                url = urlsplit(self.path)
+                action = actions.get(url.path)
+                if action is None:
+                    self.send_error(404)
+                    return
+                if self.headers.get("Origin") is not None:
+                    self.reply(403, json.dumps({"ok": False, "error": "不接受来自网页的请求"},
+                                               ensure_ascii=False).encode("utf-8"), "application/json; charset=utf-8")
+                    return
+                params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+                status, result = action(params)
+                self.reply(status, json.dumps(result, ensure_ascii=False).encode("utf-8"),
+                           "application/json; charset=utf-8")
+
+            def reply(self, status, body, content_type):
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(self.address, Handler)
+        self.httpd.daemon_threads = True
+        thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        thread.start()
+        return self
+
+    @property
+    def port(self):
+        return self.httpd.server_address[1] if self.httpd else self.address[1]
+
+    def stop(self):
+        if self.httpd is not None:
+            self.httpd.shutdown()
+            self.httpd.server_close()
+            self.httpd = None
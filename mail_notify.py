@@ -0,0 +1,235 @@
+# -*- coding: utf-8 -*-
+"""
+提醒通知 - 除了声音和弹窗，把新邮件提醒发到其他地方
+支持 HTTP webhook、桌面通知、标准输出/JSON行文件、TCP或Unix套接字
+
+每个目标有自己的有界队列和发送线程，失败时按指数退避重试；发送慢或失败的目标
+不会拖慢邮件监控，也不会拖慢其他目标。放入队列从不等待，队列满时直接丢弃并计数
+
+配置示例(app_config.json):
+    "notifiers": [
+        {"type": "webhook", "url": "http://127.0.0.1:8080/mail", "headers": {"Authorization": "Bearer xxx"}},
+        {"type": "desktop"},
+        {"type": "jsonl", "path": "-"},
+        {"type": "jsonl", "path": "alerts.jsonl"},
+        {"type": "socket", "address": "127.0.0.1:9000"}
+    ]
+"""
+
+import sys
+import json
+import time
+import queue
+import shutil
+import socket
+import threading
+import subprocess
+import urllib.request
+
+# 每个目标的队列长度
+QUEUE_SIZE = 1000
+# 默认重试次数和首次重试前等待的秒数(之后每次翻倍)
+RETRIES = 3
+RETRY_DELAY = 1.0
+SEND_TIMEOUT = 10
+
+
+class NotifyError(Exception):
+    """通知配置有误或目标不可用"""
+
+
+class WebhookSink:
+    """以JSON POST到指定URL，2xx视为成功"""
+
+    def __init__(self, url, headers=None, timeout=SEND_TIMEOUT):
+        # 指标标签中不带查询参数，避免泄露其中的口令
+        self.name = "webhook:" + url.split("?", 1)[0]
+        self.url = url
+        self.headers = dict(headers or {})
+        self.timeout = timeout
+
+    def send(self, event):
+        body = json.dumps(event, ensure_ascii=False).encode("utf-8")
+        request = urllib.request.Request(self.url, data=body, method="POST",
+                                         headers={"Content-Type": "application/json; charset=utf-8", **self.headers})
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            response.read()
+
+
+class DesktopSink:
+    """系统桌面通知：Linux用notify-send，macOS用osascript"""
+
+    name = "desktop"
+
+    def __init__(self, timeout=SEND_TIMEOUT):
+        self.timeout = timeout
+        if shutil.which("notify-send"):
+            self.command = lambda title, text: ["notify-send", "-a", "E-notice", title, text]
+        elif shutil.which("osascript"):
+            self.command = lambda title, text: ["osascript", "-e",
+                                                f"display notification {json.dumps(text)} with title {json.dumps(title)}"]
+        else:
+            raise NotifyError("找不到 notify-send 或 osascript，无法显示桌面通知")
+
+    def send(self, event):
+        lines = [f"{email_info['from']} - {email_info['subject']}" for email_info in event["emails"][:5]]
+        if event["count"] > len(lines):
+            lines.append(f"…… 共 {event['count']} 封")
+        subprocess.run(self.command(f"[{event['account']}] {event['count']} 封新邮件", "\n".join(lines)),
+                       check=True, timeout=self.timeout, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+class JsonLinesSink:
+    """每个通知写一行JSON；path为 "-" 时写到标准输出"""
+
+    def __init__(self, path="-"):
+        self.name = "stdout" if path == "-" else f"jsonl:{path}"
+        self.path = path
+        self.lock = threading.Lock()
+
+    def send(self, event):
+        line = json.dumps(event, ensure_ascii=False) + "\n"
+        with self.lock:
+            if self.path == "-":
+                sys.stdout.write(line)
+                sys.stdout.flush()
+            else:
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write(line)
+
+
+class SocketSink:
+    """连接 "主机:端口" 或Unix套接字路径，发送一行JSON后断开"""
+
+    def __init__(self, address, timeout=SEND_TIMEOUT):
+        self.name = f"socket:{address}"
+        self.timeout = timeout
+        host, _, port = address.rpartition(":")
+        if host and port.isdigit():
+            self.family, self.address = socket.AF_INET, (host, int(port))
+        elif hasattr(socket, "AF_UNIX"):
+            self.family, self.address = socket.AF_UNIX, address
+        else:
+            raise NotifyError(f"无效的套接字地址: {address}")
+
+    def send(self, event):
+        data = (json.dumps(event, ensure_ascii=False) + "\n").encode("utf-8")
+        with socket.socket(self.family, socket.SOCK_STREAM) as sock:
+            sock.settimeout(self.timeout)
+            sock.connect(self.address)
+            sock.sendall(data)
+
+
+SINK_TYPES = {
+    "webhook": lambda c: WebhookSink(c["url"], c.get("headers"), c.get("timeout", SEND_TIMEOUT)),
+    "desktop": lambda c: DesktopSink(c.get("timeout", SEND_TIMEOUT)),
+    "jsonl": lambda c: JsonLinesSink(c.get("path", "-")),
+    "stdout": lambda c: JsonLinesSink("-"),
+    "socket": lambda c: SocketSink(c["address"], c.get("timeout", SEND_TIMEOUT)),
+}
+
+
+def create_sink(config):
+    """按配置创建一个通知目标，返回 (目标, 重试次数)"""
+    kind = config.get("type")
+    if kind not in SINK_TYPES:
+        raise NotifyError(f"未知的通知类型: {kind}")
+    try:
+        return SINK_TYPES[kind](config), int(config.get("retries", RETRIES))
+    except KeyError as e:
+        raise NotifyError(f"{kind} 通知缺少配置项 {e}") from None
+
+
+class Notifier:
+    """每个目标一个有界队列和一个发送线程"""
+
+    def __init__(self, sinks, metrics, on_status=print, queue_size=QUEUE_SIZE, retry_delay=RETRY_DELAY):
+        # sinks: [(目标, 重试次数)]
+        self.sinks = list(sinks)
+        self.metrics = metrics
+        self.on_status = on_status
+        self.retry_delay = retry_delay
+        self.queues = [queue.Queue(maxsize=queue_size) for _ in self.sinks]
+        self.closing = threading.Event()
+        self.threads = [threading.Thread(target=self._worker, args=(sink, retries, jobs),
+                                         name=f"notify-{sink.name}", daemon=True)
+                        for (sink, retries), jobs in zip(self.sinks, self.queues)]
+        for thread in self.threads:
+            thread.start()
+
+    def notify(self, event):
+        """把一个通知放入每个目标的发送队列，不等待；队列满的目标丢弃这个通知"""
+        for (sink, _), jobs in zip(self.sinks, self.queues):
+            try:
+                jobs.put_nowait(event)
+            except queue.Full:
+                self.metrics.inc("mail_notify_dropped_total", sink=sink.name)
+                self.on_status(f"通知队列已满，丢弃发往 {sink.name} 的通知")
+            self.metrics.set("mail_notify_queue_depth", jobs.qsize(), sink=sink.name)
+
+    def _worker(self, sink, retries, jobs):
+        while True:
+            event = jobs.get()
+            if event is None:
+                return
+            self._deliver(sink, retries, event)
+            self.metrics.set("mail_notify_queue_depth", jobs.qsize(), sink=sink.name)
+
+    def _deliver(self, sink, retries, event):
+        delay = self.retry_delay
+        for attempt in range(retries + 1):
+            try:
+                start = time.perf_counter()
+                sink.send(event)
+                self.metrics.observe("mail_stage_seconds", time.perf_counter() - start, stage="notify", sink=sink.name)
+                self.metrics.inc("mail_notify_sent_total", sink=sink.name)
+                return True
+            except Exception as e:
+                error = e
+            # 关闭时不再等待重试
+            if attempt < retries and not self.closing.wait(delay):
+                delay *= 2
+                continue
+            break
+        self.metrics.inc("mail_notify_failed_total", sink=sink.name)
+        self.on_status(f"通知发送失败 ({sink.name}): {error}")
+        return False
+
+    def close(self, timeout=5.0):
+        """发送完已排队的通知(最多等待timeout秒，不再重试)后停止线程"""
+        self.closing.set()
+        deadline = time.monotonic() + timeout
+        for jobs in self.queues:
+            try:
+                jobs.put(None, timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Full:
+                pass
+        for thread in self.threads:
+            thread.join(max(0.0, deadline - time.monotonic()))
+        self.threads = []
+
+
+def build_event(account, emails, ack_url=None):
+    """通知内容：账号、数量和每封邮件的摘要"""
+    event = {
+        "type": "new_mail",
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "account": account,
+        "count": len(emails),
+        "emails": [{key: email_info.get(key) for key in ("subject", "from", "date", "rule", "action", "snippet", "hash")
+                    if email_info.get(key) is not None} for email_info in emails],
+    }
+    if ack_url:
+        event["ack_url"] = ack_url
+    return event
+
+
+def load_notifier(config, metrics, on_status=print):
+    """按配置中的 notifiers 创建通知器，配置有误的目标跳过"""
+    sinks = []
+    for sink_config in config.get("notifiers") or []:
+        try:
+            sinks.append(create_sink(sink_config))
+        except NotifyError as e:
+            on_status(f"通知配置有误，已跳过: {e}")
+    return Notifier(sinks, metrics, on_status) if sinks else None
@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+"""
+邮件头解析 - 把批量FETCH取回的邮件头解析成紧凑的记录 (UID, 主题, 发件人, 日期, Message-ID)
+首次同步或断线后补同步时积压的邮件很多，可以分块交给进程池并行解析，
+解析不再占用监控线程和GIL，界面也不会因此卡住
+"""
+
+import re
+import asyncio
+from email.header import decode_header
+from email.parser import BytesHeaderParser
+
+# 少于这么多封时在当前线程解析，进程间传输的开销比解析本身还大
+POOL_THRESHOLD = 200
+# 每个子进程任务解析的邮件数
+PARSE_CHUNK = 250
+
+
+def decode_mime_header(header):
+    """解码邮件头"""
+    if not header:
+        return ""
+    try:
+        decoded_parts = decode_header(header)
+        decoded_str = ""
+        for part, encoding in decoded_parts:
+            if isinstance(part, bytes):
+                if encoding:
+                    decoded_str += part.decode(encoding)
+                else:
+                    decoded_str += part.decode('utf-8', errors='ignore')
+            else:
+                decoded_str += part
+        return decoded_str
+    except:
+        return str(header)
+
+
+def header_literals(data):
+    """从批量FETCH的响应中取出 [(uid, 邮件头字节)]，不做解析"""
+    items = []
+    for index, item in enumerate(data):
+        if not isinstance(item, tuple):
+            continue
+        match = re.search(rb"UID (\d+)", item[0])
+        if match is None and index + 1 < len(data) and isinstance(data[index + 1], bytes):
+            # 部分服务器把UID放在字面量之后
+            match = re.search(rb"UID (\d+)", data[index + 1])
+        if match is None:
+            continue
+        items.append((int(match.group(1)), item[1]))
+    return items
+
+
+def parse_header_records(items):
+    """[(uid, 邮件头字节)] -> [(uid, 主题, 发件人, 日期, Message-ID)]；可在子进程中运行，只返回字符串"""
+    parser = BytesHeaderParser()
+    records = []
+    for uid, raw in items:
+        msg = parser.parsebytes(raw)
+        date = msg['Date']
+        records.append((uid, decode_mime_header(msg['Subject']), decode_mime_header(msg['From']),
+                        str(date) if date is not None else None, normalize_message_id(msg['Message-ID'])))
+    return records
+
+
+def normalize_message_id(value):
+    """取出 <...> 中的 Message-ID，去掉空白；没有时返回空串"""
+    if value is None:
+        return ""
+    value = "".join(str(value).split())
+    start = value.find("<")
+    end = value.find(">", start + 1)
+    if start >= 0 and end > start + 1:
+        return value[start + 1:end]
+    return value.strip("<>")
+
+
+class HeaderParser:
+    """解析邮件头：workers为0时在当前线程解析，否则大批量时分块交给进程池"""
+
+    def __init__(self, workers=0):
+        self.workers = max(0, int(workers or 0))
+        self.pool = None
+
+    def submit(self, items):
+        """开始解析一批邮件头，返回可等待的 [(uid, 主题, 发件人, 日期, Message-ID)]
+
+        在当前线程解析时立即完成；交给进程池时不等待结果，调用方可以先去取下一批
+        """
+        items = list(items)
+        if self.workers == 0 or len(items) < POOL_THRESHOLD:
+            future = asyncio.get_running_loop().create_future()
+            future.set_result(parse_header_records(items))
+            return future
+        loop = asyncio.get_running_loop()
+        pool = self.get_pool()
+        chunks = [loop.run_in_executor(pool, parse_header_records, items[start:start + PARSE_CHUNK])
+                  for start in range(0, len(items), PARSE_CHUNK)]
+        return asyncio.ensure_future(self._join(chunks))
+
+    @staticmethod
+    async def _join(chunks):
+        return [record for chunk in await asyncio.gather(*chunks) for record in chunk]
+
+    def get_pool(self):
+        if self.pool is None:
+            import multiprocessing
+            from concurrent.futures import ProcessPoolExecutor
+            # 用spawn启动子进程：监控线程和界面线程运行时fork并不安全
+            self.pool = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"))
+        return self.pool
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown(wait=False, cancel_futures=True)
+            self.pool = None
@@ -0,0 +1,375 @@
+# -*- coding: utf-8 -*-
+"""
+离线回放 - 从 mbox 文件或 Maildir 目录读取存档邮件，走与在线监控相同的解码、去重、规则和提醒流程
+不需要邮件服务器，用于补录历史邮件、压力测试和测量解析吞吐量
+
+读取、解析、限速、分批都是生成器，同一时间只有一封邮件(最多带正文开头几KB)和一个批次在内存中，
+内存占用与存档大小无关。三种模式：
+    提醒(默认)  与后台服务相同：按规则提醒、发送通知并标记为已处理
+    --seed      只把存档中的邮件写入已处理记录，之后在线监控不会再为这些邮件提醒
+    --dry-run   只统计会如何提醒，不提醒也不写入记录
+
+用法: python mail_replay.py 存档.mbox Maildir/ [--speed 60] [--seed | --dry-run] [-c app_config.json]
+"""
+
+import os
+import sys
+import json
+import time
+import signal
+import logging
+import argparse
+import threading
+from email.parser import BytesHeaderParser, BytesParser
+from email.utils import parsedate_to_datetime
+
+from mail_body import decode_snippet
+from mail_engine import email_hash, email_key
+from mail_metrics import peak_rss_mb, stage_totals
+from mail_parse import decode_mime_header, normalize_message_id
+
+logger = logging.getLogger("mail_alert")
+
+# 全速回放时每批去重和提醒的邮件数
+BATCH_SIZE = 500
+# 回放的邮件使用的账号名
+REPLAY_ACCOUNT = "replay"
+# 需要正文摘要时，除摘要字节数外多读的字节数(multipart的分隔行和段头)
+BODY_SLACK = 16384
+
+
+class RawMessage:
+    """一封存档邮件：完整的邮件头、正文开头(最多 body_limit 字节)和到达时间"""
+
+    __slots__ = ("source", "arrived", "body_limit", "header", "body", "size", "in_header")
+
+    def __init__(self, source, arrived=None, body_limit=0):
+        self.source = source
+        self.arrived = arrived
+        self.body_limit = body_limit
+        self.header = bytearray()
+        self.body = bytearray()
+        self.size = 0
+        self.in_header = True
+
+    def feed(self, line):
+        """加入一行，返回是否还需要后续的行"""
+        self.size += len(line)
+        if self.in_header:
+            self.header += line
+            self.in_header = line not in (b"\n", b"\r\n")
+        elif len(self.body) < self.body_limit:
+            self.body += line
+        return self.in_header or len(self.body) < self.body_limit
+
+    @property
+    def truncated(self):
+        return self.size > len(self.header) + len(self.body)
+
+
+def envelope_time(line):
+    """mbox 分隔行 "From 发件人 Tue Nov 14 22:13:20 2023" 中的投递时间"""
+    try:
+        return time.mktime(time.strptime(line.decode("ascii", "ignore").split(None, 2)[2][:24].strip(),
+                                         "%a %b %d %H:%M:%S %Y"))
+    except (IndexError, ValueError, OverflowError):
+        return None
+
+
+def iter_mbox(path, body_limit=0):
+    """逐行读取mbox，每遇到 "From " 开头的行开始一封新邮件"""
+    with open(path, "rb") as f:
+        message = None
+        for line in f:
+            if line.startswith(b"From "):
+                if message is not None:
+                    yield message
+                message = RawMessage(path, envelope_time(line), body_limit)
+                continue
+            if message is None:
+                continue
+            # mboxrd：正文中以 From 开头的行被转义成 >From
+            if line.startswith(b">") and line.lstrip(b">").startswith(b"From "):
+                line = line[1:]
+            message.feed(line)
+        if message is not None:
+            yield message
+
+
+def iter_maildir(path, body_limit=0):
+    """读取Maildir的 new 和 cur 目录；按目录顺序读取，不把全部文件名读入内存"""
+    for folder in ("new", "cur"):
+        try:
+            entries = os.scandir(os.path.join(path, folder))
+        except FileNotFoundError:
+            continue
+        with entries:
+            for entry in entries:
+                if entry.name.startswith(".") or not entry.is_file():
+                    continue
+                # 文件名以投递时间开头，如 1700000000.M1P2.host:2,S
+                prefix = entry.name.split(".", 1)[0]
+                message = RawMessage(entry.path, int(prefix) if prefix.isdigit() else None, body_limit)
+                with open(entry.path, "rb") as f:
+                    for line in f:
+                        if not message.feed(line):
+                            break
+                # 没读完的部分只计入大小
+                message.size = max(message.size, entry.stat().st_size)
+                if message.arrived is None:
+                    message.arrived = entry.stat().st_mtime
+                yield message
+
+
+def iter_archives(paths, body_limit=0):
+    """依次读取多个存档：目录按Maildir读取，文件按mbox读取"""
+    for path in paths:
+        if os.path.isdir(path):
+            yield from iter_maildir(path, body_limit)
+        else:
+            yield from iter_mbox(path, body_limit)
+
+
+def body_snippet(message, max_bytes):
+    """从邮件开头找出正文段(纯文本优先，跳过附件)，与在线取正文摘要一样只解码前 max_bytes 字节"""
+    msg = BytesParser().parsebytes(bytes(message.header + message.body))
+    parts = [part for part in msg.walk()
+             if part.get_content_maintype() == "text" and part.get_content_disposition() != "attachment"]
+    parts.sort(key=lambda part: part.get_content_subtype() != "plain")
+    if not parts:
+        return ""
+    part = parts[0]
+    encoding = part.get("Content-Transfer-Encoding", "").strip().lower()
+    if encoding in ("base64", "quoted-printable"):
+        # 保留传输编码，截断处由 decode_snippet 处理
+        payload = part.get_payload()
+        data = payload.encode("ascii", "ignore") if isinstance(payload, str) else b""
+    else:
+        # 8bit/binary 的原始字节；get_payload() 会先按字符集解码成文本
+        data = part.get_payload(decode=True) or b""
+    # 段是否完整无从得知时按截断处理，只会丢掉末尾不完整的字符
+    truncated = message.truncated or len(data) > max_bytes
+    data = data[:max_bytes]
+    return decode_snippet(data, {
+        "subtype": part.get_content_subtype(),
+        "encoding": encoding,
+        "charset": part.get_content_charset(),
+        "size": len(data) + truncated,
+    })
+
+
+def parse_messages(messages, account, metrics, body_bytes=0):
+    """把存档邮件解析成与在线监控相同的邮件信息"""
+    parser = BytesHeaderParser()
+    for index, message in enumerate(messages, 1):
+        with metrics.timer("parse", account=account):
+            msg = parser.parsebytes(bytes(message.header))
+            email_info = {
+                'id': index,
+                'account': account,
+                'mailbox': message.source,
+                'subject': decode_mime_header(msg['Subject']),
+                'from': decode_mime_header(msg['From']),
+                'date': msg['Date'],
+                'message_id': normalize_message_id(msg['Message-ID']),
+                'arrived': message.arrived if message.arrived is not None else header_time(msg['Date']),
+                'size': message.size,
+            }
+            email_info['hash'] = email_hash(email_info)
+            email_info['key'] = email_key(email_info)
+        if body_bytes:
+            with metrics.timer("body", account=account):
+                email_info['snippet'] = body_snippet(message, body_bytes)
+        yield email_info
+
+
+def header_time(date):
+    try:
+        return parsedate_to_datetime(date).timestamp()
+    except (TypeError, ValueError, IndexError):
+        return None
+
+
+def pace(emails, speed, stop_event, max_gap=None):
+    """按原始到达间隔除以 speed 放出邮件；speed为0时不等待。两封邮件之间最多等待 max_gap 秒"""
+    origin = None
+    for email_info in emails:
+        arrived = email_info['arrived']
+        if speed and arrived is not None:
+            if origin is None:
+                origin = [arrived, time.monotonic()]
+            delay = origin[1] + (arrived - origin[0]) / speed - time.monotonic()
+            if max_gap is not None and delay > max_gap:
+                # 跳过长时间没有邮件的空档，后续邮件整体提前
+                origin[1] -= delay - max_gap
+                delay = max_gap
+            if delay > 0 and stop_event.wait(delay):
+                return
+        if stop_event.is_set():
+            return
+        yield email_info
+
+
+def batched(items, size):
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+class Replayer:
+    """把存档邮件送入提醒流程并统计吞吐量"""
+
+    MODES = ("alert", "seed", "dry-run")
+
+    def __init__(self, core, on_new_mail=None, mode="alert", account=REPLAY_ACCOUNT):
+        if mode not in self.MODES:
+            raise ValueError(f"未知的回放模式: {mode}")
+        self.core = core
+        self.on_new_mail = on_new_mail
+        self.mode = mode
+        self.account = account
+        self.metrics = core.metrics
+        self.stop_event = threading.Event()
+        # 试运行不写入记录，本次回放中出现过的邮件记在内存中
+        self.seen = set()
+        self.stats = {"messages": 0, "bytes": 0, "duplicates": 0, "new": 0, "actions": {}}
+
+    def stop(self):
+        """可从任意线程或信号处理函数中调用"""
+        self.stop_event.set()
+
+    def run(self, paths, speed=0, max_gap=None, batch_size=BATCH_SIZE):
+        """回放全部存档，返回统计结果"""
+        body_bytes = 0
+        if self.mode != "seed":
+            self.core.load_rules()
+            body_bytes = self.core.body_bytes()
+        if self.mode == "alert":
+            self.core.load_notifier()
+        # 按时间回放时逐封提醒，全速时成批处理
+        batch_size = 1 if speed else batch_size
+
+        start = time.perf_counter()
+        messages = iter_archives(paths, body_bytes + BODY_SLACK if body_bytes else 0)
+        emails = pace(parse_messages(messages, self.account, self.metrics, body_bytes),
+                      speed, self.stop_event, max_gap)
+        for batch in batched(emails, batch_size):
+            self.handle_batch(batch)
+            if self.stop_event.is_set():
+                break
+        return self.report(time.perf_counter() - start)
+
+    def handle_batch(self, batch):
+        self.stats["messages"] += len(batch)
+        self.stats["bytes"] += sum(email_info['size'] for email_info in batch)
+        with self.metrics.timer("dedup", account=self.account):
+            # 旧版记录只有邮件头哈希
+            processed = self.core.processed_emails.existing(
+                [email_info['key'] for email_info in batch] + [email_info['hash'] for email_info in batch])
+            new_emails = []
+            for email_info in batch:
+                if email_info['key'] in processed or email_info['hash'] in processed or email_info['key'] in self.seen:
+                    continue
+                processed.add(email_info['key'])
+                new_emails.append(email_info)
+        self.stats["duplicates"] += len(batch) - len(new_emails)
+        self.stats["new"] += len(new_emails)
+        if not new_emails:
+            return
+
+        if self.mode == "seed":
+            with self.metrics.timer("persistence", account=self.account):
+                self.core.processed_emails.add_many([email_info['key'] for email_info in new_emails])
+            return
+        if self.mode == "dry-run":
+            self.seen.update(email_info['key'] for email_info in new_emails)
+            with self.metrics.timer("rules", account=self.account):
+                groups = self.core.rules.route(new_emails, "loop")
+        else:
+            with self.metrics.timer("dispatch", account=self.account):
+                self.on_new_mail(self.account, new_emails)
+            groups = {}
+            for email_info in new_emails:
+                groups.setdefault(email_info['action'], []).append(email_info)
+        for action, group in groups.items():
+            self.stats["actions"][action] = self.stats["actions"].get(action, 0) + len(group)
+
+    def report(self, seconds):
+        stats = dict(self.stats, mode=self.mode, seconds=round(seconds, 3),
+                     messages_per_sec=round(self.stats["messages"] / seconds, 1) if seconds else None,
+                     mb_per_sec=round(self.stats["bytes"] / seconds / 1024 / 1024, 2) if seconds else None,
+                     stages=stage_totals(self.metrics), peak_rss_mb=peak_rss_mb(),
+                     stopped=self.stop_event.is_set())
+        return stats
+
+
+def print_report(stats):
+    print(f"模式 {stats['mode']}：{stats['messages']} 封，{stats['bytes']:,} 字节，用时 {stats['seconds']} 秒"
+          + ("(已中断)" if stats["stopped"] else ""))
+    if stats["messages_per_sec"] is not None:
+        print(f"{'吞吐量':<16}{stats['messages_per_sec']:>12,.0f} 封/秒{stats['mb_per_sec']:>10.2f} MB/秒")
+    print(f"{'新邮件':<16}{stats['new']:>12}")
+    print(f"{'已处理/重复':<16}{stats['duplicates']:>12}")
+    for action, count in sorted(stats["actions"].items()):
+        print(f"  {action:<14}{count:>12}")
+    for stage, total in stats["stages"].items():
+        print(f"  {stage:<14}{total['total_ms']:>12.1f} ms{total['count']:>10} 次")
+    if stats["peak_rss_mb"] is not None:
+        print(f"{'peak_rss':<16}{stats['peak_rss_mb']:>12.1f} MB")
+
+
+def main(argv=None):
+    from mail_daemon import MailDaemon
+    from mail_instance import SingleInstance
+
+    parser = argparse.ArgumentParser(description="从 mbox/Maildir 存档离线回放邮件")
+    parser.add_argument("paths", nargs="+", help="mbox文件或Maildir目录")
+    parser.add_argument("-c", "--config", default="app_config.json", help="配置文件路径")
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument("--seed", action="store_const", const="seed", dest="mode",
+                      help="只把邮件写入已处理记录，不提醒")
+    mode.add_argument("--dry-run", action="store_const", const="dry-run", dest="mode",
+                      help="只统计会如何提醒，不提醒也不写入记录")
+    parser.add_argument("--speed", type=float, default=0,
+                        help="按原始到达间隔回放的倍速，如60表示1分钟的间隔等待1秒；0为全速")
+    parser.add_argument("--max-gap", type=float, default=None, help="按时间回放时两封邮件之间最多等待的秒数")
+    parser.add_argument("--batch", type=int, default=BATCH_SIZE, help="全速回放时每批处理的邮件数")
+    parser.add_argument("--account", default=REPLAY_ACCOUNT, help="回放邮件使用的账号名")
+    parser.add_argument("--json", action="store_true", help="以JSON输出统计结果")
+    parser.add_argument("-v", "--verbose", action="store_true", help="输出每封邮件的处理状态")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING,
+                        format="%(asctime)s %(levelname)s %(message)s")
+    for path in args.paths:
+        if not os.path.exists(path):
+            logger.error(f"存档不存在: {path}")
+            return 1
+
+    # 与后台服务和界面版共用当前目录下的记录文件，它们运行时不能回放
+    with SingleInstance() as acquired:
+        if not acquired:
+            logger.error("程序已在运行中，请先停止后再回放")
+            return 1
+        daemon = MailDaemon(args.config)
+        replayer = Replayer(daemon.core, daemon.handle_new_emails, args.mode or "alert", args.account)
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            signal.signal(signum, lambda *a: replayer.stop())
+        try:
+            stats = replayer.run(args.paths, args.speed, args.max_gap, args.batch)
+        finally:
+            daemon.core.close()
+    if args.json:
+        print(json.dumps(stats, ensure_ascii=False, indent=2))
+    else:
+        print_report(stats)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
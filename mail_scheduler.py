@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+"""
+轮询调度 - 按邮件到达情况和时段调整单个账号的轮询间隔
+失败时按错误类型指数退避，所有等待时间都带随机抖动，避免多个实例同时访问服务器
+"""
+
+import time
+import random
+
+# 间隔变化：有新邮件时减半，没有时逐步放大
+GROWTH = 1.25
+# 每次等待在计算值上下浮动的比例
+JITTER = 0.2
+# 最短轮询间隔的下限(秒)
+MIN_INTERVAL_FLOOR = 5
+# 按小时统计的到达数每过一天衰减到这个比例，较早的规律逐渐被遗忘
+DAILY_DECAY = 0.8
+# 累计到这么多封邮件后才按时段调整
+HOURLY_MIN_SAMPLES = 20
+
+# 失败退避 (初始秒数, 上限秒数)：认证失败重试也没用，退避得更久
+BACKOFF = {
+    "auth": (60, 3600),
+    "network": (5, 300),
+}
+
+
+class PollScheduler:
+    """单个账号的轮询节奏"""
+
+    def __init__(self, interval, min_interval=None, max_interval=None, rng=None, clock=time.time):
+        self.base_interval = float(interval)
+        self.min_interval = float(min_interval or max(MIN_INTERVAL_FLOOR, interval / 3))
+        self.max_interval = float(max_interval or interval * 4)
+        self.interval = self.base_interval
+        self.hourly = [0.0] * 24
+        self.day = None
+        self.failures = 0
+        self.failure_kind = None
+        self.rng = rng or random.Random()
+        self.clock = clock
+
+    def record_success(self, new_count):
+        """一次同步成功，new_count为本次发现的新邮件数"""
+        self.failures = 0
+        self.failure_kind = None
+
+        now = self.clock()
+        day = int(now // 86400)
+        if self.day is not None and day != self.day:
+            self.hourly = [count * DAILY_DECAY ** (day - self.day) for count in self.hourly]
+        self.day = day
+        self.hourly[time.localtime(now).tm_hour] += new_count
+
+        if new_count:
+            self.interval = max(self.min_interval, self.interval / 2)
+        else:
+            self.interval = min(self.max_interval, self.interval * GROWTH)
+
+    def record_failure(self, kind="network"):
+        """一次同步失败，返回重试前应等待的秒数"""
+        self.failures += 1
+        self.failure_kind = kind
+        return self.next_delay()
+
+    def hour_factor(self):
+        """当前时段相对全天平均的活跃程度换算成间隔倍数：越活跃间隔越短，限制在0.5~2倍"""
+        total = sum(self.hourly)
+        if total < HOURLY_MIN_SAMPLES:
+            return 1.0
+        share = self.hourly[time.localtime(self.clock()).tm_hour] / (total / 24)
+        return min(2.0, max(0.5, 1 / share)) if share else 2.0
+
+    def backoff_delay(self):
+        """当前失败次数对应的退避秒数(未加抖动)"""
+        initial, cap = BACKOFF.get(self.failure_kind, BACKOFF["network"])
+        return min(cap, initial * 2 ** (self.failures - 1))
+
+    def poll_interval(self):
+        """当前的轮询间隔(未加抖动)"""
+        return min(self.max_interval, max(self.min_interval, self.interval * self.hour_factor()))
+
+    def next_delay(self):
+        """下一次等待的秒数(已加抖动)"""
+        if self.failures:
+            delay = self.backoff_delay()
+            # 退避时只在后半段抖动，保证至少等待一半时间
+            return delay / 2 + self.rng.uniform(0, delay / 2)
+        return self.poll_interval() * self.rng.uniform(1 - JITTER, 1 + JITTER)
+
+    def cadence(self):
+        """当前节奏的简短说明"""
+        if self.failures:
+            return f"第{self.failures}次失败，退避约{self.backoff_delay():.0f}秒"
+        return f"轮询间隔约{self.poll_interval():.0f}秒"
@@ -0,0 +1,261 @@
+# -*- coding: utf-8 -*-
+"""
+已处理邮件记录 - SQLite存储
+每封邮件只保存唯一标识(Message-ID，没有时用UIDVALIDITY+UID)的64位指纹，作为整数主键；
+内存中只有一个Bloom过滤器，没处理过的邮件(绝大多数查询)不需要查询数据库，
+几百万条记录也只占几MB内存。Bloom过滤器在关闭时存入数据库，启动时只补上之后新增的记录。
+每次确认只追加一行，按时间顺序淘汰最旧的记录；保留的条数和天数可配置，0表示不限
+"""
+
+import os
+import json
+import math
+import time
+import hashlib
+import secrets
+import sqlite3
+import threading
+
+# 保留最近的记录条数和天数，超出的按时间从旧到新淘汰
+MAX_RECORDS = 100000
+MAX_AGE_DAYS = 180
+# 每追加这么多条检查一次是否需要淘汰
+PRUNE_EVERY = 500
+# 批量查询时每条语句的指纹个数
+LOOKUP_CHUNK = 500
+# Bloom过滤器的误报率和最小容量；误报只会多查一次数据库
+BLOOM_ERROR_RATE = 0.01
+BLOOM_MIN_CAPACITY = 100000
+# 从数据库重建Bloom过滤器时每次读取的行数
+LOAD_CHUNK = 50000
+# 其他写入者(分片工作进程)的事务可能晚于记录的时间提交，补记录时多往前查这么多秒
+WRITER_MARGIN = 5
+
+
+def fingerprint(key):
+    """唯一标识的64位指纹(有符号，可直接作为SQLite整数)"""
+    digest = hashlib.blake2b(key.encode('utf-8', errors='surrogateescape'), digest_size=8).digest()
+    return int.from_bytes(digest, "big", signed=True)
+
+
+class BloomFilter:
+    """按64位指纹的Bloom过滤器：不在其中的一定没有处理过，在其中的需要再查数据库"""
+
+    def __init__(self, capacity, error_rate=BLOOM_ERROR_RATE):
+        self.capacity = max(int(capacity), 1)
+        self.size = max(64, int(-self.capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / self.capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def positions(self, fp):
+        # 指纹本身已是均匀的哈希值，两半做双重哈希得到各个位置
+        value = fp & 0xFFFFFFFFFFFFFFFF
+        low, high = value & 0xFFFFFFFF, (value >> 32) | 1
+        return [(low + i * high) % self.size for i in range(self.hashes)]
+
+    def add(self, fp):
+        for position in self.positions(fp):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, fp):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self.positions(fp))
+
+    @property
+    def saturated(self):
+        """加入的指纹超过容量，误报率开始上升"""
+        return self.count > self.capacity
+
+    @property
+    def memory_bytes(self):
+        return len(self.bits)
+
+
+class ProcessedStore:
+    """已处理邮件的集合，按唯一标识字符串支持 in / add / len / clear，可在多个线程中使用
+
+    数据库可以同时被多个进程写入：每条记录带写入者编号，关闭时先把其他写入者在本进程运行期间
+    追加的记录补进Bloom过滤器再保存，保存的过滤器不会漏掉已提交的记录
+    """
+
+    def __init__(self, path="processed_emails.db", max_records=MAX_RECORDS, max_age_days=MAX_AGE_DAYS):
+        self.path = path
+        self.max_records = max_records
+        self.max_age_days = max_age_days
+        self.lock = threading.Lock()
+        self.added_since_prune = 0
+        self.bloom = None
+        # 本实例的写入者编号；Bloom过滤器包含 loaded_at 之前提交的全部记录
+        self.writer = secrets.randbits(62)
+        self.loaded_at = None
+
+        self.db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        # WAL模式下追加只写日志，断电也不会损坏已提交的记录
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        # 指纹作为整数主键即rowid，不需要另建索引
+        self.db.execute("CREATE TABLE IF NOT EXISTS processed_fp ("
+                        "fp INTEGER PRIMARY KEY, processed_at REAL NOT NULL, writer INTEGER)")
+        if "writer" not in [row[1] for row in self.db.execute("PRAGMA table_info(processed_fp)")]:
+            self.db.execute("ALTER TABLE processed_fp ADD COLUMN writer INTEGER")
+        self.db.execute("CREATE INDEX IF NOT EXISTS processed_fp_at_idx ON processed_fp(processed_at)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS bloom_state ("
+                        "id INTEGER PRIMARY KEY CHECK (id = 1), capacity INTEGER NOT NULL, count INTEGER NOT NULL, "
+                        "saved_at REAL NOT NULL, bits BLOB NOT NULL, writer INTEGER)")
+        if "writer" not in [row[1] for row in self.db.execute("PRAGMA table_info(bloom_state)")]:
+            self.db.execute("ALTER TABLE bloom_state ADD COLUMN writer INTEGER")
+        self.migrate_hashes()
+        self.prune()
+        self.load_bloom()
+
+    def migrate_hashes(self):
+        """旧版按md5十六进制串保存的记录转换成指纹，旧记录仍可按同一个md5串查到"""
+        if not self.db.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'processed'").fetchone():
+            return
+        rows = self.db.execute("SELECT hash, processed_at FROM processed").fetchall()
+        with self.db:
+            self.db.execute("BEGIN")
+            self.db.executemany("INSERT OR IGNORE INTO processed_fp (fp, processed_at) VALUES (?, ?)",
+                                [(fingerprint(h), processed_at) for h, processed_at in rows])
+            self.db.execute("DROP TABLE processed")
+
+    def load_bloom(self, rebuild=False):
+        """读取上次保存的Bloom过滤器并补上之后新增的记录(包括异常退出前没保存的)；
+        没有保存过或容量不够时按当前记录数重建，容量留出增长的余地
+        """
+        with self.lock:
+            self.loaded_at = time.time() - WRITER_MARGIN
+            count = self.db.execute("SELECT COUNT(*) FROM processed_fp").fetchone()[0]
+            saved = None if rebuild else self.db.execute(
+                "SELECT capacity, count, saved_at, bits, writer FROM bloom_state WHERE id = 1").fetchone()
+            if saved is not None and saved[0] >= count:
+                bloom = BloomFilter(saved[0])
+                if len(saved[3]) == len(bloom.bits):
+                    bloom.bits[:] = saved[3]
+                    bloom.count = saved[1]
+                    # 保存之后的记录，以及其他写入者可能晚提交的稍早记录
+                    cursor = self.db.execute("SELECT fp FROM processed_fp WHERE processed_at >= ? "
+                                             "AND (writer IS NOT ? OR processed_at >= ?)",
+                                             (saved[2] - WRITER_MARGIN, saved[4], saved[2]))
+                    for (fp,) in cursor:
+                        if fp not in bloom:
+                            bloom.add(fp)
+                    self.bloom = bloom
+                    return
+            bloom = BloomFilter(max(BLOOM_MIN_CAPACITY, self.max_records or 0, count * 2))
+            cursor = self.db.execute("SELECT fp FROM processed_fp")
+            while True:
+                rows = cursor.fetchmany(LOAD_CHUNK)
+                if not rows:
+                    break
+                for (fp,) in rows:
+                    bloom.add(fp)
+            self.bloom = bloom
+
+    def __contains__(self, key):
+        fp = fingerprint(key)
+        with self.lock:
+            if fp not in self.bloom:
+                return False
+            row = self.db.execute("SELECT 1 FROM processed_fp WHERE fp = ?", (fp,)).fetchone()
+        return row is not None
+
+    def __len__(self):
+        with self.lock:
+            return self.db.execute("SELECT COUNT(*) FROM processed_fp").fetchone()[0]
+
+    def existing(self, keys):
+        """一批唯一标识中已处理的那些；Bloom过滤器排除的不查询，其余分段查询避免超出参数个数限制"""
+        by_fp = {}
+        with self.lock:
+            for key in keys:
+                fp = fingerprint(key)
+                if fp in self.bloom:
+                    by_fp.setdefault(fp, []).append(key)
+            candidates = list(by_fp)
+            found = set()
+            for start in range(0, len(candidates), LOOKUP_CHUNK):
+                chunk = candidates[start:start + LOOKUP_CHUNK]
+                rows = self.db.execute(f"SELECT fp FROM processed_fp WHERE fp IN ({','.join('?' * len(chunk))})",
+                                       chunk)
+                for (fp,) in rows:
+                    found.update(by_fp[fp])
+        return found
+
+    def add(self, key):
+        self.add_many([key])
+
+    def add_many(self, keys, processed_at=None):
+        """在一个事务中追加多条记录"""
+        processed_at = time.time() if processed_at is None else processed_at
+        fps = [fingerprint(key) for key in keys]
+        with self.lock:
+            with self.db:
+                self.db.execute("BEGIN")
+                self.db.executemany("INSERT OR IGNORE INTO processed_fp (fp, processed_at, writer) VALUES (?, ?, ?)",
+                                    [(fp, processed_at, self.writer) for fp in fps])
+            for fp in fps:
+                self.bloom.add(fp)
+            self.added_since_prune += len(fps)
+            need_prune = self.added_since_prune >= PRUNE_EVERY
+            saturated = self.bloom.saturated
+        if need_prune:
+            self.prune()
+        if saturated:
+            self.load_bloom(rebuild=True)
+
+    def clear(self):
+        with self.lock:
+            self.db.execute("DELETE FROM processed_fp")
+            self.db.execute("DELETE FROM bloom_state")
+            self.bloom = BloomFilter(self.bloom.capacity)
+
+    def prune(self):
+        """按时间和条数淘汰最旧的记录；Bloom过滤器中留下的位只会带来误报，容量用满时重建"""
+        with self.lock:
+            self.added_since_prune = 0
+            if self.max_age_days:
+                cutoff = time.time() - self.max_age_days * 86400
+                self.db.execute("DELETE FROM processed_fp WHERE processed_at < ?", (cutoff,))
+            if self.max_records:
+                self.db.execute("DELETE FROM processed_fp WHERE fp IN ("
+                                "SELECT fp FROM processed_fp ORDER BY processed_at DESC "
+                                "LIMIT -1 OFFSET ?)", (self.max_records,))
+
+    def import_json(self, json_path):
+        """导入旧版 processed_emails.json，成功后改名，只导入一次"""
+        if not os.path.exists(json_path):
+            return 0
+        with open(json_path, 'r', encoding='utf-8') as f:
+            hashes = json.load(f).get('processed_emails', [])
+        # 旧文件没有时间信息，按文件中的顺序给出递增的时间
+        now = time.time() - len(hashes)
+        rows = [(fingerprint(h), now + i, self.writer) for i, h in enumerate(hashes)]
+        with self.lock:
+            with self.db:
+                self.db.execute("BEGIN")
+                self.db.executemany("INSERT OR IGNORE INTO processed_fp (fp, processed_at, writer) VALUES (?, ?, ?)",
+                                    rows)
+            for fp, _, _ in rows:
+                self.bloom.add(fp)
+        os.replace(json_path, json_path + ".migrated")
+        return len(hashes)
+
+    def close(self):
+        """保存Bloom过滤器后关闭，下次启动不需要读取全部记录"""
+        with self.lock:
+            saved_at = time.time()
+            try:
+                # 其他写入者在本进程运行期间追加的记录，先补进过滤器
+                cursor = self.db.execute("SELECT fp FROM processed_fp WHERE processed_at >= ? AND writer IS NOT ?",
+                                         (self.loaded_at, self.writer))
+                for (fp,) in cursor:
+                    if fp not in self.bloom:
+                        self.bloom.add(fp)
+                self.db.execute("INSERT OR REPLACE INTO bloom_state (id, capacity, count, saved_at, bits, writer) "
+                                "VALUES (1, ?, ?, ?, ?, ?)",
+                                (self.bloom.capacity, self.bloom.count, saved_at, bytes(self.bloom.bits), self.writer))
+            except sqlite3.Error:
+                pass
+            self.db.close()
@@ -0,0 +1,321 @@
+# -*- coding: utf-8 -*-
+"""
+分片监督进程 - 账号很多时按一致性哈希把账号分到多个工作进程，每个工作进程运行一份后台服务
+工作进程通过管道定时报告健康状态和指标，由监督进程汇总后在 metrics_port 上统一提供；
+工作进程崩溃或不再报告时按退避重启，配置中的账号增减或修改时只重启受影响的分片
+
+用法: python mail_daemon.py -w 4 [-c app_config.json]
+"""
+
+import os
+import sys
+import json
+import time
+import bisect
+import signal
+import hashlib
+import logging
+import threading
+import multiprocessing
+from multiprocessing.connection import wait
+
+from mail_core import MailAlertCore
+from mail_daemon import MailDaemon, logger
+from mail_engine import account_id, load_accounts
+from mail_metrics import Metrics, MetricsServer
+
+# 每个工作进程在哈希环上的虚拟节点数，越多分配越均匀
+VIRTUAL_NODES = 100
+# 工作进程报告健康状态和指标的间隔(秒)，超过 HEALTH_TIMEOUT 没有报告视为无响应
+REPORT_INTERVAL = 5
+HEALTH_TIMEOUT = 3 * REPORT_INTERVAL
+# 重启退避：首次等待 RESTART_DELAY 秒，连续失败时加倍；运行超过 STABLE_AFTER 秒后重新计数
+RESTART_DELAY = 1
+RESTART_MAX_DELAY = 60
+STABLE_AFTER = 60
+# 检查配置文件是否修改的间隔(秒)
+CONFIG_CHECK = 5
+# 停止时等待工作进程正常退出的秒数，之后强制结束
+STOP_TIMEOUT = 5
+
+
+def ring_hash(key):
+    return int.from_bytes(hashlib.blake2b(str(key).encode("utf-8"), digest_size=8).digest(), "big")
+
+
+class HashRing:
+    """一致性哈希环：增减账号只影响该账号所在的分片，改变工作进程数时只移动约1/N的账号"""
+
+    def __init__(self, nodes, replicas=VIRTUAL_NODES):
+        points = sorted((ring_hash(f"{node}#{index}"), node) for node in nodes for index in range(replicas))
+        self.hashes = [point[0] for point in points]
+        self.nodes = [point[1] for point in points]
+
+    def node_for(self, key):
+        index = bisect.bisect(self.hashes, ring_hash(key)) % len(self.hashes)
+        return self.nodes[index]
+
+
+def assign_accounts(ring, shards, accounts):
+    """按哈希环把账号分到各分片，返回 {分片: {account_id: 账号配置}}，没有账号的分片为空字典"""
+    assignment = {shard: {} for shard in shards}
+    for account in accounts:
+        key = account_id(account)
+        assignment[ring.node_for(key)][key] = account
+    return assignment
+
+
+def changed_shards(current, assignment):
+    """新旧分配中账号或账号配置有变化、需要重启的分片"""
+    return {shard for shard in assignment if current.get(shard) != assignment[shard]}
+
+
+class ShardWorker(MailDaemon):
+    """工作进程：只监控分到的账号；Ctrl+C 由监督进程统一处理，工作进程只响应停止命令和SIGTERM"""
+
+    STOP_SIGNALS = (signal.SIGTERM,)
+
+
+def run_worker(config_file, shard, account_ids, conn, verbose=False):
+    """工作进程入口(spawn启动)：运行后台服务，另起线程定时报告并等待停止命令"""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    logging.basicConfig(level=logging.DEBUG if verbose else logging.INFO,
+                        format=f"%(asctime)s %(levelname)s [分片{shard}] %(message)s")
+    worker = ShardWorker(config_file, shard=shard, account_ids=account_ids)
+    # 指标由监督进程汇总后统一提供，工作进程不占用端口
+    worker.core.config["metrics_port"] = 0
+    threading.Thread(target=report_loop, args=(worker, shard, conn), daemon=True).start()
+    sys.exit(worker.run())
+
+
+def report_loop(worker, shard, conn):
+    """每隔 REPORT_INTERVAL 发送一次健康报告；收到停止命令或监督进程退出(管道关闭)时停止监控"""
+    while True:
+        try:
+            if conn.poll(REPORT_INTERVAL):
+                # 监督进程只会发送停止命令
+                conn.recv()
+                break
+            conn.send(health_report(worker, shard))
+        except (EOFError, OSError):
+            break
+    # 引擎可能还没有创建，一直请求停止直到主线程退出
+    while threading.main_thread().is_alive():
+        worker.core.stop()
+        time.sleep(0.1)
+
+
+def health_report(worker, shard):
+    snapshot = worker.core.metrics.snapshot()
+    return {
+        "shard": shard,
+        "pid": os.getpid(),
+        "time": time.time(),
+        "connected": sum(entry["value"] for entry in snapshot["gauges"] if entry["name"] == "mail_connected"),
+        "metrics": snapshot,
+    }
+
+
+class Worker:
+    """一个分片：分到的账号 {account_id: 账号配置}、当前进程和重启退避"""
+
+    def __init__(self, shard):
+        self.shard = shard
+        self.accounts = {}
+        self.process = None
+        self.conn = None
+        self.started_at = 0.0
+        self.last_report = 0.0
+        self.connected = 0
+        self.failures = 0
+        self.restart_at = 0.0
+
+
+class Supervisor:
+    """启动、监督和重新分配分片工作进程，汇总它们报告的指标"""
+
+    def __init__(self, config_file, workers, verbose=False):
+        self.config_file = config_file
+        self.verbose = verbose
+        self.workers = [Worker(shard) for shard in range(workers)]
+        self.ring = HashRing(range(workers))
+        self.metrics = Metrics()
+        self.metrics_server = None
+        self.config = {}
+        self.config_mtime = None
+        self.next_config_check = 0.0
+        self.reload_requested = False
+        self.stop_event = threading.Event()
+        # 用spawn启动：工作进程不继承监督进程的线程和打开的数据库
+        self.context = multiprocessing.get_context("spawn")
+
+    def load_assignment(self):
+        """读取配置中的账号，按哈希环分配，返回 {分片: {account_id: 账号配置}}"""
+        self.config_mtime = os.stat(self.config_file).st_mtime
+        with open(self.config_file, 'r', encoding='utf-8') as f:
+            self.config = json.load(f)
+        return assign_accounts(self.ring, [worker.shard for worker in self.workers], load_accounts(self.config))
+
+    def run(self):
+        # 先打开一次共用的记录，完成旧版记录的迁移和导入，工作进程不会同时去做
+        MailAlertCore(self.config_file, on_status=logger.info).close()
+        try:
+            assignment = self.load_assignment()
+        except (OSError, ValueError) as e:
+            logger.error(f"读取配置失败: {e}")
+            return 1
+        if not any(assignment.values()):
+            logger.error(f"配置文件中没有邮箱账号: {self.config_file}")
+            return 1
+
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            signal.signal(signum, lambda *args: self.stop_event.set())
+        if hasattr(signal, "SIGHUP"):
+            # SIGHUP：重启全部工作进程，重新加载规则、通知等全部配置
+            signal.signal(signal.SIGHUP, lambda *args: setattr(self, "reload_requested", True))
+
+        self.start_metrics_server()
+        self.rebalance(assignment)
+        try:
+            while not self.stop_event.is_set():
+                self.receive_reports(1)
+                self.check_workers()
+                self.check_config()
+        finally:
+            self.stop_workers(self.workers)
+            if self.metrics_server is not None:
+                self.metrics_server.stop()
+        logger.info("分片监控已停止")
+        return 0
+
+    def start_metrics_server(self):
+        port = int(self.config.get("metrics_port") or 0)
+        if not port:
+            return
+        host = self.config.get("metrics_host") or "127.0.0.1"
+        try:
+            self.metrics_server = MetricsServer(self.metrics, port, host).start()
+            logger.info(f"指标服务: http://{host}:{port}/metrics")
+        except OSError as e:
+            logger.error(f"启动指标服务失败: {e}")
+
+    def rebalance(self, assignment):
+        """按新的分配重启账号有变化的分片；先全部停止再启动，同一账号不会同时在两个进程中监控"""
+        shards = changed_shards({worker.shard: worker.accounts for worker in self.workers}, assignment)
+        changed = [worker for worker in self.workers if worker.shard in shards]
+        if not changed:
+            return
+        self.stop_workers(changed)
+        for worker in changed:
+            worker.accounts = assignment[worker.shard]
+            worker.failures = 0
+            worker.restart_at = 0.0
+            self.metrics.set("mail_worker_accounts", len(worker.accounts), shard=str(worker.shard))
+            if not worker.accounts:
+                self.metrics.load({}, shard=str(worker.shard))
+        logger.info("账号分配: " + "，".join(f"分片{worker.shard} {len(worker.accounts)}个"
+                                          for worker in self.workers))
+
+    def start_worker(self, worker):
+        parent, child = self.context.Pipe()
+        process = self.context.Process(target=run_worker, name=f"mail-shard-{worker.shard}",
+                                       args=(self.config_file, worker.shard, sorted(worker.accounts), child,
+                                             self.verbose))
+        process.start()
+        child.close()
+        worker.process, worker.conn = process, parent
+        worker.started_at = time.monotonic()
+        worker.last_report = 0.0
+        self.metrics.set("mail_worker_up", 1, shard=str(worker.shard))
+        logger.info(f"分片{worker.shard} 已启动 (pid {process.pid})，{len(worker.accounts)} 个账号")
+
+    def receive_reports(self, timeout):
+        """等待工作进程的报告，最长timeout秒"""
+        conns = {worker.conn: worker for worker in self.workers if worker.conn is not None}
+        if not conns:
+            self.stop_event.wait(timeout)
+            return
+        for conn in wait(list(conns), timeout):
+            worker = conns[conn]
+            try:
+                report = conn.recv()
+            except (EOFError, OSError):
+                # 进程已退出，由 check_workers 处理
+                conn.close()
+                worker.conn = None
+                continue
+            worker.last_report = time.monotonic()
+            worker.connected = report["connected"]
+            shard = str(worker.shard)
+            self.metrics.load(report["metrics"], shard=shard)
+            self.metrics.set("mail_worker_last_report_timestamp_seconds", report["time"], shard=shard)
+
+    def check_workers(self):
+        """启动到了重启时间的分片，处理异常退出和不再报告的工作进程"""
+        now = time.monotonic()
+        for worker in self.workers:
+            if not worker.accounts:
+                continue
+            if worker.process is None:
+                if now >= worker.restart_at:
+                    self.start_worker(worker)
+            elif not worker.process.is_alive():
+                self.worker_failed(worker, f"异常退出 (退出码 {worker.process.exitcode})")
+            elif now - max(worker.last_report, worker.started_at) > HEALTH_TIMEOUT:
+                self.worker_failed(worker, f"{HEALTH_TIMEOUT}秒没有报告")
+
+    def worker_failed(self, worker, reason):
+        now = time.monotonic()
+        if now - worker.started_at > STABLE_AFTER:
+            worker.failures = 0
+        worker.failures += 1
+        delay = min(RESTART_MAX_DELAY, RESTART_DELAY * 2 ** (worker.failures - 1))
+        worker.restart_at = now + delay
+        self.kill_worker(worker)
+        self.metrics.inc("mail_worker_restarts_total", shard=str(worker.shard))
+        logger.warning(f"分片{worker.shard} {reason}，{delay}秒后重启")
+
+    def stop_workers(self, workers):
+        """发送停止命令，等待各工作进程保存记录后退出，超时的强制结束"""
+        running = [worker for worker in workers if worker.process is not None]
+        for worker in running:
+            try:
+                worker.conn.send("stop")
+            except (AttributeError, OSError):
+                worker.process.terminate()
+        deadline = time.monotonic() + STOP_TIMEOUT
+        for worker in running:
+            worker.process.join(max(0.0, deadline - time.monotonic()))
+            if worker.process.is_alive():
+                logger.warning(f"分片{worker.shard} {STOP_TIMEOUT}秒内没有退出，强制结束")
+            self.kill_worker(worker)
+
+    def kill_worker(self, worker):
+        if worker.process.is_alive():
+            worker.process.kill()
+            worker.process.join(1)
+        if worker.conn is not None:
+            worker.conn.close()
+        worker.process = worker.conn = None
+        worker.connected = 0
+        self.metrics.set("mail_worker_up", 0, shard=str(worker.shard))
+
+    def check_config(self):
+        """配置文件修改后重新分配账号，收到SIGHUP时重启全部工作进程"""
+        if self.reload_requested:
+            self.reload_requested = False
+            logger.info("重新加载配置，重启全部工作进程")
+            self.stop_workers(self.workers)
+            for worker in self.workers:
+                worker.accounts = {}
+        elif time.monotonic() < self.next_config_check:
+            return
+        self.next_config_check = time.monotonic() + CONFIG_CHECK
+        try:
+            if os.stat(self.config_file).st_mtime == self.config_mtime and any(w.accounts for w in self.workers):
+                return
+            assignment = self.load_assignment()
+        except (OSError, ValueError) as e:
+            logger.error(f"读取配置失败，保持当前分配: {e}")
+            return
+        self.rebalance(assignment)
@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+"""提醒声音：缓存只在文件变化时重新读取，stop() 打断循环播放，播放一次不打断循环提醒；用不出声的空后端"""
+
+import os
+import time
+
+import pytest
+
+from mail_audio import AudioError, AudioPlayer, NullBackend, write_default_tone
+
+
+@pytest.fixture
+def player():
+    player = AudioPlayer(NullBackend(), on_error=lambda msg: None)
+    yield player
+    player.stop()
+
+
+def test_cache_reloaded_only_when_file_changes(player, tmp_path):
+    path = str(tmp_path / "alert.wav")
+    write_default_tone(path, duration=0.1)
+    sound = player.load(path)
+    assert player.load(path) is sound
+
+    # 内容和时间都变了才重新读取
+    write_default_tone(path, duration=0.2)
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+    reloaded = player.load(path)
+    assert reloaded is not sound
+    assert reloaded.duration == pytest.approx(0.2)
+    assert player.load(path) is reloaded
+
+    other = str(tmp_path / "other.wav")
+    write_default_tone(other, duration=0.1)
+    assert player.load(other).path == other
+    with pytest.raises(AudioError):
+        player.load(str(tmp_path / "missing.wav"))
+
+
+def test_stop_interrupts_loop(player, tmp_path):
+    path = str(tmp_path / "alert.wav")
+    write_default_tone(path, duration=5)
+    player.play_loop(path, gap=0.01)
+    time.sleep(0.05)
+    assert player.is_playing
+    start = time.perf_counter()
+    player.stop()
+    # 不必等5秒的声音放完
+    assert time.perf_counter() - start < 0.5
+    assert not player.is_playing
+
+
+def test_play_once_does_not_cancel_loop(player, tmp_path):
+    loop_path = str(tmp_path / "loop.wav")
+    once_path = str(tmp_path / "once.wav")
+    write_default_tone(loop_path, duration=0.05)
+    write_default_tone(once_path, duration=0.05)
+    player.play_loop(loop_path, gap=0.01)
+    player.play_once(once_path)
+    time.sleep(0.3)
+    assert player.is_playing and player.looping
+    plays = player.backend.plays
+    assert once_path not in plays
+    assert plays.count(loop_path) >= 2
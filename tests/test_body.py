@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+"""正文摘要：按 BODYSTRUCTURE 选段、部分取信和解码，用本地模拟IMAP服务器"""
+
+import asyncio
+import base64
+import quopri
+
+import pytest
+
+from fake_imap_server import FakeImapServer
+from mail_engine import ACCOUNT_DEFAULTS, AccountMonitor
+from mail_metrics import Metrics
+from mail_parse import HeaderParser
+
+HEADERS = "From: a@example.com\r\nSubject: test\r\nMessage-ID: <{uid}@example.com>\r\nMIME-Version: 1.0\r\n"
+
+
+class SnippetEngine:
+    """AccountMonitor 需要的最少的引擎属性"""
+
+    def __init__(self):
+        self.body_bytes = 0
+        self.parser = HeaderParser(0)
+        self.metrics = Metrics()
+
+    def status(self, msg):
+        pass
+
+
+def part(content_type, body, encoding="8bit", extra=""):
+    return (f"Content-Type: {content_type}\r\nContent-Transfer-Encoding: {encoding}\r\n{extra}\r\n").encode("ascii") + body
+
+
+def multipart(subtype, *parts):
+    boundary = f"=_{subtype}"
+    return (f"Content-Type: multipart/{subtype}; boundary=\"{boundary}\"\r\n\r\n".encode("ascii")
+            + b"".join(f"--{boundary}\r\n".encode("ascii") + p + b"\r\n" for p in parts)
+            + f"--{boundary}--\r\n".encode("ascii"))
+
+
+def message(uid, body):
+    return HEADERS.format(uid=uid).encode("ascii") + body
+
+
+@pytest.fixture
+def server():
+    server = FakeImapServer().start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def fetch_snippets(server, bodies, max_bytes=4096):
+    """把邮件放进INBOX，连接后取正文摘要，返回按追加顺序的摘要列表"""
+    box = server.mailbox("INBOX")
+    uids = [box.append(message(index, body)) for index, body in enumerate(bodies)]
+    account = dict(ACCOUNT_DEFAULTS, name="test", server="127.0.0.1", port=server.port, email="user",
+                   password="pass", ssl=False)
+    monitor = AccountMonitor(account, SnippetEngine())
+
+    async def run():
+        await monitor.connect()
+        try:
+            return await monitor.fetch_snippets(uids, max_bytes)
+        finally:
+            monitor.disconnect()
+
+    snippets = asyncio.run(run())
+    return [snippets.get(uid) for uid in uids]
+
+
+def test_plain_text_preferred_over_html(server):
+    body = multipart("alternative",
+                     part("text/plain; charset=utf-8", "纯文本正文".encode("utf-8")),
+                     part("text/html; charset=utf-8", "<p>网页正文</p>".encode("utf-8")))
+    assert fetch_snippets(server, [body]) == ["纯文本正文"]
+
+
+def test_html_fallback_and_attachments_skipped(server):
+    attachment = part("text/plain; charset=utf-8; name=\"notes.txt\"", b"attachment text",
+                      extra="Content-Disposition: attachment; filename=\"notes.txt\"\r\n")
+    html = part("text/html; charset=utf-8", base64.encodebytes("<p>只有&lt;网页&gt;<b>正文</b></p>".encode("utf-8")),
+                encoding="base64")
+    body = multipart("mixed", attachment, multipart("alternative", html))
+    assert fetch_snippets(server, [body]) == ["只有<网页> 正文"]
+
+
+def test_transfer_encodings_and_gbk_as_gb18030(server):
+    # 𠀀 不在GBK中，只有按GB18030解码才不是乱码
+    gbk = part("text/plain; charset=gbk", base64.encodebytes("生僻字𠀀".encode("gb18030")), encoding="base64")
+    qp = part("text/plain; charset=utf-8", quopri.encodestring("引用可打印 = 编码".encode("utf-8")),
+              encoding="quoted-printable")
+    assert fetch_snippets(server, [gbk, qp]) == ["生僻字𠀀", "引用可打印 = 编码"]
+
+
+def test_multibyte_character_cut_at_cap_is_dropped(server):
+    body = part("text/plain; charset=utf-8", ("中文" * 100).encode("utf-8"))
+    # 7个字节：2个完整的汉字加上第3个的1个字节
+    assert fetch_snippets(server, [body], max_bytes=7) == ["中文"]
+    base64_body = part("text/plain; charset=utf-8", base64.encodebytes(("中文" * 100).encode("utf-8")),
+                       encoding="base64")
+    snippet = fetch_snippets(server, [base64_body], max_bytes=10)[0]
+    assert snippet and "�" not in snippet and ("中文" * 100).startswith(snippet)
@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+"""提醒后没有确认的邮件：下次开始监控时重新提醒，不会丢失"""
+
+from mail_core import MailAlertCore
+from mail_metrics import Metrics
+
+
+def make_email(uid):
+    return {'key': f"mid:{uid}@example.com", 'account': "work", 'mailbox': "INBOX", 'from': f"sender{uid}",
+            'subject': f"主题{uid}", 'date': "Mon, 12 Oct 2026 09:00:00 +0800", 'action': "loop", 'rule': None}
+
+
+def test_unacknowledged_alerts_are_requeued(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    core = MailAlertCore(on_status=lambda msg: None)
+    emails = [make_email(uid) for uid in range(3)]
+    core.history.record(emails)
+    core.mark_processed(emails[:1])
+    # 另一个进程确认过的邮件只补记确认时间
+    core.processed_emails.add(emails[1]['key'])
+    core.close()
+
+    core = MailAlertCore(on_status=lambda msg: None)
+    try:
+        pending = core.pending_alerts()
+        assert [email_info['key'] for email_info in pending] == [emails[2]['key']]
+        assert pending[0]['account'] == "work" and pending[0]['subject'] == "主题2"
+        core.mark_processed(pending)
+        assert core.pending_alerts() == []
+    finally:
+        core.close()
+
+
+def test_pending_alerts_metric_counts_unacknowledged(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    core = MailAlertCore(on_status=lambda msg: None)
+    core.metrics = Metrics()
+    core.account_names = ["work", "home"]
+    try:
+        emails = [make_email(uid) for uid in range(3)]
+        core.history.record(emails)
+        core.update_pending_metric()
+        assert pending_gauge(core, "work") == 3 and pending_gauge(core, "home") == 0
+        core.mark_processed(emails[:2])
+        assert pending_gauge(core, "work") == 1
+    finally:
+        core.close()
+
+
+def pending_gauge(core, account):
+    return next(entry["value"] for entry in core.metrics.snapshot()["gauges"]
+                if entry["name"] == "mail_pending_alerts" and entry["account"] == account)
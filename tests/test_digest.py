@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+"""提醒汇总：去重、防抖窗口、持续到达时的最长等待和按账号计数，时钟可注入"""
+
+from mail_digest import MAX_WAIT_FACTOR, AlertDigest
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def make_email(uid, account="work"):
+    return {'key': f"mid:{uid}@example.com", 'account': account, 'from': "a@example.com", 'subject': f"主题{uid}"}
+
+
+def test_same_mail_counted_once():
+    digest = AlertDigest(2, clock=FakeClock())
+    assert digest.add([make_email(1), make_email(2), make_email(1)]) == 2
+    assert digest.add([make_email(2)]) == 0
+    assert len(digest) == 2
+
+
+def test_shown_after_quiet_window():
+    clock = FakeClock()
+    digest = AlertDigest(2, clock=clock)
+    assert not digest.ready()
+    digest.add([make_email(1)])
+    clock.now += 1.5
+    digest.add([make_email(2)])
+    clock.now += 1.5
+    # 距上一封只过了1.5秒
+    assert not digest.ready()
+    clock.now += 0.5
+    assert digest.ready()
+    digest.shown = True
+    assert not digest.ready()
+
+
+def test_steady_stream_capped_at_max_wait():
+    clock = FakeClock()
+    digest = AlertDigest(2, clock=clock)
+    assert digest.max_wait == 2 * MAX_WAIT_FACTOR
+    waited = 0.0
+    uid = 0
+    while not digest.ready():
+        uid += 1
+        digest.add([make_email(uid)])
+        clock.now += 1
+        waited += 1
+    # 每秒都有新邮件，防抖窗口永远不会结束，第一封邮件最多等待 max_wait
+    assert waited == digest.max_wait
+
+
+def test_account_counts_and_take():
+    digest = AlertDigest(2, clock=FakeClock())
+    digest.add([make_email(1), make_email(2), make_email(3, "home")])
+    assert digest.accounts() == {"work": 2, "home": 1}
+    digest.shown = True
+    emails = digest.take()
+    assert [email_info['key'] for email_info in emails] == [make_email(uid)['key'] for uid in (1, 2, 3)]
+    assert len(digest) == 0 and not digest.shown and digest.accounts() == {}
+    # 清空后同一封邮件可以再次加入
+    assert digest.add([make_email(1)]) == 1
@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+"""监控引擎同步流程，用本地模拟IMAP服务器"""
+
+import json
+import asyncio
+
+import pytest
+
+from fake_imap_server import FakeImapServer
+from mail_engine import ACCOUNT_DEFAULTS, AccountMonitor, SyncStateStore
+from mail_metrics import Metrics
+from mail_parse import HeaderParser
+
+
+class StubEngine:
+    """代替 MonitorEngine：记录提醒，可在提醒若干封后模拟断线"""
+
+    def __init__(self, sync_file, fail_after=None):
+        self.sync_store = SyncStateStore(sync_file)
+        self.body_bytes = 0
+        self.parser = HeaderParser(0)
+        self.metrics = Metrics()
+        self.processed = set()
+        self.alerted = []
+        self.fail_after = fail_after
+
+    def status(self, msg):
+        pass
+
+    async def dispatch(self, monitor, new_emails):
+        self.alerted.extend(new_emails)
+        self.processed.update(email_info['key'] for email_info in new_emails)
+        if self.fail_after is not None and len(self.alerted) >= self.fail_after:
+            self.fail_after = None
+            raise ConnectionError("模拟断线")
+
+
+def gauge(metrics, name, **labels):
+    return sum(entry["value"] for entry in metrics.snapshot()["gauges"]
+               if entry["name"] == name and all(entry.get(key) == value for key, value in labels.items()))
+
+
+@pytest.fixture
+def server():
+    server = FakeImapServer().start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def make_monitor(server, engine, mailboxes):
+    account = dict(ACCOUNT_DEFAULTS, name="test", server="127.0.0.1", port=server.port, email="user",
+                   password="pass", ssl=False, mailboxes=mailboxes)
+    return AccountMonitor(account, engine)
+
+
+def test_interrupted_backlog_in_other_folder_resumes(server, tmp_path):
+    """其他文件夹首次同步被中断后，之后的轮询继续处理剩下的积压分段"""
+    server.mailbox("INBOX")
+    server.mailbox("Folder1").add_synthetic(12000)
+    engine = StubEngine(str(tmp_path / "sync_state.db"), fail_after=1)
+
+    backlog = []
+
+    async def run():
+        monitor = make_monitor(server, engine, ["INBOX", "Folder1"])
+        await monitor.connect()
+        with pytest.raises(ConnectionError):
+            await monitor.sync()
+        backlog.append(gauge(engine.metrics, "mail_backlog_uids", folder="Folder1"))
+        monitor.disconnect()
+        await monitor.connect()
+        for _ in range(3):
+            await monitor.sync()
+        monitor.disconnect()
+
+    asyncio.run(run())
+    engine.sync_store.close()
+    state = engine.sync_store.get("user@127.0.0.1:%d/Folder1" % server.port)
+    assert "backlog" not in state
+    assert len({email_info['id'] for email_info in engine.alerted}) == 12000
+    # 中断时积压还在，处理完后为0
+    assert backlog[0] > 0
+    assert gauge(engine.metrics, "mail_backlog_uids", folder="Folder1") == 0
+
+
+def test_sync_state_shared_by_shards(tmp_path):
+    """两个分片共用同步状态数据库，各自只写自己的邮箱，重新打开后都在"""
+    path = str(tmp_path / "sync_state.db")
+    first, second = SyncStateStore(path), SyncStateStore(path)
+    first.update("a@imap.example.com:993/INBOX", 7, 100, [[1, 50, "UNSEEN"]])
+    second.update("b@imap.example.com:993/INBOX", 9, 200)
+    first.update("a@imap.example.com:993/INBOX", 7, 120)
+    first.close()
+    second.close()
+
+    store = SyncStateStore(path)
+    try:
+        assert store.get("a@imap.example.com:993/INBOX") == {"uidvalidity": 7, "last_uid": 120}
+        assert store.get("b@imap.example.com:993/INBOX") == {"uidvalidity": 9, "last_uid": 200}
+    finally:
+        store.close()
+
+
+def test_sync_state_imports_legacy_json(tmp_path):
+    legacy = tmp_path / "sync_state.json"
+    legacy.write_text(json.dumps({"a@imap.example.com:993/INBOX": {
+        "uidvalidity": 7, "last_uid": 100, "backlog": [[1, 50, "UNSEEN"]]}}), encoding="utf-8")
+    store = SyncStateStore(str(tmp_path / "sync_state.db"))
+    assert store.import_json(str(legacy)) == 1
+    assert store.import_json(str(legacy)) == 0
+    store.close()
+
+    store = SyncStateStore(str(tmp_path / "sync_state.db"))
+    try:
+        assert store.get("a@imap.example.com:993/INBOX") == {
+            "uidvalidity": 7, "last_uid": 100, "backlog": [[1, 50, "UNSEEN"]]}
+    finally:
+        store.close()
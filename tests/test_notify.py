@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+"""通知：本机的接收端代替真实的webhook和套接字服务，发送慢的目标不能拖慢其他目标和监控"""
+
+import json
+import time
+import queue
+import socket
+import threading
+import urllib.error
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from mail_metrics import Metrics, MetricsServer
+from mail_notify import Notifier, SocketSink, WebhookSink, build_event
+
+EMAILS = [{'key': "mid:1@example.com", 'account': "work", 'from': "boss@example.com", 'subject': "周报",
+           'date': "Mon, 12 Oct 2026 09:00:00 +0800", 'rule': "老板", 'action': "loop"}]
+
+
+@pytest.fixture
+def webhook():
+    """本机HTTP接收端，收到的JSON放入队列"""
+    received = queue.Queue()
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            received.put(json.loads(self.rfile.read(int(self.headers["Content-Length"]))))
+            self.send_response(204)
+            self.end_headers()
+
+        def log_message(self, format, *args):
+            pass
+
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{httpd.server_address[1]}/mail", received
+    httpd.shutdown()
+    httpd.server_close()
+
+
+@pytest.fixture
+def receiver():
+    """本机TCP接收端，每个连接收到的一行JSON放入队列"""
+    received = queue.Queue()
+    server = socket.create_server(("127.0.0.1", 0))
+
+    def accept():
+        while True:
+            try:
+                conn, _ = server.accept()
+            except OSError:
+                return
+            with conn, conn.makefile("rb") as f:
+                received.put(json.loads(f.readline()))
+
+    threading.Thread(target=accept, daemon=True).start()
+    yield f"127.0.0.1:{server.getsockname()[1]}", received
+    server.close()
+
+
+class BlockedSink:
+    """一直发送不完的目标"""
+
+    name = "blocked"
+
+    def __init__(self):
+        self.release = threading.Event()
+
+    def send(self, event):
+        self.release.wait()
+
+
+def counter(metrics, name, **labels):
+    return sum(entry["value"] for entry in metrics.snapshot()["counters"]
+               if entry["name"] == name and all(entry.get(key) == value for key, value in labels.items()))
+
+
+def test_webhook_and_socket_receive_event(webhook, receiver):
+    url, webhook_received = webhook
+    address, socket_received = receiver
+    metrics = Metrics()
+    notifier = Notifier([(WebhookSink(url), 0), (SocketSink(address), 0)], metrics, on_status=lambda msg: None)
+    try:
+        notifier.notify(build_event("work", EMAILS, "http://127.0.0.1:9101/ack"))
+        for received in (webhook_received, socket_received):
+            event = received.get(timeout=5)
+            assert event["account"] == "work" and event["count"] == 1
+            assert event["emails"][0]["subject"] == "周报"
+            assert event["ack_url"] == "http://127.0.0.1:9101/ack"
+    finally:
+        notifier.close()
+    assert counter(metrics, "mail_notify_sent_total") == 2
+
+
+def test_blocked_sink_does_not_delay_others(webhook):
+    url, received = webhook
+    blocked = BlockedSink()
+    metrics = Metrics()
+    notifier = Notifier([(blocked, 0), (WebhookSink(url), 0)], metrics, on_status=lambda msg: None, queue_size=2)
+    try:
+        for _ in range(10):
+            start = time.perf_counter()
+            notifier.notify(build_event("work", EMAILS))
+            # 队列满时直接丢弃，不等待
+            assert time.perf_counter() - start < 0.1
+            received.get(timeout=5)
+        assert counter(metrics, "mail_notify_dropped_total", sink="blocked") >= 7
+        assert counter(metrics, "mail_notify_dropped_total", sink=WebhookSink(url).name) == 0
+    finally:
+        blocked.release.set()
+        notifier.close()
+
+
+def test_ack_rejects_browser_requests():
+    acks = []
+    server = MetricsServer(Metrics(), 0, actions={"/ack": lambda params: (acks.append(params), (200, {"ok": True}))[1]})
+    server.start()
+    url = f"http://127.0.0.1:{server.port}/ack"
+    try:
+        request = urllib.request.Request(url, data=b"", method="POST", headers={"Origin": "http://evil.example"})
+        with pytest.raises(urllib.error.HTTPError) as error:
+            urllib.request.urlopen(request, timeout=5)
+        assert error.value.code == 403
+        assert acks == []
+
+        with urllib.request.urlopen(urllib.request.Request(url, data=b"", method="POST"), timeout=5) as response:
+            assert response.status == 200
+        assert acks == [{}]
+    finally:
+        server.stop()
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+"""离线回放：小的mbox存档按三种模式回放，检查写入已处理记录和提醒历史的内容"""
+
+import json
+import mailbox
+from email.message import EmailMessage
+
+import pytest
+
+import mail_replay
+from mail_history import HistoryStore
+from mail_store import ProcessedStore
+
+
+def write_mbox(path, count, start=0):
+    box = mailbox.mbox(str(path))
+    for uid in range(start, start + count):
+        msg = EmailMessage()
+        msg["From"] = f"sender{uid}@example.com"
+        msg["Subject"] = f"存档邮件 {uid}"
+        msg["Date"] = "Mon, 12 Oct 2026 09:00:00 +0800"
+        msg["Message-ID"] = f"<{uid}@example.com>"
+        msg.set_content(f"正文 {uid}")
+        box.add(msg)
+    box.flush()
+    box.close()
+    return str(path)
+
+
+def replay(capsys, *args):
+    assert mail_replay.main(list(args) + ["--json"]) == 0
+    return json.loads(capsys.readouterr().out)
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+
+def processed_count():
+    store = ProcessedStore("processed_emails.db")
+    try:
+        return len(store)
+    finally:
+        store.close()
+
+
+def test_seed_then_alert_skips_seeded_mail(workdir, capsys):
+    archive = write_mbox(workdir / "old.mbox", 5)
+    stats = replay(capsys, archive, "--dry-run")
+    assert (stats["messages"], stats["new"]) == (5, 5)
+    # 只统计，不写入记录
+    assert processed_count() == 0
+
+    stats = replay(capsys, archive, "--seed")
+    assert (stats["messages"], stats["new"]) == (5, 5)
+    assert processed_count() == 5
+
+    newer = write_mbox(workdir / "new.mbox", 4, start=3)
+    stats = replay(capsys, archive, newer, "--batch", "2")
+    # 前5封已写入记录，新存档中只有2封是新邮件
+    assert (stats["messages"], stats["duplicates"], stats["new"]) == (9, 7, 2)
+    assert stats["actions"] == {"loop": 2}
+    assert processed_count() == 7
+
+    history = HistoryStore("mail_history.db")
+    try:
+        rows = history.search(keyword="存档邮件")
+    finally:
+        history.close()
+    assert sorted(row["subject"] for row in rows) == ["存档邮件 5", "存档邮件 6"]
+    assert all(row["acked_at"] is not None for row in rows)
+
+
+def test_replay_refused_while_instance_running(workdir):
+    from mail_instance import SingleInstance
+    archive = write_mbox(workdir / "old.mbox", 1)
+    with SingleInstance() as acquired:
+        assert acquired
+        assert mail_replay.main([archive, "--seed"]) == 1
@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+"""提醒规则：主题正则的预筛文字不能漏掉本该命中的邮件"""
+
+import re
+
+import pytest
+
+from alert_rules import RuleSet, required_literal
+
+# (主题正则, 能匹配的主题)
+CASES = [
+    (r"\[ALERT\] 故障", "[ALERT] 故障"),
+    ("告警{1,3}xyz", "告警警xyz"),
+    ("ab{2}cd", "abbcd"),
+    ("ab{0,2}cd", "acd"),
+    (r"\x41BC", "ABC"),
+    (r"\x41BCD", "ABCD"),
+    (r"\u544a警报", "告警报"),
+    (r"\U0000544a警报", "告警报"),
+    (r"\N{LATIN SMALL LETTER A}bc", "abc"),
+    (r"订单\d+号", "订单12号"),
+    (r"\bfoo\b bar", "foo bar"),
+    (r"(ab)\1cd", "ababcd"),
+    (r"\0123", "\n3"),
+    ("(?x) a b", "ab"),
+    ("abc(?-i:D)ef", "abcDef"),
+]
+
+
+def test_required_literal_skips_inline_flags():
+    assert required_literal(r"\[ALERT\] 故障") == "[alert] 故障"
+    assert required_literal("(?x) a b") is None
+    assert required_literal("(?i)hello") is None
+    assert required_literal("abc(?-i:D)ef") is None
+    assert required_literal("(?:foo)bar") == "bar"
+
+
+def test_verbose_subject_rule_matches():
+    rules = RuleSet([{"name": "告警", "subject": ["(?x) a b"], "action": "once"}])
+    emails = [{'key': "mid:1@example.com", 'account': "work", 'from': "ops@example.com", 'subject': "ab"}]
+    groups = rules.route(emails, "loop")
+    assert groups == {"once": emails}
+    assert emails[0]['rule'] == "告警"
+
+
+@pytest.mark.parametrize("pattern, subject", CASES)
+def test_prefilter_hint_never_rejects_a_match(pattern, subject):
+    assert re.search(pattern, subject, re.IGNORECASE)
+    hint = required_literal(pattern)
+    assert hint is None or hint in subject.casefold()
+    rules = RuleSet([{"name": "规则", "subject": [pattern]}])
+    assert rules.match({'from': "ops@example.com", 'subject': subject}) is not None
+
+
+def test_required_literal_skips_quantifiers_and_escapes():
+    assert required_literal("告警{1,3}xyz") == "xyz"
+    assert required_literal(r"\x41BCD") == "bcd"
+    assert required_literal(r"\u544a警报") == "警报"
+    assert required_literal(r"订单\d+号") == "订单"
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+"""轮询调度：间隔随新邮件缩短和放大、时段活跃度、按错误类型退避，时间和抖动都可注入"""
+
+import random
+import time
+
+import pytest
+
+from mail_scheduler import BACKOFF, DAILY_DECAY, GROWTH, JITTER, PollScheduler
+
+# 某天本地时间的0点，各小时的时间戳由它推算
+MIDNIGHT = time.mktime((2026, 10, 12, 0, 0, 0, 0, 0, -1))
+
+
+class FakeClock:
+    def __init__(self, now=MIDNIGHT + 10 * 3600):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def make_scheduler(interval=60, clock=None, **kwargs):
+    return PollScheduler(interval, rng=random.Random(1), clock=clock or FakeClock(), **kwargs)
+
+
+def test_interval_halves_on_new_mail_and_grows_when_idle():
+    scheduler = make_scheduler(60)
+    scheduler.record_success(3)
+    assert scheduler.interval == 30
+    scheduler.record_success(0)
+    assert scheduler.interval == pytest.approx(30 * GROWTH)
+
+
+def test_interval_clamped_to_min_and_max():
+    scheduler = make_scheduler(60)
+    assert (scheduler.min_interval, scheduler.max_interval) == (20, 240)
+    for _ in range(10):
+        scheduler.record_success(1)
+    assert scheduler.interval == 20
+    for _ in range(50):
+        scheduler.record_success(0)
+    assert scheduler.interval == 240
+    # 很短的间隔也不低于下限
+    assert make_scheduler(6).min_interval == 5
+
+
+def test_jitter_stays_within_bounds():
+    scheduler = make_scheduler(60)
+    delays = [scheduler.next_delay() for _ in range(200)]
+    assert min(delays) >= 60 * (1 - JITTER) and max(delays) <= 60 * (1 + JITTER)
+    assert make_scheduler(60).next_delay() == make_scheduler(60).next_delay()
+
+
+def test_hour_factor_follows_activity_and_decays():
+    clock = FakeClock(MIDNIGHT + 10 * 3600)
+    scheduler = make_scheduler(60, clock=clock)
+    # 样本太少时不调整
+    scheduler.record_success(5)
+    assert scheduler.hour_factor() == 1.0
+    scheduler.record_success(20)
+    clock.now = MIDNIGHT + 22 * 3600
+    scheduler.record_success(5)
+    # 22点占全天的1/6，是平均值的4倍，间隔减半(下限0.5)
+    assert scheduler.hour_factor() == 0.5
+    clock.now = MIDNIGHT + 3 * 3600
+    # 没有邮件的时段间隔加倍
+    assert scheduler.hour_factor() == 2.0
+
+    before, day = list(scheduler.hourly), scheduler.day
+    clock.now = MIDNIGHT + 22 * 3600 + 3 * 86400
+    scheduler.record_success(0)
+    assert scheduler.day == day + 3
+    assert scheduler.hourly == pytest.approx([count * DAILY_DECAY ** 3 for count in before])
+
+
+def test_backoff_doubles_up_to_cap_per_kind():
+    scheduler = make_scheduler(60)
+    initial, cap = BACKOFF["network"]
+    delays = []
+    for _ in range(10):
+        scheduler.record_failure("network")
+        delays.append(scheduler.backoff_delay())
+    assert delays[:3] == [initial, initial * 2, initial * 4]
+    assert delays[-1] == cap
+
+    scheduler = make_scheduler(60)
+    initial, cap = BACKOFF["auth"]
+    for _ in range(20):
+        delay = scheduler.record_failure("auth")
+        # 抖动只在后半段
+        assert scheduler.backoff_delay() / 2 <= delay <= scheduler.backoff_delay()
+    assert scheduler.backoff_delay() == cap
+
+    # 成功后恢复正常轮询
+    scheduler.record_success(0)
+    assert scheduler.failures == 0 and "轮询间隔" in scheduler.cadence()
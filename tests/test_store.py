@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+"""已处理记录：多个写入者共用一个数据库时保存的Bloom过滤器不能漏掉记录"""
+
+from mail_store import ProcessedStore
+
+
+def test_second_writer_records_survive_close(tmp_path):
+    path = str(tmp_path / "processed_emails.db")
+    first = ProcessedStore(path)
+    second = ProcessedStore(path)
+    second.add("mid:x@example.com")
+    second.close()
+    first.add("mid:y@example.com")
+    # 后关闭的实例保存的过滤器必须包含另一个实例写入的记录
+    first.close()
+
+    store = ProcessedStore(path)
+    try:
+        assert len(store) == 2
+        assert "mid:x@example.com" in store
+        assert "mid:y@example.com" in store
+        assert "mid:z@example.com" not in store
+    finally:
+        store.close()
+
+
+def test_unlimited_retention(tmp_path):
+    store = ProcessedStore(str(tmp_path / "processed_emails.db"), max_records=0, max_age_days=0)
+    try:
+        store.add_many([f"mid:{uid}@example.com" for uid in range(1000)], processed_at=0)
+        store.prune()
+        assert len(store) == 1000
+    finally:
+        store.close()
@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+"""分片分配：一致性哈希的稳定性，增减账号或工作进程只移动受影响的账号，修改配置只重启对应分片"""
+
+from mail_engine import ACCOUNT_DEFAULTS, account_id
+from mail_supervisor import HashRing, assign_accounts, changed_shards
+
+
+def make_account(index, **settings):
+    return dict(ACCOUNT_DEFAULTS, name=f"user{index}", email=f"user{index}@example.com", **settings)
+
+
+def owners(ring, accounts):
+    return {account_id(account): ring.node_for(account_id(account)) for account in accounts}
+
+
+def test_assignment_is_stable_and_balanced():
+    accounts = [make_account(index) for index in range(1000)]
+    first = owners(HashRing(range(4)), accounts)
+    assert first == owners(HashRing(range(4)), accounts)
+    counts = [list(first.values()).count(shard) for shard in range(4)]
+    # 100个虚拟节点时各分片与平均值的偏差不大
+    assert min(counts) > 150 and max(counts) < 350
+
+
+def test_adding_worker_moves_only_its_share():
+    accounts = [make_account(index) for index in range(1000)]
+    before = owners(HashRing(range(4)), accounts)
+    after = owners(HashRing(range(5)), accounts)
+    moved = [key for key in before if before[key] != after[key]]
+    # 只有分到新工作进程的账号移动，约1/5
+    assert all(after[key] == 4 for key in moved)
+    assert 100 < len(moved) < 300
+
+
+def test_account_changes_restart_only_affected_shards():
+    ring = HashRing(range(4))
+    accounts = [make_account(index) for index in range(20)]
+    current = assign_accounts(ring, range(4), accounts)
+    assert changed_shards(current, assign_accounts(ring, range(4), accounts)) == set()
+
+    added = make_account(99)
+    assert changed_shards(current, assign_accounts(ring, range(4), accounts + [added])) == {
+        ring.node_for(account_id(added))}
+
+    removed = accounts[3]
+    assert changed_shards(current, assign_accounts(ring, range(4), accounts[:3] + accounts[4:])) == {
+        ring.node_for(account_id(removed))}
+
+    # 修改一个账号的设置(不改变account_id)只重启它所在的分片
+    edited = accounts[:5] + [dict(accounts[5], check_interval=120)] + accounts[6:]
+    assert changed_shards(current, assign_accounts(ring, range(4), edited)) == {
+        ring.node_for(account_id(accounts[5]))}